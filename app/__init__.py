@@ -1,11 +1,55 @@
 from flask import Flask, send_from_directory
 from .routes import main
 from .errors import register_error_handlers
+from enchantplanner import stats
+from enchantplanner.calculator import (configure_caches, configure_heuristic, configure_parallel, configure_store,
+                                      configure_vectorized, load_plan_table, DEFAULT_PLAN_TABLE)
 
 
 def create_app():
     app = Flask(__name__, instance_relative_config=False)
-    app.config.from_mapping(SECRET_KEY="dev-key")
+    app.config.from_mapping(
+        SECRET_KEY="dev-key",
+        PLAN_CACHE_ENTRIES=4096,
+        SUBPROBLEM_CACHE_ENTRIES=200_000,
+        SUBPROBLEM_CACHE_WEIGHT=2_000_000,
+        PLAN_TABLE_PATH=DEFAULT_PLAN_TABLE,
+        # SQLite file on local disk where workers share finished plans; None keeps
+        # plans per worker (as on serverless hosts without a shared disk)
+        PLAN_STORE_PATH=None,
+        PLAN_STORE_ENTRIES=100_000,
+        # processes per worker for very large searches; 0 keeps them in-request
+        PLANNER_PROCESSES=0,
+        # score large search layers with NumPy (an optional dependency)
+        PLANNER_VECTORIZED=False,
+        # partial plans kept per merge by engine=heuristic; wider is better and slower
+        PLANNER_BEAM_WIDTH=8,
+        BATCH_MAX_REQUESTS=1000,
+        # seconds a plan may search before the best plan so far is returned
+        # (requests may ask for less with time_budget); None means no limit
+        PLAN_TIME_BUDGET=10.0,
+        # seconds browsers and the CDN may keep GET /api/plan responses; their
+        # URLs carry the data version, so a data change never serves stale plans
+        PLAN_CACHE_MAX_AGE=31_536_000,
+        # planner counters and timers, exported at /metrics
+        PLANNER_STATS=True,
+        # allow POST /calculate?profile=1 to return a cProfile breakdown
+        PLANNER_PROFILING=False,
+    )
+
+    # planner caches live for the whole worker, so bound them up front
+    configure_caches(
+        plan_entries=app.config["PLAN_CACHE_ENTRIES"],
+        subproblem_entries=app.config["SUBPROBLEM_CACHE_ENTRIES"],
+        subproblem_weight=app.config["SUBPROBLEM_CACHE_WEIGHT"],
+    )
+    # common "max everything" plans, built offline by enchantplanner.precompute
+    load_plan_table(app.config["PLAN_TABLE_PATH"])
+    configure_store(app.config["PLAN_STORE_PATH"], max_entries=app.config["PLAN_STORE_ENTRIES"])
+    configure_parallel(app.config["PLANNER_PROCESSES"])
+    configure_vectorized(app.config["PLANNER_VECTORIZED"])
+    configure_heuristic(app.config["PLANNER_BEAM_WIDTH"])
+    stats.enable(app.config["PLANNER_STATS"])
 
     # register blueprint
     app.register_blueprint(main)
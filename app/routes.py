@@ -1,40 +1,64 @@
+import cProfile
+import hashlib
+import io
 import os
+import json
+import pstats
+import threading
+from contextlib import nullcontext
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_from_directory, \
-    make_response
+    make_response, Response, stream_with_context, jsonify
 from datetime import datetime
 
 from enchantplanner.data import ENCHANTMENTS
-from enchantplanner.utils import pretty_name
-from enchantplanner.models import EnchantedItem
-from enchantplanner.calculator import plan_enchants
+from enchantplanner.catalog import CATALOG
+from enchantplanner.utils import pretty_name, data_version
+from enchantplanner.models import EnchantedItem, PlannerOptions
+from enchantplanner import stats
+from enchantplanner.calculator import plan_enchants, plan_incremental, plan_front, cache_stats, NOT_PROVEN_OPTIMAL
+from enchantplanner.batch import PlanRequest, plan_many, parse_uses, PLAN_ERRORS
+from enchantplanner.inventory import plan_inventory
 from enchantplanner.exceptions import IncompatibleSelected, MergeTooExpensive
 
 main = Blueprint("main", __name__)
 
 # All the item types (minus "book"), and sorted list of (ns,meta) pairs
-ITEM_TYPES = sorted(
-    {it for meta in ENCHANTMENTS.values() for it in meta["items"] if it != "book"}
-)
+ITEM_TYPES = list(CATALOG.item_types)
 ALL_ENCHANTS = sorted(ENCHANTMENTS.items())
+PRETTY_NAMES = {ns: pretty_name(ns) for ns in CATALOG.names}
+
+
+def time_budget() -> float | None:
+    """Seconds the planner may spend: the request's ``time_budget``, capped by ``PLAN_TIME_BUDGET``."""
+    limit = current_app.config["PLAN_TIME_BUDGET"]
+    raw = request.values.get("time_budget")
+    if not raw:
+        return limit
+    budget = float(raw)
+    if not budget >= 0:
+        raise ValueError(f"Invalid time budget {raw!r}")
+    return budget if limit is None else min(budget, limit)
 
 
 def parse_enchants(prefix: str):
+    lead = f"{prefix}-"
     out: dict[str, int] = {}
-    for ns, _ in ALL_ENCHANTS:
-        raw = request.form.get(f"{prefix}-{ns}")
-        if raw and int(raw) > 0:
+    for key, raw in request.form.items():
+        ns = key[len(lead):]
+        if key.startswith(lead) and ns in CATALOG.ids and raw and int(raw) > 0:
             out[ns] = int(raw)
-    return out
+    # in name order, as the form lists them
+    return dict(sorted(out.items()))
 
 
 @main.route("/")
 def index():
-    pretty_names = {ns: pretty_name(ns) for ns in ENCHANTMENTS}
     return render_template(
         "index.html",
         items=ITEM_TYPES,
         enchants=ALL_ENCHANTS,
-        pretty_names=pretty_names
+        pretty_names=PRETTY_NAMES,
+        data_version=data_version()
     )
 
 
@@ -50,9 +74,30 @@ def ads_txt():
 
 @main.route("/calculate", methods=["POST"])
 def calculate():
+    # ?profile=1 swaps the page for a cProfile breakdown of this request
+    if request.args.get("profile") == "1" and current_app.config["PLANNER_PROFILING"]:
+        profiler = cProfile.Profile()
+        with stats.collect() as st:
+            profiler.runcall(_calculate)
+        out = io.StringIO()
+        out.write(json.dumps(st.to_dict(), indent=1) + "\n\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(60)
+        return Response(out.getvalue(), mimetype="text/plain")
+    with stats.collect() if stats.enabled() else nullcontext():
+        return _calculate()
+
+
+def _render(template: str, **context):
+    st = stats.current()
+    if st is None:
+        return render_template(template, **context)
+    with st.timer("render"):
+        return render_template(template, **context)
+
+
+def _calculate():
     allow = request.form.get("allow_incompat") in ("true", "on", "1")
-    from enchantplanner import models
-    models.ALLOW_INCOMPAT = allow
+    options = PlannerOptions(allow_incompatible=allow)
 
     try:
         item_type = request.form.get("item_type")
@@ -67,18 +112,198 @@ def calculate():
             return redirect(url_for("main.index"))
 
         mode = request.form.get("mode", "levels")
-        prior_work = int(request.form.get("prior_work", 0))
+        engine = request.form.get("engine", "dp")
+        prior_work = parse_uses(request.form.get("prior_work", "0"))
 
         base_item = EnchantedItem.from_state(
-            item_type, current, anvil_uses=prior_work
+            item_type, current, anvil_uses=prior_work, options=options
         )
-        plan = plan_enchants(base_item, desired, mode=mode)
+        if mode == "pareto":
+            plans = plan_front(base_item, desired, options=options, time_budget=time_budget())
+            return _render("front.html", plans=plans)
+        token = request.form.get("plan_token")
+        if token is None:
+            # a plain form post never comes back with a token, so nothing is pinned for it
+            plan = plan_enchants(base_item, desired, mode=mode, options=options,
+                                 time_budget=time_budget(), engine=engine)
+            return _render("result.html", plan=plan)
+        # the token (empty to start a session) keeps this page's solved sub-problems for its
+        # next recalculation
+        plan, token = plan_incremental(base_item, desired, token or None, mode=mode,
+                                       options=options, time_budget=time_budget(), engine=engine)
 
-        return render_template("result.html", plan=plan)
+        return _render("result.html", plan=plan), {"X-Plan-Token": token}
 
     except (ValueError, IncompatibleSelected, MergeTooExpensive, RuntimeError) as e:
         return str(e), 400
 
+@main.route("/api/plan", methods=["GET"])
+def plan_json():
+    """
+    One plan as JSON, cacheable by browsers and the CDN.
+
+    The URL is ``PlanRequest.to_query()`` plus ``v``, the enchant data
+    version; any other spelling of the same request (parameter order, enchant
+    order, an old ``v``) redirects there.  An exact plan only changes with
+    the data, and a data change changes the URL, so its response is cached
+    as immutable for ``PLAN_CACHE_MAX_AGE``.  A heuristic plan also depends
+    on the server's beam width, so caches revalidate it.  The strong ETag is
+    a hash of the body.
+    ``mode=pareto`` returns ``{"plans": [...]}``, the others ``{"plan": {...}}``.
+    Plans cut short by the time budget are not cached.
+
+    A client that edits and recalculates sends ``X-Plan-Token`` (empty to
+    start) to plan through a ``plan_incremental`` session and gets the token
+    back in the same header; those responses are cached by the browser only.
+    """
+    try:
+        req = PlanRequest.from_query(request.args)
+    except KeyError as e:
+        return {"error": f"Malformed request: missing {e.args[0]!r}"}, 400
+    except PLAN_ERRORS as e:
+        return {"error": str(e)}, 400
+    canonical = f"{req.to_query()}&v={data_version()}"
+    if request.query_string.decode() != canonical:
+        response = redirect(f"{url_for('main.plan_json')}?{canonical}")
+        # the target moves whenever the data version does
+        response.cache_control.public = True
+        response.cache_control.max_age = 300
+        return response
+
+    token = request.headers.get("X-Plan-Token")
+    session = token is not None and req.mode != "pareto"
+    try:
+        with stats.collect() if stats.enabled() else nullcontext():
+            if req.mode == "pareto":
+                plans = plan_front(req.base, req.desired, options=req.options,
+                                   time_budget=current_app.config["PLAN_TIME_BUDGET"])
+            elif session:
+                plan, token = plan_incremental(req.base, req.desired, token or None, mode=req.mode,
+                                               options=req.options, engine=req.engine,
+                                               time_budget=current_app.config["PLAN_TIME_BUDGET"])
+                plans = [plan]
+            else:
+                plans = [plan_enchants(req.base, req.desired, mode=req.mode, options=req.options,
+                                       time_budget=current_app.config["PLAN_TIME_BUDGET"],
+                                       engine=req.engine)]
+    except PLAN_ERRORS as e:
+        return {"error": str(e)}, 400
+    # stats differ per run; keep the body a function of the plan
+    bodies = [{k: v for k, v in plan.to_dict().items() if k != "stats"} for plan in plans]
+    response = jsonify({"plans": bodies} if req.mode == "pareto" else {"plan": bodies[0]})
+    if session:
+        response.vary.add("X-Plan-Token")
+        response.headers["X-Plan-Token"] = token
+    if any(NOT_PROVEN_OPTIMAL in plan.warnings for plan in plans):
+        response.cache_control.no_store = True
+        return response
+    max_age = current_app.config["PLAN_CACHE_MAX_AGE"]
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest()[:32])
+    if session:
+        # the token is this client's own
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    if req.engine == "heuristic":
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+        if not session:
+            response.cache_control.s_maxage = max_age
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@main.route("/api/plan/batch", methods=["POST"])
+def plan_batch():
+    """
+    Plan a list of targets, streamed back as NDJSON in completion order.
+
+    Body: ``{"requests": [{"item_type", "current", "prior_work", "desired", "mode"}, ...]}``.
+    Each line is ``{"index": i, "plan": {...}}`` or ``{"index": i, "error": "..."}``.
+    Every target gets the request's time budget; a client that goes away
+    cancels the rest of the batch.
+    """
+    try:
+        budget = time_budget()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return {"error": "Malformed request: expected a JSON object."}, 400
+    items = body.get("requests")
+    if not isinstance(items, list) or not items:
+        return {"error": "Expected a non-empty 'requests' list."}, 400
+    if len(items) > current_app.config["BATCH_MAX_REQUESTS"]:
+        return {"error": f"At most {current_app.config['BATCH_MAX_REQUESTS']} requests per batch."}, 400
+
+    parsed: dict[int, PlanRequest] = {}
+    errors: dict[int, str] = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = PlanRequest.from_dict(item)
+        except (KeyError, TypeError, AttributeError) as e:
+            errors[i] = f"Malformed request: {e}"
+        except PLAN_ERRORS as e:
+            errors[i] = str(e)
+    order = list(parsed)
+    cancel = threading.Event()
+
+    def generate():
+        try:
+            for i, msg in errors.items():
+                yield json.dumps({"index": i, "error": msg}) + "\n"
+            for j, result in plan_many(parsed.values(), parallel=True, time_budget=budget, cancel=cancel):
+                line = {"index": order[j]}
+                if isinstance(result, Exception):
+                    line["error"] = str(result)
+                else:
+                    line["plan"] = result.to_dict()
+                yield json.dumps(line) + "\n"
+        finally:
+            # the response was closed early or fully sent; either way stop planning
+            cancel.set()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@main.route("/api/plan/inventory", methods=["POST"])
+def plan_from_inventory():
+    """
+    Plan a target using only the books and items the player owns.
+
+    Body: one batch request plus ``"inventory": [{"type", "enchants", "uses"}, ...]``.
+    Returns ``{"plan": {...}, "unused": [...]}``, the inventory items the plan leaves out.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        req = PlanRequest.from_dict(body)
+        inventory = [
+            EnchantedItem.from_state(it["type"], {ns: int(lv) for ns, lv in (it.get("enchants") or {}).items()},
+                                     anvil_uses=parse_uses(it.get("uses", 0)), options=req.options)
+            for it in body.get("inventory") or []
+        ]
+    except (KeyError, TypeError, AttributeError) as e:
+        return {"error": f"Malformed request: {e}"}, 400
+    except PLAN_ERRORS as e:
+        return {"error": str(e)}, 400
+    if not inventory:
+        return {"error": "Expected a non-empty 'inventory' list."}, 400
+    try:
+        with stats.collect() if stats.enabled() else nullcontext():
+            plan, unused = plan_inventory(req.base, req.desired, inventory, mode=req.mode, options=req.options,
+                                          time_budget=time_budget())
+    except PLAN_ERRORS as e:
+        return {"error": str(e)}, 400
+    return {"plan": plan.to_dict(), "unused": [it.to_dict() for it in unused]}
+
+
+@main.route("/metrics")
+def metrics():
+    """Planner counters, timers and cache sizes for this worker, in the Prometheus text format."""
+    return Response(stats.render_prometheus(cache_stats()), mimetype="text/plain; version=0.0.4")
+
+
 @main.route('/sitemap.xml', methods=['GET'])
 def sitemap():
     pages = [
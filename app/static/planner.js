@@ -3,11 +3,17 @@ const NAMES = window.NAMES;
 const CURRENT_LV = Object.create(null);
 
 let allowIncompat = false;
+// plan_incremental session of this page; empty until the server opens one
+let planToken = '';
 
 function prettify(ns) {
     return NAMES[ns] || ns;
 }
 
+function levelMax(ns) {
+    return ENCHANTS.find(([n]) => n === ns)[1].levelMax;
+}
+
 const form = document.getElementById('planner-form');
 const itemSel = document.getElementById('item-select');
 const dyn = document.getElementById('dynamic-area');
@@ -309,18 +315,113 @@ function refreshPanels() {
     updateCalcButton();
 }
 
+// the canonical GET /api/plan query (PlanRequest.to_query plus the data
+// version), so repeat requests hit the browser or CDN cache without a redirect
+function planQuery(data) {
+    const list = prefix => [...data.entries()]
+        .filter(([k, v]) => k.startsWith(prefix) && +v > 0)
+        .map(([k, v]) => [k.slice(prefix.length), +v])
+        .sort(([a], [b]) => a < b ? -1 : 1)
+        .map(([ns, lv]) => `${ns}:${lv}`)
+        .join(',');
+    return [
+        ['item_type', data.get('item_type')],
+        ['current', list('cur-')],
+        ['prior_work', +(data.get('prior_work') || 0)],
+        ['desired', list('des-')],
+        ['mode', data.get('mode') || 'levels'],
+        ['allow_incompat', ['true', 'on', '1'].includes(data.get('allow_incompat')) ? 1 : 0],
+        ['v', window.DATA_VERSION],
+    ].map(([k, v]) => `${k}=${v}`).join('&');
+}
+
+// EnchantedItem.pretty()
+function prettyItem(it) {
+    const ench = Object.entries(it.enchants)
+        .sort(([a], [b]) => a < b ? -1 : 1)
+        .map(([ns, lv]) => prettify(ns) + (levelMax(ns) > 1 ? ` ${lv}` : ''))
+        .join(', ');
+    const type = it.type.charAt(0).toUpperCase() + it.type.slice(1);
+    const core = ench ? `${type} (${ench})` : type;
+    return it.type === 'book' ? core : `${core} (Prior-work penalty = ${it.uses})`;
+}
+
+function renderPlan(plan) {
+    const steps = plan.steps.map((s, i) => `
+        <li class="relative pl-10">
+            <span class="absolute left-0 top-1/2 -translate-y-1/2 rounded-full bg-brand px-3 py-1 text-sm font-bold text-white shadow">${i + 1}</span>
+            <article class="rounded-lg border border-slate-700 bg-slate-800/70 p-4 shadow-card transition hover:bg-slate-700/60">
+                <p class="font-semibold leading-snug">
+                    Combine ${prettyItem(s.left)} <span class="text-brand">+</span> ${prettyItem(s.right)}
+                </p>
+                <p class="mt-1 text-sm text-slate-300">
+                    Cost: <span class="font-semibold text-white">${s.levels} levels</span>
+                    (<span class="text-brand">${s.xp}xp</span>) · Resulting prior‑work penalty = ${s.prior}
+                </p>
+            </article>
+        </li>`).join('');
+    const warnings = plan.warnings.map(w => `<p class="mt-1 text-sm text-slate-300">${w}</p>`).join('');
+    const gap = plan.gap == null ? '' : `
+                <p class="mt-1 text-sm">At most ${(plan.gap * 100).toFixed(1)}% above optimal
+                    (no plan costs under ${plan.lower_bound} levels)</p>`;
+    return `
+        <h2 class="mb-8 text-center text-2xl font-extrabold tracking-tight text-brand">Optimal Anvil Sequence</h2>
+        <ol class="flex flex-col gap-6">${steps}</ol>
+        <div class="ml-10">
+            <section class="mt-10 w-max rounded-lg border border-brand/40 bg-brand/10 p-5 text-slate-200 shadow-card">
+                <h3 class="mb-2 text-lg font-bold text-brand-light">Totals</h3>
+                <p class="text-xl font-extrabold">
+                    ${plan.total_levels} levels <span class="text-brand text-base font-semibold">(${plan.total_xp} xp)</span>
+                </p>
+                <p class="mt-1 text-sm">Final prior‑work penalty: <span class="font-medium">${plan.final_prior_work}</span></p>${gap}
+                ${warnings}
+            </section>
+        </div>`;
+}
+
+function renderFront(plans) {
+    const items = plans.map((plan, i) => `
+        <li class="relative pl-10">
+            <span class="absolute left-0 top-1/2 -translate-y-1/2 rounded-full bg-brand px-3 py-1 text-sm font-bold text-white shadow">${i + 1}</span>
+            <details class="rounded-lg border border-slate-700 bg-slate-800/70 p-4 shadow-card transition hover:bg-slate-700/60">
+                <summary class="cursor-pointer font-semibold leading-snug">
+                    ${plan.total_levels} levels (<span class="text-brand">${plan.total_xp}xp</span>) · Final
+                    prior‑work penalty = ${plan.final_prior_work}
+                </summary>
+                ${plan.steps.map((s, j) => `
+                <p class="mt-1 text-sm text-slate-300">
+                    ${j + 1}) Combine ${prettyItem(s.left)} <span class="text-brand">+</span> ${prettyItem(s.right)}
+                    · <span class="font-semibold text-white">${s.levels} levels</span>
+                    (<span class="text-brand">${s.xp}xp</span>) · prior‑work penalty = ${s.prior}
+                </p>`).join('')}
+                ${plan.warnings.map(w => `<p class="mt-1 text-sm text-slate-300">${w}</p>`).join('')}
+            </details>
+        </li>`).join('');
+    return `
+        <h2 class="mb-8 text-center text-2xl font-extrabold tracking-tight text-brand">All Optimal Trade-offs</h2>
+        <ol class="flex flex-col gap-6">${items}</ol>`;
+}
+
 form.addEventListener('submit', e => {
     e.preventDefault();
-    fetch(form.action, {
-        method: 'POST',
-        body: new FormData(form)
-    }).then(r => r.redirected
-        ? window.location = r.url
-        : r.text()
-    ).then(html => {
-        if (!html) return;
-        resBlk.innerHTML = html;
+    const show = () => {
         resBlk.style.display = 'block';
         resBlk.scrollIntoView({behavior: 'smooth'});
-    });
+    };
+    // the session token lets the server reuse this page's solved sub-problems on each edit
+    fetch(`${window.PLAN_URL}?${planQuery(new FormData(form))}`, {headers: {'X-Plan-Token': planToken}})
+        .then(r => {
+            planToken = r.headers.get('X-Plan-Token') || planToken;
+            // a server error page is not JSON; report its status instead of failing silently
+            return r.json().catch(() => ({error: `The planner failed (HTTP ${r.status}). Please try again.`}));
+        })
+        .then(body => {
+            if (body.error) resBlk.textContent = body.error;
+            else resBlk.innerHTML = body.plans ? renderFront(body.plans) : renderPlan(body.plan);
+            show();
+        })
+        .catch(() => {
+            resBlk.textContent = 'Could not reach the planner. Please try again.';
+            show();
+        });
 });
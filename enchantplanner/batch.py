@@ -0,0 +1,173 @@
+"""
+Planning many targets in one call.
+"""
+import threading
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Mapping, Tuple
+from urllib.parse import urlencode
+
+from . import calculator
+from .calculator import plan_enchants, plan_key
+from .catalog import CATALOG
+from .exceptions import IncompatibleSelected, MergeTooExpensive, PlanCancelled
+from .models import EnchantedItem, MergePlan, PlannerOptions, DEFAULT_OPTIONS
+
+# what a single target can fail with; anything else is a bug and propagates
+PLAN_ERRORS = (ValueError, IncompatibleSelected, MergeTooExpensive, RuntimeError)
+
+
+@dataclass
+class PlanRequest:
+    base: EnchantedItem
+    desired: Dict[str, int] = field(default_factory=dict)
+    mode: str = "levels"
+    options: PlannerOptions = DEFAULT_OPTIONS
+    engine: str = "dp"
+
+    @staticmethod
+    def from_dict(data: dict) -> "PlanRequest":
+        """
+        Build from the JSON shape ``{item_type, current, prior_work, desired,
+        mode, allow_incompat, engine}``.
+        """
+        options = PlannerOptions(allow_incompatible=parse_flag(data.get("allow_incompat", False)))
+        base = EnchantedItem.from_state(
+            data["item_type"],
+            {ns: int(lv) for ns, lv in (data.get("current") or {}).items()},
+            anvil_uses=parse_uses(data.get("prior_work", 0)),
+            options=options,
+        )
+        desired = {ns: int(lv) for ns, lv in (data.get("desired") or {}).items()}
+        unknown = sorted(ns for ns in desired if ns not in CATALOG.ids)
+        if unknown:
+            raise ValueError(f"Unknown enchantments: {unknown}")
+        engine = data.get("engine", "dp")
+        if engine not in calculator.ENGINES:
+            raise ValueError(f"Unknown engine '{engine}'")
+        return PlanRequest(base, desired, data.get("mode", "levels"), options, engine)
+
+    @staticmethod
+    def from_query(args: Mapping[str, str]) -> "PlanRequest":
+        """
+        Build from query parameters in ``to_query``'s shape, in any order;
+        ``current`` and ``desired`` are ``ns:level`` lists separated by commas.
+        """
+        return PlanRequest.from_dict({
+            "item_type": args["item_type"],
+            "current": _parse_enchants(args.get("current", "")),
+            "prior_work": args.get("prior_work", 0),
+            "desired": _parse_enchants(args.get("desired", "")),
+            "mode": args.get("mode", "levels"),
+            "allow_incompat": args.get("allow_incompat", "0") in ("1", "true", "on"),
+            "engine": args.get("engine", "dp"),
+        })
+
+    def to_query(self) -> str:
+        """
+        The canonical query string for this request: every parameter, in a
+        fixed order, with enchants sorted by name.  Equal requests give equal
+        strings, so it works as a cache key and as a shared URL.  ``engine``
+        is only spelled out when it is not the default.
+        """
+        params = [
+            ("item_type", self.base.item_type),
+            ("current", _format_enchants(self.base.enchants)),
+            ("prior_work", self.base.anvil_uses),
+            ("desired", _format_enchants(self.desired)),
+            ("mode", self.mode),
+            ("allow_incompat", int(self.options.allow_incompatible)),
+        ]
+        if self.engine != "dp":
+            params.append(("engine", self.engine))
+        return urlencode(params, safe=":,")
+
+
+def parse_flag(raw) -> bool:
+    """A yes/no option as JSON gives it: a bool, or the string ``"true"`` or ``"false"``."""
+    if isinstance(raw, bool):
+        return raw
+    if raw in ("true", "false"):
+        return raw == "true"
+    raise ValueError(f"Expected true or false, got {raw!r}")
+
+
+def parse_uses(raw) -> int:
+    """Anvil uses as a request gives them: an int, or a string of digits from a form or query."""
+    if isinstance(raw, str) and raw.isascii() and raw.isdigit():
+        return int(raw)
+    if isinstance(raw, int) and not isinstance(raw, bool) and raw >= 0:
+        return raw
+    raise ValueError(f"Prior work {raw!r} must be a whole number of anvil uses, at least 0")
+
+
+def _format_enchants(enchants: Dict[str, int]) -> str:
+    return ",".join(f"{ns}:{lv}" for ns, lv in sorted(enchants.items()))
+
+
+def _parse_enchants(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in filter(None, raw.split(",")):
+        ns, sep, lv = part.partition(":")
+        if not sep:
+            raise ValueError(f"Expected 'enchant:level', got {part!r}")
+        out[ns] = int(lv)
+    return out
+
+
+def _plan_task(req: PlanRequest, time_budget: float | None = None,
+               cancel: threading.Event | None = None) -> MergePlan | Exception:
+    try:
+        return plan_enchants(req.base, req.desired, mode=req.mode, options=req.options,
+                             time_budget=time_budget, cancel=cancel, engine=req.engine)
+    except PLAN_ERRORS as e:
+        return e
+
+
+def plan_many(requests: Iterable[PlanRequest], *, parallel: bool = False, time_budget: float | None = None,
+              cancel: threading.Event | None = None) -> Iterator[Tuple[int, MergePlan | Exception]]:
+    """
+    Plan every request, yielding ``(index, plan or error)`` as each finishes.
+
+    Identical targets are planned once and yielded for every index that
+    asked for them.  Serially the whole batch shares this process's caches;
+    with ``parallel`` (and a pool set up by ``configure_parallel``) unique
+    targets are fanned out over the planner's process pool, each worker
+    keeping its own caches across tasks.
+
+    ``time_budget`` applies to each target (see ``plan_enchants``).  Setting
+    ``cancel``, or closing the generator, stops the batch: the running
+    search gives up and queued targets are dropped.
+    """
+    groups: Dict[tuple, List[int]] = {}
+    unique: List[PlanRequest] = []
+    for i, req in enumerate(requests):
+        key = plan_key(req.base, req.desired, req.mode, req.options, req.engine)
+        if key not in groups:
+            groups[key] = []
+            unique.append(req)
+        groups[key].append(i)
+
+    def emit(req: PlanRequest, result):
+        for i in groups[plan_key(req.base, req.desired, req.mode, req.options, req.engine)]:
+            yield i, result
+
+    if parallel and calculator._PARALLEL_WORKERS >= 2 and len(unique) > 1:
+        pool = calculator._pool()
+        # events do not cross into pool workers; cancel drops queued targets
+        futures = {pool.submit(_plan_task, req, time_budget): req for req in unique}
+        try:
+            for fut in as_completed(futures):
+                if cancel is not None and cancel.is_set():
+                    return
+                yield from emit(futures[fut], fut.result())
+        finally:
+            for fut in futures:
+                fut.cancel()
+    else:
+        for req in unique:
+            try:
+                result = _plan_task(req, time_budget, cancel)
+            except PlanCancelled:
+                return
+            yield from emit(req, result)
@@ -0,0 +1,335 @@
+"""
+Benchmark suite for ``plan_enchants``.
+
+Plans each item type with 1..N missing books (the first N enchants of its
+largest compatible set, at max level), in both modes and for a few starting
+anvil-use counts, and reports for each case:
+
+* wall time, with a cold search cache and again with a warm one (plan cache
+  cleared, solved sub-problems kept);
+* candidate merges the search tried;
+* peak traced memory (measured in a separate, traced run);
+* sub-problem cache entries and weight afterwards.
+
+The precomputed plan table is set aside while benchmarking so every case
+reaches the search.  Results are written as JSON; ``--compare`` checks them
+against an earlier run and exits non-zero on regressions::
+
+    python -m enchantplanner.benchmark [-o results.json] [--max-books 12]
+        [--items boots sword ...] [--uses 0 3] [--compare old.json]
+        [--vectorized] [--bounded] [--engine shapes] [--differential] [--quality]
+
+``--vectorized`` runs the searches on the NumPy layer kernel (see
+``calculator.configure_vectorized``) so the two can be compared,
+``--bounded`` runs them as ``plan_enchants(..., bounded=True)`` so the
+merges branch-and-bound saves can be measured, and ``--engine`` picks the
+``plan_enchants`` engine.  ``--differential`` times
+nothing: it plans every case with the DP and with ``--engine`` (default
+``shapes``) on cold caches and exits non-zero if any two disagree on levels,
+prior work or failing.  ``--quality`` does the same for ``--engine heuristic``
+(its default), reporting how far above the DP's levels its plans are and
+exiting non-zero if one beats the DP or its lower bound does.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, List
+
+from . import calculator, stats
+from .calculator import plan_enchants, clear_caches, cache_stats, _plan_rank
+from .catalog import CATALOG
+from .exceptions import IncompatibleSelected, MergeTooExpensive
+from .models import EnchantedItem, MergePlan
+from .precompute import MODES, item_types, maximal_sets, _conflict
+from .utils import data_version
+
+RESULTS_FORMAT = 1
+TEMPERATURES = ("cold", "warm")
+
+
+def enchant_pool(item_type: str) -> List[str]:
+    """Enchants benchmarked for ``item_type``: its largest compatible set, by name."""
+    if item_type == "book":
+        # books take anything; build one compatible set greedily
+        chosen: List[str] = []
+        for ns in sorted(CATALOG.names):
+            if not ns.startswith("curse_") and not any(_conflict(ns, c) for c in chosen):
+                chosen.append(ns)
+        return chosen
+    best = max(maximal_sets(item_type), key=lambda s: (len(s), sorted(s)))
+    return sorted(best)
+
+
+def cases(items: List[str], max_books: int, uses: List[int]) -> Iterator[dict]:
+    for item_type in items:
+        pool = enchant_pool(item_type)
+        for books in range(1, min(max_books, len(pool)) + 1):
+            for anvil_uses in uses:
+                for mode in MODES:
+                    yield {
+                        "item_type": item_type,
+                        "books": books,
+                        "anvil_uses": anvil_uses,
+                        "mode": mode,
+                        "desired": {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in pool[:books]},
+                    }
+
+
+def _prepare(temperature: str) -> None:
+    if temperature == "cold":
+        clear_caches()
+    else:
+        calculator._PLANS.clear()
+        calculator._FRONTS.clear()
+
+
+def _plan(case: dict, engine: str = "dp", bounded: bool = False) -> MergePlan | str:
+    base = EnchantedItem(case["item_type"], {}, anvil_uses=case["anvil_uses"])
+    try:
+        return plan_enchants(base, case["desired"], mode=case["mode"], engine=engine, bounded=bounded)
+    except (ValueError, IncompatibleSelected, MergeTooExpensive, RuntimeError) as e:
+        return str(e)
+
+
+def _error(result: MergePlan | str) -> str | None:
+    return result if isinstance(result, str) else None
+
+
+def run_case(case: dict, *, memory: bool = True, engine: str = "dp", bounded: bool = False) -> List[dict]:
+    """Measure one case cold, then warm; one result row per temperature."""
+    rows = []
+    for temperature in TEMPERATURES:
+        _prepare(temperature)
+        with stats.collect() as st:
+            start = time.perf_counter()
+            error = _error(_plan(case, engine, bounded))
+            elapsed = time.perf_counter() - start
+        merges = st.counters.get("merges_tried", 0)
+        subproblems = cache_stats()["subproblems"]
+
+        peak = None
+        if memory:
+            # tracing slows the search down, so memory gets a run of its own
+            _prepare(temperature)
+            tracemalloc.start()
+            _plan(case, engine, bounded)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        row = {k: v for k, v in case.items() if k != "desired"}
+        row.update(
+            cache=temperature,
+            seconds=round(elapsed, 6),
+            merges=merges,
+            peak_bytes=peak,
+            subproblem_entries=subproblems.entries,
+            subproblem_weight=subproblems.weight,
+            error=error,
+        )
+        rows.append(row)
+    return rows
+
+
+def run(items: List[str], max_books: int, uses: List[int], *, memory: bool = True,
+        progress=None, engine: str = "dp", bounded: bool = False) -> dict:
+    table = dict(calculator._TABLE)
+    calculator._TABLE.clear()
+    try:
+        results = []
+        for case in cases(items, max_books, uses):
+            rows = run_case(case, memory=memory, engine=engine, bounded=bounded)
+            results.extend(rows)
+            if progress is not None:
+                for row in rows:
+                    progress(row)
+    finally:
+        calculator._TABLE.update(table)
+        clear_caches()
+    return {
+        "format": RESULTS_FORMAT,
+        "data_version": data_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "vectorized": calculator._VECTORIZED,
+        "engine": engine,
+        "bounded": bounded,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def differential(items: List[str], max_books: int, uses: List[int], engine: str = "shapes",
+                 progress=None) -> List[str]:
+    """
+    Cases where ``engine`` and the DP disagree: on the plan's levels or prior
+    work, or on whether there is one.  Equal-cost plans may differ in xp and
+    steps.
+    """
+    table = dict(calculator._TABLE)
+    calculator._TABLE.clear()
+    problems = []
+    try:
+        for case in cases(items, max_books, uses):
+            found = []
+            for which in ("dp", engine):
+                clear_caches()
+                result = _plan(case, which)
+                found.append(result if isinstance(result, str) else (result.total_levels, result.final_prior_work))
+            name = "{} books={} uses={} {}".format(case["item_type"], case["books"], case["anvil_uses"], case["mode"])
+            if found[0] != found[1]:
+                problems.append(f"{name}: dp {found[0]} != {engine} {found[1]}")
+            if progress is not None:
+                progress(name, found[0])
+    finally:
+        calculator._TABLE.update(table)
+        clear_caches()
+    return problems
+
+
+def quality(items: List[str], max_books: int, uses: List[int], engine: str = "heuristic",
+            progress=None) -> dict:
+    """
+    How close ``engine``'s plans come to the DP's, on cold caches: the excess
+    levels of each plan as a fraction of the optimum, and the cases where
+    ``engine`` beats the DP, its ``lower_bound`` is above the optimum, or
+    only one of the two found a plan (``problems``).
+    """
+    table = dict(calculator._TABLE)
+    calculator._TABLE.clear()
+    excess = []
+    problems = []
+    try:
+        for case in cases(items, max_books, uses):
+            found = []
+            for which in ("dp", engine):
+                clear_caches()
+                found.append(_plan(case, which))
+            exact, plan = found
+            name = "{} books={} uses={} {}".format(case["item_type"], case["books"], case["anvil_uses"], case["mode"])
+            if isinstance(exact, str) or isinstance(plan, str):
+                if _error(exact) is None or _error(plan) is None:
+                    problems.append(f"{name}: dp {_error(exact) or 'plans'} but {engine} {_error(plan) or 'plans'}")
+                continue
+            if (plan.total_levels, plan.final_prior_work) != (exact.total_levels, exact.final_prior_work):
+                if _plan_rank(plan, case["mode"]) < _plan_rank(exact, case["mode"]):
+                    problems.append(f"{name}: {engine} beats dp ({plan.total_levels} < {exact.total_levels} levels)")
+            if plan.lower_bound is not None and plan.lower_bound > exact.total_levels:
+                problems.append(f"{name}: lower bound {plan.lower_bound} > optimum {exact.total_levels}")
+            excess.append((plan.total_levels - exact.total_levels) / max(exact.total_levels, 1))
+            if progress is not None:
+                progress(name, exact.total_levels, plan.total_levels, plan.lower_bound)
+    finally:
+        calculator._TABLE.update(table)
+        clear_caches()
+    return {
+        "engine": engine,
+        "cases": len(excess),
+        "optimal": sum(1 for e in excess if e == 0),
+        "mean_excess": sum(excess) / len(excess) if excess else 0.0,
+        "max_excess": max(excess, default=0.0),
+        "problems": problems,
+    }
+
+
+def _row_key(row: dict) -> tuple:
+    return row["item_type"], row["books"], row["anvil_uses"], row["mode"], row["cache"]
+
+
+def compare(old: dict, new: dict, *, tolerance: float = 1.25, min_seconds: float = 0.005) -> List[str]:
+    """
+    Regressions of ``new`` against ``old``: cases that got slower than
+    ``tolerance`` times (ignoring both under ``min_seconds``), tried more
+    merges, or stopped finding a plan.
+    """
+    before: Dict[tuple, dict] = {_row_key(r): r for r in old["results"]}
+    problems = []
+    for row in new["results"]:
+        prev = before.get(_row_key(row))
+        if prev is None:
+            continue
+        name = "{} books={} uses={} {} {}".format(*_row_key(row))
+        if row["error"] and not prev["error"]:
+            problems.append(f"{name}: now fails ({row['error']})")
+        if row["merges"] > prev["merges"]:
+            problems.append(f"{name}: merges {prev['merges']} -> {row['merges']}")
+        if max(row["seconds"], prev["seconds"]) >= min_seconds and row["seconds"] > prev["seconds"] * tolerance:
+            problems.append(f"{name}: {prev['seconds']:.4f}s -> {row['seconds']:.4f}s")
+    return problems
+
+
+def _print_row(row: dict) -> None:
+    peak = "-" if row["peak_bytes"] is None else f"{row['peak_bytes'] / 1024:.0f}K"
+    status = f"  ! {row['error']}" if row["error"] else ""
+    print(f"{row['item_type']:<14} {row['books']:>2} books  uses={row['anvil_uses']}  {row['mode']:<10} "
+          f"{row['cache']:<4} {row['seconds'] * 1000:>10.2f} ms  {row['merges']:>10} merges  "
+          f"{peak:>8}  cache={row['subproblem_entries']}{status}")
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m enchantplanner.benchmark", description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", default="benchmark.json", help="where to write the results")
+    parser.add_argument("--max-books", type=int, default=12)
+    parser.add_argument("--items", nargs="+", default=None, help="item types (default: all, plus book)")
+    parser.add_argument("--uses", nargs="+", type=int, default=[0, 3], help="starting anvil uses")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak-memory runs")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="fail on regressions against an earlier run")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown factor for --compare")
+    parser.add_argument("--vectorized", action="store_true", help="use the NumPy layer kernel (needs NumPy)")
+    parser.add_argument("--bounded", action="store_true", help="run the searches as branch-and-bound")
+    parser.add_argument("--engine", choices=calculator.ENGINES, default=None,
+                        help="plan_enchants engine (default: dp, shapes with --differential, "
+                             "heuristic with --quality)")
+    parser.add_argument("--differential", action="store_true",
+                        help="check --engine against the DP instead of timing")
+    parser.add_argument("--quality", action="store_true",
+                        help="measure how far --engine's plans are above the DP's instead of timing")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.vectorized:
+        calculator.configure_vectorized(True)
+
+    items = args.items or item_types() + ["book"]
+    if args.quality:
+        engine = args.engine or "heuristic"
+        report = quality(items, args.max_books, args.uses, engine,
+                         progress=None if args.quiet else
+                         lambda name, exact, found, bound: print(f"{name:<40} dp {exact:>4}  {engine} {found:>4}  "
+                                                                 f"bound {bound}"))
+        for line in report["problems"]:
+            print(f"PROBLEM {line}")
+        print(f"{engine} vs dp: {report['optimal']}/{report['cases']} optimal, "
+              f"mean {report['mean_excess']:.2%} and max {report['max_excess']:.2%} above")
+        return 1 if report["problems"] else 0
+    if args.differential:
+        engine = args.engine or "shapes"
+        problems = differential(items, args.max_books, args.uses, engine,
+                                progress=None if args.quiet else lambda name, found: print(f"{name:<40} {found}"))
+        for line in problems:
+            print(f"MISMATCH {line}")
+        print(f"{engine} vs dp: {len(problems)} mismatches")
+        return 1 if problems else 0
+
+    results = run(items, args.max_books, args.uses, memory=not args.no_memory,
+                  progress=None if args.quiet else _print_row, engine=args.engine or "dp", bounded=args.bounded)
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=1)
+    total = sum(r["seconds"] for r in results["results"])
+    print(f"wrote {len(results['results'])} results to {args.output} ({total:.2f}s planning)")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            old = json.load(fh)
+        problems = compare(old, results, tolerance=args.tolerance)
+        for line in problems:
+            print(f"REGRESSION {line}")
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    weight: int
+    max_entries: Optional[int]
+    max_weight: Optional[int]
+
+
+class PlanCache:
+    """
+    Thread-safe LRU cache with an entry budget and an optional weight budget.
+
+    ``weigh(value)`` estimates the resident size of one entry (1 per entry by
+    default); least recently used entries are evicted until both budgets hold.
+    A budget of ``None`` means unbounded.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, *, max_weight: Optional[int] = None,
+                 weigh: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self._weigh = weigh or (lambda value: 1)
+        self._data: "OrderedDict[Hashable, tuple[Any, int]]" = OrderedDict()
+        self._lock = Lock()
+        self._weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        weight = self._weigh(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._weight -= old[1]
+            self._data[key] = (value, weight)
+            self._weight += weight
+            self._evict()
+
+    def resize(self, max_entries: Optional[int] = None, *, max_weight: Optional[int] = None) -> None:
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_weight = max_weight
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._data), self._weight,
+                              self.max_entries, self.max_weight)
+
+    def _evict(self) -> None:
+        while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries)
+                or (self.max_weight is not None and self._weight > self.max_weight)):
+            _, (_, weight) = self._data.popitem(last=False)
+            self._weight -= weight
+            self.evictions += 1
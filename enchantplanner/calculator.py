@@ -1,58 +1,1205 @@
-import itertools
+import dataclasses
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from functools import lru_cache
-from typing import List, Tuple, Dict
+from typing import Callable, Iterator, List, Tuple, Dict
 
-from .models import EnchantedItem, Step, MergePlan
-from .exceptions import InvalidTarget, MergeTooExpensive
-from .data import ENCHANTMENTS
+from . import heuristic, packed, shapes, singleflight, stats, vectorized
+from .cache import PlanCache, CacheStats
+from .store import PlanStore
+from .models import EnchantedItem, Step, MergePlan, PlannerOptions, DEFAULT_OPTIONS
+from .exceptions import IncompatibleSelected, InvalidTarget, MergeTooExpensive, PlanCancelled
+from .utils import xp_from_levels, data_version
+from .catalog import CATALOG
+
+
+def _max_uses(limit: int) -> int:
+    # An item whose prior-work penalty alone exceeds the merge cap can never be
+    # used in another merge, so no merge result has more anvil uses than this.
+    return (limit + 1).bit_length()
+
+
+def _check_uses(items: Tuple[EnchantedItem, ...], limit: int) -> None:
+    """``MergeTooExpensive`` if one of ``items`` is too worked to merge at all under ``limit``."""
+    for item in items:
+        if item.anvil_uses >= _max_uses(limit):
+            raise MergeTooExpensive(f"An item with {item.anvil_uses} prior anvil uses costs more than "
+                                    f"{limit} levels to merge")
 
 
 @lru_cache(maxsize=None)
-def _cheapest_single(work_tuple: Tuple[EnchantedItem, ...]):
-    items = work_tuple
-    n = len(items)
-    if n == 1:
+def xp_costs(limit: int) -> List[int]:
+    """xp cost of every merge cost up to ``limit`` levels."""
+    return [xp_from_levels(lv) for lv in range(limit + 1)]
+
+
+# A solved search state: (state, target node, sacrifice node, merge levels).
+# Leaves have no children; the plan is rebuilt from these back-pointers.
+Node = Tuple[tuple, "Node | None", "Node | None", int]
+
+# Added to the warnings of plans made under a time budget.
+OPTIMAL = "Optimal plan: the search finished within the time budget."
+NOT_PROVEN_OPTIMAL = ("Not proven optimal: the time budget ran out before the search finished, "
+                      "so this is the best plan found so far.")
+# Added to the plans of ``engine="shapes"`` that could not be proven and had
+# too many books for the DP.
+SHAPES_NOT_PROVEN = ("Not proven optimal: the merge cost limit ruled out the cheapest merge-tree shapes, "
+                     "and there are too many books to check every plan.")
+
+# Added to the plans of ``engine="heuristic"``; their ``lower_bound`` says how
+# far from optimal they can be.
+HEURISTIC_PLAN = "Heuristic plan: not proven optimal; see its gap to the lower bound."
+
+# most books ``engine="shapes"`` hands to the DP when it cannot prove its plan:
+# sixteen books onto a book take the DP about 3 s, and each book doubles that
+_SHAPES_DP_BOOKS = 16
+
+# most items a search with a ``stop`` check starts on: its tables grow as
+# 2^n, and past this size building them alone outlasts any sensible budget
+_BOUNDED_MAX_ITEMS = 18
+
+# sub-plans per finished layer of an interrupted search that are completed
+# greedily for the best-so-far plan
+_COMPLETIONS = 8
+
+# Bit positions of interchangeable items, one tuple per class (see
+# ``_symmetry_classes``); items with no twin are classes of their own.
+_Classes = Tuple[Tuple[int, ...], ...]
+
+# per finished layer, each subset as (items, {uses: (levels, xp, node)})
+_Partial = List[List[Tuple[Tuple[EnchantedItem, ...], dict]]]
+
+
+class _Interrupted(Exception):
+    """A search stopped by its ``stop`` check, with the layers it finished."""
+
+    def __init__(self, partial: _Partial):
+        super().__init__("search interrupted")
+        self.partial = partial
+
+# Solved sub-problems, keyed by the options and their items in canonical
+# (signature) order so the same multiset is shared no matter which request or
+# input order hit it.  Each maps anvil uses -> (levels, xp, node) and is
+# weighed by that count.
+_SUBPROBLEMS = PlanCache(200_000, max_weight=2_000_000, weigh=len)
+
+# Sub-problem tables pinned for ``plan_incremental`` sessions, keyed by token
+# and weighed by their entry count.  Each maps the same keys as _SUBPROBLEMS.
+_SESSIONS = PlanCache(1024, max_weight=500_000, weigh=len)
+
+# Finished plans, keyed by ``plan_key``, in front of the search.
+_PLANS = PlanCache(4096)
+
+# Pareto fronts from ``plan_front``, keyed like _PLANS without the mode.
+_FRONTS = PlanCache(1024)
+
+# Plans precomputed offline by ``enchantplanner.precompute`` under the
+# default options, same keys as _PLANS.
+PLAN_TABLE_FORMAT = 1
+DEFAULT_PLAN_TABLE = os.path.join(os.path.dirname(__file__), "plan_table.json")
+_TABLE: Dict[tuple, MergePlan] = {}
+
+
+# engines ``plan_enchants`` can run; see its docstring
+ENGINES = ("dp", "shapes", "heuristic")
+
+
+def plan_key(base: EnchantedItem, desired: Dict[str, int], mode: str,
+             options: PlannerOptions = DEFAULT_OPTIONS, engine: str = "dp") -> tuple:
+    key = base.signature, tuple(sorted(desired.items())), mode, options
+    # other engines may break xp ties differently, so they cache apart
+    return key if engine == "dp" else key + (engine,)
+
+
+def store_key(key: tuple) -> str:
+    """
+    ``plan_key``'s key as a string for the persistent store: the same for
+    equal requests in every process.  Heuristic plans depend on the beam
+    width too.
+    """
+    (item_type, uses, enchants), desired, mode, options = key[:4]
+    parts = [item_type, uses, enchants, desired, mode,
+             [options.allow_incompatible, options.max_merge_levels, options.edition]]
+    if key[4:] == ("heuristic",):
+        parts.append(["heuristic", _BEAM_WIDTH])
+    elif key[4:]:
+        parts.append(list(key[4:]))
+    return json.dumps(parts, separators=(",", ":"))
+
+
+def load_plan_table(path: str = DEFAULT_PLAN_TABLE) -> int:
+    """
+    Load a precomputed plan table, replacing any loaded before.
+
+    Returns the number of plans loaded; a missing file, another format or a
+    table built from different ``ENCHANTMENTS`` data loads nothing.
+    """
+    _TABLE.clear()
+    try:
+        with open(path, encoding="utf-8") as fh:
+            table = json.load(fh)
+    except FileNotFoundError:
+        return 0
+    if table.get("format") != PLAN_TABLE_FORMAT or table.get("data_version") != data_version():
+        return 0
+    for item_type, desired, mode, plan in table["plans"]:
+        base = EnchantedItem(item_type, {})
+        _TABLE[plan_key(base, dict(desired), mode)] = MergePlan.from_dict(plan)
+    return len(_TABLE)
+
+# Process pool for large DP layers; off until ``configure_parallel`` is called.
+_PARALLEL_WORKERS = 0
+# a layer is only farmed out when it has at least this many splits to try
+_PARALLEL_MIN_SPLITS = 20_000
+_POOL: ProcessPoolExecutor | None = None
+_POOL_PID = 0
+
+
+def configure_parallel(workers: int | None = None, *, min_splits: int = 20_000) -> None:
+    """
+    Solve large DP layers on a pool of ``workers`` processes (0 turns it off,
+    None uses every CPU).  The pool is created on first use and kept for the
+    life of the process.
+    """
+    global _PARALLEL_WORKERS, _PARALLEL_MIN_SPLITS, _POOL
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if _POOL is not None and workers != _PARALLEL_WORKERS:
+        _POOL.shutdown(cancel_futures=True)
+        _POOL = None
+    _PARALLEL_WORKERS = workers
+    _PARALLEL_MIN_SPLITS = min_splits
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL, _POOL_PID
+    # a pool inherited through fork belongs to the parent
+    if _POOL is None or _POOL_PID != os.getpid():
+        _POOL = ProcessPoolExecutor(max_workers=_PARALLEL_WORKERS, initializer=_pool_worker_init)
+        _POOL_PID = os.getpid()
+    return _POOL
+
+
+def _pool_worker_init() -> None:
+    # pool workers run their tasks serially rather than starting pools of their own
+    global _PARALLEL_WORKERS
+    _PARALLEL_WORKERS = 0
+
+
+def _parallel_chunks(masks: List[int]) -> List[List[int]] | None:
+    """Round-robin chunks of one layer for the pool, or None to solve it serially."""
+    if _PARALLEL_WORKERS < 2 or len(masks) < 2:
+        return None
+    splits = len(masks) << (bin(masks[0]).count("1") - 1)
+    if splits < _PARALLEL_MIN_SPLITS:
+        return None
+    count = min(len(masks), _PARALLEL_WORKERS)
+    return [masks[i::count] for i in range(count)]
+
+
+# NumPy layer kernel (see ``vectorized``); off until ``configure_vectorized`` is called.
+_VECTORIZED = False
+# searches over fewer items stay in the Python loop, where they are quicker
+_VECTORIZED_MIN_ITEMS = 8
+
+
+def configure_vectorized(enabled: bool = True, *, min_items: int = 8) -> None:
+    """
+    Solve the DP layers of searches over at least ``min_items`` items with
+    the NumPy kernel in ``vectorized`` instead of the Python loop (and the
+    process pool).  Plans are the same either way.  Raises ``RuntimeError``
+    when enabling it without NumPy installed.
+    """
+    global _VECTORIZED, _VECTORIZED_MIN_ITEMS
+    if enabled and not vectorized.available():
+        raise RuntimeError("The vectorized planner needs NumPy installed.")
+    _VECTORIZED = enabled
+    _VECTORIZED_MIN_ITEMS = min_items
+
+
+# partial plans per merge in the heuristic engine's beam search
+_BEAM_WIDTH = heuristic.BEAM_WIDTH
+
+
+def configure_heuristic(beam_width: int = heuristic.BEAM_WIDTH) -> None:
+    """
+    Beam width of ``engine="heuristic"``: wider finds better plans, more
+    slowly.  Drops cached plans, which may have come from another width.
+    """
+    global _BEAM_WIDTH
+    if beam_width < 1:
+        raise ValueError("beam_width must be at least 1")
+    _BEAM_WIDTH = beam_width
+    _PLANS.clear()
+
+
+# plans shared by every worker on the host; off until ``configure_store`` is called
+_STORE: PlanStore | None = None
+# lock files that let one worker search a plan while the others wait for it in the store
+_HOST_LOCK: singleflight.HostLock | None = None
+# searches in this process, one per plan key at a time
+_FLIGHTS = singleflight.SingleFlight()
+
+
+def configure_store(path: str | None, *, max_entries: int | None = 100_000) -> None:
+    """
+    Keep finished plans in the SQLite file at ``path`` as well (see
+    ``store``), so every worker process on the host, and the next one to
+    start, reuses them.  ``None`` turns the store off.  ``clear_caches``
+    leaves it alone.
+
+    Where ``flock`` is available, workers also coalesce searches through
+    lock files in ``path + ".locks"``: while one worker searches a plan, the
+    others asking for it wait and then read it from the store.
+    """
+    global _STORE, _HOST_LOCK
+    if _STORE is not None:
+        _STORE.close()
+    _STORE = None if path is None else PlanStore(path, max_entries=max_entries)
+    _HOST_LOCK = singleflight.HostLock(path + ".locks") if path is not None and singleflight.available() else None
+
+
+def configure_caches(*, plan_entries: int | None = 4096, subproblem_entries: int | None = 200_000,
+                     subproblem_weight: int | None = 2_000_000, session_entries: int | None = 1024,
+                     session_weight: int | None = 500_000) -> None:
+    _PLANS.resize(plan_entries)
+    _SUBPROBLEMS.resize(subproblem_entries, max_weight=subproblem_weight)
+    _SESSIONS.resize(session_entries, max_weight=session_weight)
+
+
+def clear_caches() -> None:
+    _PLANS.clear()
+    _FRONTS.clear()
+    _SUBPROBLEMS.clear()
+    _SESSIONS.clear()
+
+
+def cache_stats() -> Dict[str, CacheStats]:
+    out = {"plans": _PLANS.stats(), "fronts": _FRONTS.stats(), "subproblems": _SUBPROBLEMS.stats(),
+           "sessions": _SESSIONS.stats()}
+    if _STORE is not None:
+        out["store"] = _STORE.stats()
+    return out
+
+
+def _lookup(key: tuple, pinned: Dict[tuple, dict] | None) -> dict | None:
+    """A solved sub-problem from the session table, else the shared cache (pinning it)."""
+    if pinned is None:
+        return _SUBPROBLEMS.get(key)
+    found = pinned.get(key)
+    if found is None:
+        found = _SUBPROBLEMS.get(key)
+        if found is not None:
+            pinned[key] = found
+    return found
+
+
+def _canonical(items) -> Tuple[EnchantedItem, ...]:
+    return tuple(sorted(items, key=lambda it: it.signature))
+
+
+def _cheapest_single(work_tuple: Tuple[EnchantedItem, ...], incumbent: Tuple[str, int, int] | None = None,
+                     options: PlannerOptions = DEFAULT_OPTIONS, stop: Callable[[], bool] | None = None,
+                     pinned: Dict[tuple, dict] | None = None):
+    """
+    Bitmask DP over every subset of ``work_tuple``.
+
+    Items are put in canonical order and item ``i`` is bit ``1 << i``.  Masks
+    are solved in layers of increasing popcount, so every proper submask is
+    solved first; any subset already in ``_SUBPROBLEMS`` is loaded instead.
+    The best plan per (mask, resulting anvil uses) lives in flat arrays at
+    ``mask * width + uses``; ``_solve_mask`` fills one mask.  Large layers are
+    spread over the process pool (see ``configure_parallel``), which gives the
+    same result as solving them here since every mask only reads its layer's
+    predecessors; with ``configure_vectorized`` whole layers are scored by the
+    NumPy kernel instead, again with the same result.
+
+    Inside the search items are ``(item_type, packed, present, uses)`` states
+    (see ``packed``).  Candidates only record back-pointers to the slots they
+    merged; once a mask is finished each winner becomes a ``Node``, and
+    ``Step`` lists are rebuilt only for the returned solutions.
+
+    Interchangeable books (see ``_symmetry_classes``) are searched by count:
+    only masks that take each class's books lowest bit first are solved,
+    splits are enumerated per class count, and a half holding other books of
+    a class reuses the canonical mask's solution with its books relabelled.
+
+    ``incumbent`` is ``(mode, levels, uses)`` of a known complete plan.  With
+    it the search is bounded: states whose admissible lower bound (see
+    ``_cutoffs``) cannot beat the incumbent under ``mode`` are dropped, and
+    the solutions returned are only guaranteed to hold the optimum for that
+    mode.  Subsets that lost states this way are not cached; book-only ones
+    are never bounded, so the book layer of a plan is shared by every base
+    item (see ``_cutoffs``).
+
+    ``options`` decides the merge cost limit and whether incompatible
+    enchants may end up together.
+
+    ``stop`` is polled while the tables are set up and before every mask
+    (before every layer sent to the pool); once it returns True the search
+    raises ``_Interrupted`` with the solutions of every layer it finished.
+    Subsets solved so far stay cached.  With ``stop`` set, searches over more
+    than ``_BOUNDED_MAX_ITEMS`` items raise it before allocating anything.
+
+    ``pinned`` is a session's own sub-problem table (see ``plan_incremental``):
+    it is consulted before ``_SUBPROBLEMS`` and receives every subset used.
+    """
+    items = _canonical(work_tuple)
+    if len(items) == 1:
         item = items[0]
         return {item.anvil_uses: ([], 0, 0, item)}
+    st = stats.current()
+    limit = options.max_merge_levels
+    cached = _lookup((options, items), pinned)
+    if cached is not None:
+        if st is not None:
+            st.count("subproblem_hits")
+        return _decode_solutions(cached)
+
+    n = len(items)
+    if stop is not None and (n > _BOUNDED_MAX_ITEMS or stop()):
+        raise _Interrupted([])
+    full = (1 << n) - 1
+    _check_uses(items, limit)
+    width = _max_uses(limit) + 1
+    classes = _symmetry_classes(items, options)
+
+    # anvil-use counts filled for each mask, in insertion order; built before
+    # the flat arrays, since making millions of lists next to them keeps the
+    # garbage collector walking them
+    uses_of: List[List[int]] = [[] for _ in range(full + 1)]
+    size = (full + 1) * width
+    best_lv: List[int] = [-1] * size
+    best_xp: List[int] = [0] * size
+    best_node: List[Node | None] = [None] * size
+    # back-pointers of the current winner while its mask is being solved; with
+    # symmetry classes they point at the concrete (maybe non-canonical) halves
+    from_tgt: List[int] = [0] * size
+    from_sac: List[int] = [0] * size
+    from_cost: List[int] = [0] * size
+    # per-slot merge inputs, unpacked from the node state for the inner loop
+    penalty: List[int] = [0] * size
+    value: List[int] = [0] * size
+    # a mask is book-only unless it holds a non-book item
+    is_book: List[bool] = [True] * (full + 1)
+    # highest total levels a slot may reach and still beat the incumbent
+    cut = _cutoffs(items, width, incumbent, limit)
+    if stop is not None and stop():
+        raise _Interrupted([])
+    # masks that lost a state to the bound, directly or through a submask
+    pruned: List[bool] = [False] * (full + 1)
+    kernel = None
+    if _VECTORIZED and n >= _VECTORIZED_MIN_ITEMS:
+        kernel = vectorized.LayerKernel(full, width, limit, xp_costs(limit), cut, is_book,
+                                        None if classes is None else lambda mask: _class_splits(mask, classes))
+
+    def fill(slot: int, node: Node, lv: int, xp: int):
+        state = node[0]
+        best_lv[slot] = lv
+        best_xp[slot] = xp
+        best_node[slot] = node
+        penalty[slot] = (1 << state[3]) - 1
+        value[slot] = packed.value(state[1])
+        if kernel is not None:
+            kernel.put(slot, lv, xp, penalty[slot], value[slot])
+
+    leaves = [(encode_item(item), None, None, 0) for item in items]
+    for i, item in enumerate(items):
+        bit = 1 << i
+        fill(bit * width + item.anvil_uses, leaves[i], 0, 0)
+        uses_of[bit].append(item.anvil_uses)
+        if item.item_type != "book":
+            for mask in range(bit, full + 1):
+                if mask & bit:
+                    is_book[mask] = False
+    if stop is not None and stop():
+        raise _Interrupted([])
+
+    # canonical sub-problem key of every mask; the lowest bit comes first
+    keys: List[Tuple[EnchantedItem, ...]] = [()] * (full + 1)
+    for i in range(n):
+        keys[1 << i] = (items[i],)
+
+    def node_at(slot: int) -> Node:
+        # the winner of a concrete slot, relabelled from its canonical mask
+        if classes is None:
+            return best_node[slot]
+        mask, w = divmod(slot, width)
+        canon, moves = _canonical_mask(mask, classes)
+        node = best_node[canon * width + w]
+        if moves:
+            node = _relabel(node, {leaves[i][0]: leaves[j] for i, j in moves})
+        return node
+
+    def interrupted(layers: List[List[int]]) -> _Interrupted:
+        partial = []
+        for layer in layers:
+            solved = []
+            for mask in layer:
+                mb = mask * width
+                solved.append((keys[mask], {w: (best_lv[mb + w], best_xp[mb + w], best_node[mb + w])
+                                            for w in uses_of[mask]}))
+            partial.append(solved)
+        return _Interrupted(partial)
+
+    # work done here, handed to ``stats`` once the search is finished;
+    # the full set already missed on entry
+    tried = over_cap = hits = 0
+    misses = 1
+    result = {}
+    finished = [[1 << i for i in range(n)]]
+    for layer in _layers(n) if classes is None else _class_layers(classes):
+        todo = []
+        for mask in layer:
+            mask_base = mask * width
+            if classes is None:
+                low = mask & -mask
+                keys[mask] = keys[low] + keys[mask ^ low]
+                bits = mask
+            else:
+                # submasks may not be canonical, so the key is built directly
+                keys[mask] = tuple(items[i] for i in range(n) if mask >> i & 1)
+                # dropping a class's highest bit keeps a mask canonical
+                bits = 0
+                for prefixes in _class_prefixes(classes):
+                    held = mask & prefixes[-1]
+                    if held:
+                        bits |= 1 << (held.bit_length() - 1)
+            if incumbent is not None:
+                while bits and not pruned[mask]:
+                    bit = bits & -bits
+                    pruned[mask] = pruned[mask ^ bit]
+                    bits ^= bit
+
+            # the full set was already looked up on entry
+            cached = _lookup((options, keys[mask]), pinned) if mask != full else None
+            if cached is not None:
+                hits += 1
+                for w, (lv, xp, node) in cached.items():
+                    if lv > cut[mask_base + w]:
+                        pruned[mask] = True
+                        continue
+                    fill(mask_base + w, node, lv, xp)
+                    uses_of[mask].append(w)
+            else:
+                if mask != full:
+                    misses += 1
+                todo.append(mask)
+
+        chunks = _parallel_chunks(todo) if kernel is None else None
+        if kernel is None and chunks is None:
+            for mask in todo:
+                if stop is not None and stop():
+                    raise interrupted(finished)
+                lost, n_tried, n_over = _solve_mask(mask, width, limit, best_lv, best_xp, penalty, value,
+                                                    uses_of, is_book, cut, from_tgt, from_sac, from_cost,
+                                                    classes)
+                pruned[mask] = pruned[mask] or lost
+                tried += n_tried
+                over_cap += n_over
+        else:
+            if stop is not None and stop():
+                raise interrupted(finished)
+            if kernel is not None:
+                # the whole layer in array operations; same winners as the loop above
+                batches = [kernel.solve(todo)]
+            else:
+                shared = (width, limit, best_lv, best_xp, penalty, value, uses_of, is_book, cut, classes)
+                batches = _pool().map(_solve_chunk, [(chunk,) + shared for chunk in chunks])
+            for done in batches:
+                for mask, lost, n_tried, n_over, found in done:
+                    pruned[mask] = pruned[mask] or lost
+                    tried += n_tried
+                    over_cap += n_over
+                    for w, lv, xp, tslot, sslot, cost_lv in found:
+                        slot = mask * width + w
+                        best_lv[slot] = lv
+                        best_xp[slot] = xp
+                        from_tgt[slot] = tslot
+                        from_sac[slot] = sslot
+                        from_cost[slot] = cost_lv
+                        uses_of[mask].append(w)
+
+        for mask in todo:
+            mask_base = mask * width
+            result = {}
+            for w in uses_of[mask]:
+                slot = mask_base + w
+                tnode = node_at(from_tgt[slot])
+                snode = node_at(from_sac[slot])
+                tstate = tnode[0]
+                sstate = snode[0]
+                if not result:
+                    # the merged enchant set only depends on the mask
+                    clash = packed.conflicts(tstate[2] | sstate[2])
+                    if clash and not options.allow_incompatible:
+                        raise IncompatibleSelected(clash)
+                state = (tstate[0], packed.merge(tstate[1], sstate[1], sstate[2]), tstate[2] | sstate[2], w)
+                node = (state, tnode, snode, from_cost[slot])
+                fill(slot, node, best_lv[slot], best_xp[slot])
+                result[w] = (best_lv[slot], best_xp[slot], node)
+            if not pruned[mask]:
+                _SUBPROBLEMS.put((options, keys[mask]), result)
+                if pinned is not None:
+                    pinned[options, keys[mask]] = result
+        finished.append(layer)
+
+    if st is not None:
+        st.count("merges_tried", tried)
+        st.count("merges_over_cap", over_cap)
+        st.count("subproblem_hits", hits)
+        st.count("subproblem_misses", misses)
+    return _decode_solutions(result)
+
+
+@lru_cache(maxsize=None)
+def _layers(n: int) -> List[List[int]]:
+    """Masks over ``n`` bits with at least two set, grouped by popcount ascending."""
+    layers: List[List[int]] = [[] for _ in range(n + 1)]
+    for mask in range(1, 1 << n):
+        layers[bin(mask).count("1")].append(mask)
+    return layers[2:]
+
+
+def _symmetry_classes(items: Tuple[EnchantedItem, ...], options: PlannerOptions) -> _Classes | None:
+    """
+    Group interchangeable items, or None when no two are.
+
+    Books are interchangeable when they have the same value and anvil uses
+    and share no enchant with any other item, nor (unless incompatible
+    enchants are allowed) conflict with one.  Every merge then costs the same
+    whichever of them it takes, so subsets differing only in which of them
+    they hold have the same solutions up to relabelling.
+    """
+    present = [packed.encode(it.enchants)[1] for it in items]
+    groups: Dict[tuple, List[int]] = {}
+    for i, it in enumerate(items):
+        others = 0
+        for j, bits in enumerate(present):
+            if j != i:
+                others |= bits
+        if it.item_type == "book" and not present[i] & others and (options.allow_incompatible or not any(
+                packed.INCOMPAT[eid] & others for eid in range(present[i].bit_length()) if present[i] >> eid & 1)):
+            key = (it.value, it.anvil_uses)
+        else:
+            key = (i,)
+        groups.setdefault(key, []).append(i)
+    if len(groups) == len(items):
+        return None
+    return tuple(sorted(tuple(g) for g in groups.values()))
+
+
+@lru_cache(maxsize=256)
+def _class_layers(classes: _Classes) -> List[List[int]]:
+    """Canonical masks (each class's bits taken lowest first) with at least two set, by popcount."""
+    masks = [0]
+    for prefixes in _class_prefixes(classes):
+        masks = [m | p for m in masks for p in prefixes]
+    layers: List[List[int]] = [[] for _ in range(sum(map(len, classes)) + 1)]
+    for mask in sorted(masks):
+        layers[bin(mask).count("1")].append(mask)
+    return layers[2:]
+
+
+def _canonical_mask(mask: int, classes: _Classes) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    The canonical mask with the same count of each class as ``mask``, and the
+    ``(canonical bit, concrete bit)`` positions that differ between the two.
+    """
+    canon = 0
+    moves = []
+    for cls in classes:
+        if len(cls) == 1:
+            canon |= mask & (1 << cls[0])
+            continue
+        held = [i for i in cls if mask >> i & 1]
+        for i, j in zip(cls, held):
+            canon |= 1 << i
+            if i != j:
+                moves.append((i, j))
+    return canon, moves
+
+
+def _relabel(node: Node, leaves: Dict[tuple, Node]) -> Node:
+    """``node`` with the leaves whose states are in ``leaves`` swapped, states rebuilt above them."""
+    state, tnode, snode, cost_lv = node
+    if tnode is None:
+        return leaves.get(state, node)
+    tnode = _relabel(tnode, leaves)
+    snode = _relabel(snode, leaves)
+    tstate = tnode[0]
+    sstate = snode[0]
+    state = (tstate[0], packed.merge(tstate[1], sstate[1], sstate[2]), tstate[2] | sstate[2], state[3])
+    return state, tnode, snode, cost_lv
+
+
+def _class_splits(mask: int, classes: _Classes) -> Iterator[Tuple[int, int, int]]:
+    """
+    Unordered splits of canonical ``mask`` by how many of each class go left,
+    as ``(left, right, concrete right)``: ``left`` takes the lowest bits of
+    each class and ``right`` is the canonical mask of the concrete rest.
+    """
+    splits = [(0, 0)]
+    for prefixes in _class_prefixes(classes):
+        k = bin(mask & prefixes[-1]).count("1")
+        if k:
+            splits = [(left | prefixes[t], right | prefixes[k - t]) for left, right in splits for t in range(k + 1)]
+    # both halves are canonical, so ordering them visits each unordered split once
+    return iter([(left, right, mask ^ left) for left, right in splits if left >= right and right])
 
-    best: Dict[int, Tuple[List[Step], int, int, EnchantedItem]] = {}
 
-    for i in range(1, n):
-        for left_idx in itertools.combinations(range(n), i):
-            right_idx = tuple(sorted(set(range(n)) - set(left_idx)))
-            lefts = tuple(items[j] for j in left_idx)
-            rights = tuple(items[j] for j in right_idx)
+@lru_cache(maxsize=256)
+def _class_prefixes(classes: _Classes) -> List[List[int]]:
+    """Per class, the mask of its lowest ``k`` bits for every ``k``."""
+    return [[sum(1 << i for i in cls[:k]) for k in range(len(cls) + 1)] for cls in classes]
 
-            for lw, (lsteps, llv, lxp, litem) in _cheapest_single(lefts).items():
-                for rw, (rsteps, rlv, rxp, ritem) in _cheapest_single(rights).items():
-                    try:
-                        merged, cost_lv, cost_xp = litem.merge(ritem)
-                    except (InvalidTarget, MergeTooExpensive):
+
+def _solve_mask(mask: int, width: int, limit: int, best_lv: List[int], best_xp: List[int], penalty: List[int],
+                value: List[int], uses_of: List[List[int]], is_book: List[bool], cut: List[int],
+                from_tgt: List[int], from_sac: List[int], from_cost: List[int],
+                classes: _Classes | None = None) -> Tuple[bool, int, int]:
+    """
+    Fill the slots of ``mask`` from its already solved submasks.
+
+    Each unordered split is visited once, and both merge directions are
+    tried; merges costing more than ``limit`` levels are not allowed.  With
+    ``classes`` the halves are read from their canonical masks while the
+    back-pointers record the concrete ones.  Returns whether a candidate was
+    dropped by ``cut``, how many candidates were tried and how many of those
+    cost too much.
+    """
+    pruned = False
+    tried = over_cap = 0
+    xp_cost = xp_costs(limit)
+    mask_base = mask * width
+    low = mask & -mask
+    rest = mask ^ low
+    sub = rest
+    splits = None if classes is None else _class_splits(mask, classes)
+    while True:
+        # moved: slot offset from the canonical right half to the concrete one
+        if splits is None:
+            # the half holding the mask's lowest bit is ``left``
+            if not sub:
+                break
+            sub = (sub - 1) & rest
+            left = sub | low
+            right = mask ^ left
+            moved = 0
+        else:
+            split = next(splits, None)
+            if split is None:
+                break
+            left, right, right_at = split
+            moved = (right_at - right) * width
+        # only book-onto-book merges may go in either direction
+        pairs = ((left, right, 0, moved), (right, left, moved, 0)) if is_book[left] == is_book[right] else (
+            ((right, left, moved, 0),) if is_book[left] else ((left, right, 0, moved),))
+        for tgt, sac, tmoved, smoved in pairs:
+            tbase = tgt * width
+            sbase = sac * width
+            tried += len(uses_of[tgt]) * len(uses_of[sac])
+            for tw in uses_of[tgt]:
+                tslot = tbase + tw
+                tpen = penalty[tslot]
+                tlv = best_lv[tslot]
+                for sw in uses_of[sac]:
+                    sslot = sbase + sw
+                    cost_lv = tpen + penalty[sslot] + value[sslot]
+                    if cost_lv > limit:
+                        over_cap += 1
+                        continue
+                    tot_lv = tlv + best_lv[sslot] + cost_lv
+                    w = (tw if tw > sw else sw) + 1
+                    slot = mask_base + w
+                    if tot_lv > cut[slot]:
+                        pruned = True
                         continue
+                    cur = best_lv[slot]
+                    if cur >= 0 and cur < tot_lv:
+                        continue
+                    tot_xp = best_xp[tslot] + best_xp[sslot] + xp_cost[cost_lv]
+                    if cur == tot_lv and best_xp[slot] <= tot_xp:
+                        continue
+                    if cur < 0:
+                        uses_of[mask].append(w)
+                    best_lv[slot] = tot_lv
+                    best_xp[slot] = tot_xp
+                    from_tgt[slot] = tslot + tmoved
+                    from_sac[slot] = sslot + smoved
+                    from_cost[slot] = cost_lv
+    return pruned, tried, over_cap
+
+
+def _solve_chunk(args) -> List[Tuple[int, bool, int, int, List[Tuple[int, int, int, int, int, int]]]]:
+    """Pool task: solve a chunk of one layer and return each mask's winners."""
+    masks, width, limit, best_lv, best_xp, penalty, value, uses_of, is_book, cut, classes = args
+    size = len(best_lv)
+    from_tgt = [0] * size
+    from_sac = [0] * size
+    from_cost = [0] * size
+    out = []
+    for mask in masks:
+        lost, tried, over_cap = _solve_mask(mask, width, limit, best_lv, best_xp, penalty, value, uses_of,
+                                            is_book, cut, from_tgt, from_sac, from_cost, classes)
+        found = []
+        for w in uses_of[mask]:
+            slot = mask * width + w
+            found.append((w, best_lv[slot], best_xp[slot], from_tgt[slot], from_sac[slot], from_cost[slot]))
+        out.append((mask, lost, tried, over_cap, found))
+    return out
+
+
+def _cutoffs(items: Tuple[EnchantedItem, ...], width: int, incumbent: Tuple[str, int, int] | None,
+             limit: int) -> List[int]:
+    """
+    Per-slot cap on total levels for the bounded search.
+
+    For a state of ``mask`` with ``w`` uses, the rest of any full plan is a
+    tree over that state and the items outside ``mask``.  Every one of those
+    is merged in once, paying its prior-work penalty; the internal nodes pay
+    at least ``shapes.min_tree_penalty``; and everything except the leaf on the
+    final target's spine is a sacrifice once, paying its value.  The state can
+    only beat the incumbent if its levels plus that bound do not exceed it.
+
+    Values only add up like this when no two books share an enchant and at
+    most one item is not a book, which holds for ``plan_enchants``; for other
+    inputs no slot is capped.
+
+    Book-only masks are not capped either.  Their sub-problems do not depend
+    on the base item, so solved whole they are cached for every item type,
+    prior work and current enchants that asks for the same books, where a
+    capped (pruned) one would only be good for this request.
+    """
+    n = len(items)
+    full = (1 << n) - 1
+    cap = [limit * n + 1] * ((full + 1) * width)
+    if incumbent is None:
+        return cap
+
+    mode, inc_lv, inc_uses = incumbent
+    bases = [i for i, it in enumerate(items) if it.item_type != "book"]
+    seen = 0
+    for it in items:
+        if it.item_type == "book":
+            present = packed.encode(it.enchants)[1]
+            if seen & present:
+                return cap
+            seen |= present
+    if len(bases) > 1:
+        return cap
+    base_bit = 1 << bases[0] if bases else 0
+
+    value_sum = [0] * (full + 1)
+    penalty_sum = [0] * (full + 1)
+    value_max = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        item = items[low.bit_length() - 1]
+        rest = mask ^ low
+        value_sum[mask] = value_sum[rest] + item.value
+        penalty_sum[mask] = penalty_sum[rest] + item.prior_penalty()
+        value_max[mask] = max(value_max[rest], item.value)
+
+    for mask in range(1, full + 1):
+        if base_bit and not mask & base_bit:
+            continue
+        outside = full ^ mask
+        count = bin(outside).count("1")
+        for w in range(width):
+            slot = mask * width + w
+            if not outside:
+                lb_rest, final_uses = 0, w
+            else:
+                own_value = value_sum[mask] if not mask & base_bit else 0
+                if base_bit:
+                    spine = value_sum[base_bit] if outside & base_bit else 0
+                else:
+                    spine = max(value_max[outside], own_value)
+                lb_rest = (own_value + value_sum[outside] - spine
+                           + (1 << w) - 1 + penalty_sum[outside] + shapes.min_tree_penalty(count + 1))
+                final_uses = max(w + 1, count.bit_length())
+            if mode == "prior_work":
+                if final_uses > inc_uses:
+                    cap[slot] = -1
+                elif final_uses == inc_uses:
+                    cap[slot] = inc_lv - lb_rest
+            else:
+                cap[slot] = inc_lv - lb_rest
+    return cap
+
+
+def _greedy_incumbent(items: List[EnchantedItem], mode: str,
+                      options: PlannerOptions = DEFAULT_OPTIONS) -> Tuple[str, int, int] | None:
+    """Best of the greedy plans as ``(mode, levels, uses)``, or None if all get stuck."""
+    plan = _seed_plan(items, mode, options)
+    if plan is None:
+        return None
+    return mode, plan.total_levels, plan.final_prior_work.bit_length()
+
+
+def _greedy_plan(items: List[EnchantedItem], mode: str,
+                 options: PlannerOptions = DEFAULT_OPTIONS) -> MergePlan | None:
+    """Best of the greedy plans under ``mode``, or None if all get stuck."""
+    found = [p for p in (_cheapest_first(items, options), _balanced_rounds(items, options)) if p is not None]
+    if not found:
+        return None
+    return min(found, key=lambda p: _plan_rank(p, mode))
+
+
+def _seed_plan(items: List[EnchantedItem], mode: str,
+               options: PlannerOptions = DEFAULT_OPTIONS) -> MergePlan | None:
+    """
+    Best of the greedy plans, or the heuristic engine's plan when they all
+    get stuck on the merge cost limit (as they do with many books); None if
+    that finds none either.
+    """
+    plan = _greedy_plan(items, mode, options)
+    if plan is not None:
+        return plan
+    try:
+        return heuristic.plan(items[0], list(items[1:]), mode, options, _BEAM_WIDTH)
+    except IncompatibleSelected:
+        return None
+
+
+def _greedy_step(tgt: EnchantedItem, sac: EnchantedItem, options: PlannerOptions) -> Tuple[EnchantedItem, Step]:
+    merged, cost, xp = tgt.merge(sac, options=options)
+    return merged, Step(tgt, sac, cost, xp, merged.prior_penalty())
+
+
+def _greedy_result(steps: List[Step], final: EnchantedItem) -> MergePlan:
+    return MergePlan(steps, sum(s.cost_levels for s in steps), sum(s.cost_xp for s in steps),
+                     final.prior_penalty())
+
+
+def _balanced_rounds(items: List[EnchantedItem], options: PlannerOptions = DEFAULT_OPTIONS) -> MergePlan | None:
+    """
+    Merge in rounds: each round sorts the pool (non-books first, then by value,
+    heaviest first) and merges neighbours pairwise, lighter onto heavier.
+    """
+    pool = list(items)
+    steps: List[Step] = []
+    while len(pool) > 1:
+        pool.sort(key=lambda it: (it.item_type == "book", -it.value))
+        nxt = []
+        for i in range(0, len(pool) - 1, 2):
+            try:
+                merged, step = _greedy_step(pool[i], pool[i + 1], options)
+            except (IncompatibleSelected, MergeTooExpensive, InvalidTarget):
+                return None
+            steps.append(step)
+            nxt.append(merged)
+        if len(pool) % 2:
+            nxt.append(pool[-1])
+        pool = nxt
+    return _greedy_result(steps, pool[0])
+
+
+def _cheapest_first(items: List[EnchantedItem], options: PlannerOptions = DEFAULT_OPTIONS) -> MergePlan | None:
+    """Repeatedly make the cheapest merge available."""
+    pool = list(items)
+    steps: List[Step] = []
+    while len(pool) > 1:
+        pick = None
+        for i, tgt in enumerate(pool):
+            for j, sac in enumerate(pool):
+                if i == j or (tgt.item_type == "book" and sac.item_type != "book"):
+                    continue
+                cost = tgt.merge_cost_levels(sac)
+                key = (cost, max(tgt.anvil_uses, sac.anvil_uses))
+                if cost <= options.max_merge_levels and (pick is None or key < pick[0]):
+                    pick = (key, i, j)
+        if pick is None:
+            return None
+        _, i, j = pick
+        try:
+            merged, step = _greedy_step(pool[i], pool[j], options)
+        except (IncompatibleSelected, MergeTooExpensive, InvalidTarget):
+            return None
+        steps.append(step)
+        pool = [it for k, it in enumerate(pool) if k not in (i, j)] + [merged]
+    return _greedy_result(steps, pool[0])
+
+
+def encode_item(item: EnchantedItem) -> tuple:
+    """The search state of ``item``: (item type, packed levels, present bits, anvil uses)."""
+    return (item.item_type,) + packed.encode(item.enchants) + (item.anvil_uses,)
+
+
+def _decode(state: tuple) -> EnchantedItem:
+    return packed.decode(state[0], state[1], state[3])
+
+
+def decode_steps(node: Node, steps: List[Step]) -> EnchantedItem:
+    """Append the steps building ``node`` to ``steps`` (sub-plans first) and return its item."""
+    state, tnode, snode, cost_lv = node
+    if tnode is None:
+        return _decode(state)
+    left = decode_steps(tnode, steps)
+    right = decode_steps(snode, steps)
+    merged = _decode(state)
+    steps.append(Step(left, right, cost_lv, xp_from_levels(cost_lv), merged.prior_penalty()))
+    return merged
+
+
+def _decode_solutions(solutions) -> Dict[int, Tuple[List[Step], int, int, EnchantedItem]]:
+    out = {}
+    for w, (lv, xp, node) in solutions.items():
+        steps: List[Step] = []
+        item = decode_steps(node, steps)
+        out[w] = (steps, lv, xp, item)
+    return out
+
+
+def _search(initial: EnchantedItem, books: List[EnchantedItem], incumbent: Tuple[str, int, int] | None = None,
+            options: PlannerOptions = DEFAULT_OPTIONS, stop: Callable[[], bool] | None = None,
+            pinned: Dict[tuple, dict] | None = None):
+    return _cheapest_single(tuple([initial] + books), incumbent, options, stop, pinned)
+
+
+def plan_enchants(base: EnchantedItem, desired: Dict[str, int], *, mode: str = "levels",
+                  bounded: bool = False, greedy_seed: bool = True,
+                  options: PlannerOptions = DEFAULT_OPTIONS, time_budget: float | None = None,
+                  deadline: float | None = None, cancel: threading.Event | None = None,
+                  pinned: Dict[tuple, dict] | None = None, engine: str = "dp") -> MergePlan:
+    """
+    Cheapest way to bring ``base`` up to ``desired`` under ``options``.
+
+    Plans are cached per request; the returned ``MergePlan`` may be shared
+    between callers and must be treated as read-only.
+
+    ``bounded`` runs a branch-and-bound search that skips states which cannot
+    beat an incumbent plan: the cached plan for the other mode if there is
+    one, and with ``greedy_seed`` the best of two greedy plans.  The result is
+    still optimal.
+
+    ``time_budget`` (seconds from now) and ``deadline`` (a ``time.monotonic``
+    value) bound the search, which then runs bounded.  If it finishes in time
+    the plan's warnings say it is optimal; otherwise the best plan found so
+    far is returned, warned as not proven optimal, and is not cached.
+    Setting ``cancel`` stops the search at its next check and raises
+    ``PlanCancelled``, so an abandoned request stops using the CPU.
+
+    ``pinned`` is a session sub-problem table; use ``plan_incremental``.
+
+    ``engine`` picks the search: ``"dp"``, the subset DP, or ``"shapes"``,
+    which searches merge-tree shapes instead (see ``shapes``) and scales to
+    many more books.  Both give plans with the same levels and prior work.
+    When ``shapes`` cannot prove its plan it runs the DP, unless there are
+    too many books for that; the plan it found is then warned as
+    ``SHAPES_NOT_PROVEN``.  ``"heuristic"`` (see ``heuristic``) plans fifteen
+    or more books in milliseconds but only near-optimally: its plans are
+    warned as ``HEURISTIC_PLAN`` and carry a ``lower_bound`` on the levels.
+
+    While ``stats`` collection is on, the plan comes back as a copy carrying
+    the collection's ``SearchStats``.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'")
+    if time_budget is not None:
+        end = time.monotonic() + time_budget
+        deadline = end if deadline is None else min(deadline, end)
+    args = (base, desired, mode, bounded, greedy_seed, options, deadline, cancel, pinned, engine)
+    st = stats.current()
+    if st is None:
+        if not stats.enabled():
+            return _plan_enchants(*args)
+        with stats.collect() as st:
+            return _plan_with_stats(st, args)
+    return _plan_with_stats(st, args)
+
 
-                    w = merged.anvil_uses
-                    tot_lv = llv + rlv + cost_lv
-                    tot_xp = lxp + rxp + cost_xp
-                    step = Step(litem, ritem, cost_lv, cost_xp, merged.prior_penalty())
-                    cand = (lsteps + rsteps + [step], tot_lv, tot_xp, merged)
+def _plan_with_stats(st: stats.SearchStats, args: tuple) -> MergePlan:
+    st.count("plans")
+    try:
+        with st.timer("plan"):
+            plan = _plan_enchants(*args)
+    except IncompatibleSelected:
+        st.count("incompatible_selected")
+        raise
+    return dataclasses.replace(plan, stats=st)
 
-                    if w not in best or best[w][1] > tot_lv:
-                        best[w] = cand
 
-    return best
+def _plan_enchants(base: EnchantedItem, desired: Dict[str, int], mode: str, bounded: bool, greedy_seed: bool,
+                   options: PlannerOptions, deadline: float | None, cancel: threading.Event | None,
+                   pinned: Dict[tuple, dict] | None, engine: str = "dp") -> MergePlan:
+    st = stats.current()
+    if cancel is not None and cancel.is_set():
+        raise PlanCancelled("Planning was cancelled.")
+    key = plan_key(base, desired, mode, options, engine)
+    plan = _TABLE.get(key)
+    if plan is not None:
+        if st is not None:
+            st.count("plan_table_hits")
+        return _proven(plan, deadline)
+    plan = _PLANS.get(key)
+    if plan is not None:
+        if st is not None:
+            st.count("plan_cache_hits")
+        return _proven(plan, deadline)
+    if _STORE is not None:
+        plan = _STORE.get(store_key(key))
+        if plan is not None:
+            if st is not None:
+                st.count("plan_store_hits")
+            _PLANS.put(key, plan)
+            return _proven(plan, deadline)
+    front = _FRONTS.get(key[:2] + key[3:4])
+    if front is not None:
+        if st is not None:
+            st.count("front_cache_hits")
+        plan = pick_plan(front, mode)
+        _PLANS.put(key, plan)
+        if _STORE is not None:
+            _STORE.put(store_key(key), plan)
+    else:
+        stop = stopper(deadline, cancel)
+        try:
+            plan = _coalesced(key, lambda: _plan_uncached(base, desired, mode, bounded or stop is not None,
+                                                          greedy_seed, options, stop, pinned, engine), stop)
+        except _Interrupted as e:
+            if cancel is not None and cancel.is_set():
+                if st is not None:
+                    st.count("cancelled")
+                raise PlanCancelled("Planning was cancelled.") from None
+            if st is not None:
+                st.count("deadline_expired")
+            return _best_so_far(base, desired, mode, options, e.partial)
+    return _proven(plan, deadline)
 
 
-def _search(initial: EnchantedItem, books: List[EnchantedItem]):
-    return _cheapest_single(tuple([initial] + books))
+def _coalesced(key: tuple, search: Callable[[], MergePlan], stop: Callable[[], bool] | None) -> MergePlan:
+    """
+    ``search()`` for plan ``key``, run once however many requests for it
+    arrive meanwhile: other threads of this process wait for it and share
+    its plan or error, and with a plan store other workers wait on its lock
+    file and read the plan from the store.  A search cut short by its own
+    time budget or cancel is not shared; the next request in line searches
+    instead.  Raises ``_Interrupted`` if ``stop`` fires while waiting.
+    """
+    st = stats.current()
+    try:
+        plan, shared = _FLIGHTS.do(key, lambda: _kept(key, search, stop), stop, retry=(_Interrupted,))
+    except singleflight.Abandoned:
+        raise _Interrupted([]) from None
+    if shared and st is not None:
+        st.count("coalesced")
+    return plan
 
 
-def plan_enchants(base: EnchantedItem, desired: Dict[str, int], *, mode: str = "levels") -> MergePlan:
+def _kept(key: tuple, search: Callable[[], MergePlan], stop: Callable[[], bool] | None) -> MergePlan:
+    """
+    ``search()`` with its plan put in the plan cache and the store before
+    anyone waiting is let go, behind the key's lock file when there is one.
+    """
+    if _STORE is None:
+        plan = search()
+    elif _HOST_LOCK is None:
+        plan = search()
+        _STORE.put(store_key(key), plan)
+    else:
+        skey = store_key(key)
+        with _HOST_LOCK.hold(skey, stop):
+            # another worker may have stored this very plan since the lookup before the lock
+            plan = _STORE.get(skey)
+            if plan is not None:
+                st = stats.current()
+                if st is not None:
+                    st.count("coalesced")
+            else:
+                plan = search()
+                _STORE.put(skey, plan)
+    _PLANS.put(key, plan)
+    return plan
+
+
+def stopper(deadline: float | None, cancel: threading.Event | None) -> Callable[[], bool] | None:
+    """The ``stop`` check for a search until ``deadline`` or ``cancel``; None if there is neither."""
+    if cancel is None:
+        return None if deadline is None else lambda: time.monotonic() >= deadline
+    if deadline is None:
+        return cancel.is_set
+    return lambda: cancel.is_set() or time.monotonic() >= deadline
+
+
+def _proven(plan: MergePlan, deadline: float | None) -> MergePlan:
+    """``plan`` marked optimal when it was asked for under a time budget and is."""
+    if deadline is None or HEURISTIC_PLAN in plan.warnings or SHAPES_NOT_PROVEN in plan.warnings:
+        return plan
+    return dataclasses.replace(plan, warnings=plan.warnings + [OPTIMAL])
+
+
+def _best_so_far(base: EnchantedItem, desired: Dict[str, int], mode: str, options: PlannerOptions,
+                 partial: _Partial) -> MergePlan:
+    """
+    Best plan known when a search ran out of time: the greedy plans (or the
+    heuristic one, see ``_seed_plan``), and the best few sub-plans of every
+    layer it finished, each completed by merging in the remaining items
+    greedily.  A search that got further never returns a worse plan.
+    """
+    items = [base] + missing_books(base, desired)
+    best = _seed_plan(items, mode, options)
+    candidates = []
+    for layer in partial:
+        found = []
+        for subset, solutions in layer:
+            # the item being enchanted has to be in the sub-plan it grows from
+            if base.item_type != "book" and base not in subset:
+                continue
+            for w, (lv, xp, node) in solutions.items():
+                found.append(((w, lv, xp) if mode == "prior_work" else (lv, w, xp), subset, lv, xp, node))
+        found.sort(key=lambda c: c[0])
+        candidates += found[:_COMPLETIONS]
+
+    for _, subset, lv, xp, node in candidates:
+        steps: List[Step] = []
+        item = decode_steps(node, steps)
+        rest = list((Counter(items) - Counter(subset)).elements())
+        tail = _cheapest_first([item] + rest, options)
+        if tail is None:
+            continue
+        plan = MergePlan(steps + tail.steps, lv + tail.total_levels, xp + tail.total_xp, tail.final_prior_work)
+        if best is None or _plan_rank(plan, mode) < _plan_rank(best, mode):
+            best = plan
+    if best is None:
+        raise RuntimeError("No valid anvil order found within the time budget.")
+    return dataclasses.replace(best, warnings=best.warnings + [NOT_PROVEN_OPTIMAL])
+
+
+def _incumbent(base: EnchantedItem, desired: Dict[str, int], mode: str, books: List[EnchantedItem],
+               greedy_seed: bool, options: PlannerOptions = DEFAULT_OPTIONS) -> Tuple[str, int, int] | None:
+    seeds = []
+    for other in ("levels", "prior_work"):
+        key = plan_key(base, desired, other, options)
+        plan = _TABLE.get(key) or _PLANS.get(key)
+        if plan is not None and plan.steps:
+            seeds.append((plan.total_levels, plan.final_prior_work.bit_length()))
+    if greedy_seed:
+        greedy = _greedy_incumbent([base] + books, mode, options)
+        if greedy is not None:
+            seeds.append(greedy[1:])
+    if not seeds:
+        return None
+    if mode == "prior_work":
+        uses, lv = min((uses, lv) for lv, uses in seeds)
+    else:
+        lv, uses = min(seeds)
+    return mode, lv, uses
+
+
+def missing_books(base: EnchantedItem, desired: Dict[str, int]) -> List[EnchantedItem]:
+    """One book per enchant ``base`` lacks at the ``desired`` level; ``ValueError`` if one cannot be had."""
     # validate desired
     for ns, lv in desired.items():
-        max_lv = ENCHANTMENTS[ns]["levelMax"]
-        if lv < 1 or lv > max_lv:
+        if lv < 1 or lv > CATALOG.level_max[CATALOG.ids[ns]]:
             raise ValueError(f"Invalid level {lv} for {ns}")
-        if not base.item_type in ENCHANTMENTS[ns]["items"] and base.item_type != "book":
+        if not CATALOG.can_have(ns, base.item_type):
             raise ValueError(f"{base.item_type} cannot get {ns}")
 
     # build missing books
@@ -61,11 +1208,50 @@ def plan_enchants(base: EnchantedItem, desired: Dict[str, int], *, mode: str = "
         cur_lv = base.enchants.get(ns, 0)
         if cur_lv < lv:
             missing.append(EnchantedItem.book(ns, lv))
+    return missing
+
 
+def _plan_uncached(base: EnchantedItem, desired: Dict[str, int], mode: str,
+                   bounded: bool = False, greedy_seed: bool = True,
+                   options: PlannerOptions = DEFAULT_OPTIONS, stop: Callable[[], bool] | None = None,
+                   pinned: Dict[tuple, dict] | None = None, engine: str = "dp") -> MergePlan:
+    missing = missing_books(base, desired)
     if not missing:
         return MergePlan([], 0, 0, base.prior_penalty())
+    _check_uses((base,), options.max_merge_levels)
 
-    solutions = _search(base, missing)
+    st = stats.current()
+    if engine == "heuristic":
+        if st is not None:
+            st.count("heuristic_searches")
+        plan = heuristic.plan(base, missing, mode, options, _BEAM_WIDTH, stop)
+        if stop is not None and stop():
+            raise _Interrupted([])
+        return _heuristic_plan(plan, base, missing, mode, options)
+    if engine == "shapes":
+        if st is not None:
+            st.count("shape_searches")
+        found = shapes.plan(base, missing, mode, options, stop)
+        if found is not None:
+            plan, proven = found
+            if proven:
+                return plan
+            if len(missing) > _SHAPES_DP_BOOKS:
+                if st is not None:
+                    st.count("shape_unproven")
+                return _shapes_unproven(plan, [base] + missing, mode, options)
+        if stop is not None and stop():
+            raise _Interrupted([])
+        if st is not None:
+            st.count("shape_fallbacks")
+    if st is not None:
+        st.count("searches")
+    incumbent = _incumbent(base, desired, mode, missing, greedy_seed, options) if bounded else None
+    if st is None:
+        solutions = _search(base, missing, incumbent, options, stop, pinned)
+    else:
+        with st.timer("search"):
+            solutions = _search(base, missing, incumbent, options, stop, pinned)
     if not solutions:
         raise RuntimeError("No valid anvil order—cost too high.")
 
@@ -85,3 +1271,302 @@ def plan_enchants(base: EnchantedItem, desired: Dict[str, int], *, mode: str = "
 
     _, steps, tot_lv, tot_xp, final = pick  # type: ignore
     return MergePlan(steps, tot_lv, tot_xp, final.prior_penalty())
+
+
+def _shapes_unproven(plan: MergePlan | None, items: List[EnchantedItem], mode: str,
+                     options: PlannerOptions) -> MergePlan:
+    """The better of the shape search's plan and the greedy ones, warned as not proven optimal."""
+    greedy = _seed_plan(items, mode, options)
+    found = [p for p in (plan, greedy) if p is not None]
+    if not found:
+        raise RuntimeError("No valid anvil order found—cost too high.")
+    best = min(found, key=lambda p: _plan_rank(p, mode))
+    return dataclasses.replace(best, warnings=best.warnings + [SHAPES_NOT_PROVEN])
+
+
+def _heuristic_plan(plan: MergePlan | None, base: EnchantedItem, books: List[EnchantedItem], mode: str,
+                    options: PlannerOptions) -> MergePlan:
+    """The better of the heuristic plan and the greedy ones, warned and given the lower bound."""
+    greedy = _greedy_plan([base] + books, mode, options)
+    found = [p for p in (plan, greedy) if p is not None]
+    if not found:
+        raise RuntimeError("No valid anvil order found—cost too high.")
+    best = min(found, key=lambda p: _plan_rank(p, mode))
+    return dataclasses.replace(best, warnings=best.warnings + [HEURISTIC_PLAN],
+                               lower_bound=heuristic.lower_bound(base, books, options.max_merge_levels))
+
+
+def plan_incremental(base: EnchantedItem, desired: Dict[str, int], token: str | None = None,
+                     **kwargs) -> Tuple[MergePlan, str]:
+    """
+    ``plan_enchants`` for edit-and-recalculate sessions; returns the plan and
+    the session token to send with the next request.
+
+    Every sub-problem a session's request uses is pinned in a table kept
+    under its token, so when the next request adds, removes or changes one
+    book only the subsets holding that book are solved, even if the shared
+    cache has evicted the rest meanwhile.  Entries the new request cannot
+    use are dropped.  An unknown or expired token starts a new session.
+    """
+    pinned = _SESSIONS.get(token) if token else None
+    if pinned is None:
+        token = secrets.token_urlsafe(16)
+        pinned = {}
+    plan = plan_enchants(base, desired, pinned=pinned, **kwargs)
+    _retain(pinned, [base] + missing_books(base, desired), kwargs.get("options", DEFAULT_OPTIONS))
+    # put again so the session is weighed by its current size
+    _SESSIONS.put(token, pinned)
+    return plan, token
+
+
+def _retain(pinned: Dict[tuple, dict], items: List[EnchantedItem], options: PlannerOptions) -> None:
+    """Drop the session entries that are not subsets of ``items`` under ``options``."""
+    have = Counter(items)
+    for key in list(pinned):
+        key_options, subset = key
+        if key_options != options or any(have[it] < n for it, n in Counter(subset).items()):
+            pinned.pop(key, None)
+
+
+def plan_front(base: EnchantedItem, desired: Dict[str, int], *,
+               options: PlannerOptions = DEFAULT_OPTIONS, time_budget: float | None = None,
+               deadline: float | None = None, cancel: threading.Event | None = None) -> List[MergePlan]:
+    """
+    Every plan not dominated on (total levels, total xp, final prior work),
+    fewest levels first, from a single search.
+
+    Each mode's ``plan_enchants`` answer is one of these (see ``pick_plan``),
+    so once a front is cached both modes are served from it.  The list and
+    its plans may be shared between callers and must be treated as read-only.
+    Stats are attached to each plan as in ``plan_enchants``.
+
+    ``time_budget``, ``deadline`` and ``cancel`` work as in ``plan_enchants``.
+    Out of time, the front is made of the best plan found for each mode,
+    warned as not proven optimal, and is not cached.
+    """
+    if time_budget is not None:
+        end = time.monotonic() + time_budget
+        deadline = end if deadline is None else min(deadline, end)
+    args = (base, desired, options, deadline, cancel)
+    st = stats.current()
+    if st is None:
+        if not stats.enabled():
+            return _plan_front(*args)
+        with stats.collect() as st:
+            return _front_with_stats(st, args)
+    return _front_with_stats(st, args)
+
+
+def _front_with_stats(st: stats.SearchStats, args: tuple) -> List[MergePlan]:
+    st.count("fronts")
+    try:
+        with st.timer("plan"):
+            front = _plan_front(*args)
+    except IncompatibleSelected:
+        st.count("incompatible_selected")
+        raise
+    return [dataclasses.replace(plan, stats=st) for plan in front]
+
+
+def _plan_front(base: EnchantedItem, desired: Dict[str, int], options: PlannerOptions,
+                deadline: float | None = None, cancel: threading.Event | None = None) -> List[MergePlan]:
+    st = stats.current()
+    if cancel is not None and cancel.is_set():
+        raise PlanCancelled("Planning was cancelled.")
+    key = (base.signature, tuple(sorted(desired.items())), options)
+    front = _FRONTS.get(key)
+    if front is not None:
+        if st is not None:
+            st.count("front_cache_hits")
+        return front
+
+    missing = missing_books(base, desired)
+    if not missing:
+        front = [MergePlan([], 0, 0, base.prior_penalty())]
+    else:
+        if st is not None:
+            st.count("searches")
+        front = []
+        try:
+            found = _pareto_single(tuple([base] + missing), options, stopper(deadline, cancel))
+        except _Interrupted:
+            if cancel is not None and cancel.is_set():
+                if st is not None:
+                    st.count("cancelled")
+                raise PlanCancelled("Planning was cancelled.") from None
+            if st is not None:
+                st.count("deadline_expired")
+            return _front_so_far(base, desired, options)
+        for lv, xp, node in found:
+            steps: List[Step] = []
+            final = decode_steps(node, steps)
+            front.append(MergePlan(steps, lv, xp, final.prior_penalty()))
+        if not front:
+            raise RuntimeError("No valid anvil order—cost too high.")
+    _FRONTS.put(key, front)
+    return front
+
+
+def _front_so_far(base: EnchantedItem, desired: Dict[str, int], options: PlannerOptions) -> List[MergePlan]:
+    """The best plans known for each mode when a front search ran out of time, fewest levels first."""
+    front: List[MergePlan] = []
+    for plan in sorted((_best_so_far(base, desired, mode, options, []) for mode in ("levels", "prior_work")),
+                       key=lambda p: _plan_rank(p, "levels")):
+        if not any(p.total_levels <= plan.total_levels and p.total_xp <= plan.total_xp
+                   and p.final_prior_work <= plan.final_prior_work for p in front):
+            front.append(plan)
+    return front
+
+
+def pick_plan(front: List[MergePlan], mode: str = "levels") -> MergePlan:
+    """The plan ``plan_enchants`` returns for ``mode``, taken from a Pareto front."""
+    return min(front, key=lambda p: _plan_rank(p, mode))
+
+
+def _plan_rank(plan: MergePlan, mode: str) -> Tuple[int, int, int]:
+    """Sort key of ``plan`` under ``mode``, best first."""
+    if mode == "prior_work":
+        return plan.final_prior_work, plan.total_levels, plan.total_xp
+    return plan.total_levels, plan.final_prior_work, plan.total_xp
+
+
+def _pareto_insert(frontier: list, lv: int, xp: int, entry: tuple) -> bool:
+    """
+    Add ``entry`` to a (levels, xp) frontier kept sorted by levels unless an
+    existing entry is at least as good on both; drops entries it dominates.
+    """
+    for i, (flv, fxp, _) in enumerate(frontier):
+        if flv <= lv and fxp <= xp:
+            return False
+        if flv >= lv:
+            break
+    else:
+        i = len(frontier)
+    j = i
+    while j < len(frontier) and frontier[j][1] >= xp:
+        j += 1
+    frontier[i:j] = [(lv, xp, entry)]
+    return True
+
+
+def _pareto_single(work_tuple: Tuple[EnchantedItem, ...], options: PlannerOptions = DEFAULT_OPTIONS,
+                   stop: Callable[[], bool] | None = None) -> List[Tuple[int, int, Node]]:
+    """
+    Subset DP like ``_cheapest_single``, but each (mask, anvil uses) slot keeps
+    its whole (levels, xp) Pareto frontier instead of one winner.  Levels and
+    xp both add up over sub-plans, so frontiers built from frontiers are
+    complete.  Returns the final ``(levels, xp, node)`` entries not dominated
+    once prior work is compared too.  Raises ``_Interrupted`` when ``stop``
+    fires; a partial front is of no use, so nothing comes with it.
+    """
+    items = _canonical(work_tuple)
+    n = len(items)
+    if stop is not None and (n > _BOUNDED_MAX_ITEMS or stop()):
+        raise _Interrupted([])
+    full = (1 << n) - 1
+    limit = options.max_merge_levels
+    xp_cost = xp_costs(limit)
+    _check_uses(items, limit)
+    width = _max_uses(limit) + 1
+
+    size = (full + 1) * width
+    # per slot: list of (levels, xp, node), levels ascending and xp descending
+    front: List[list | None] = [None] * size
+    levels: List[int] = [0] * size
+    present: List[int] = [0] * size
+    penalty: List[int] = [0] * size
+    value: List[int] = [0] * size
+    uses_of: List[List[int]] = [[] for _ in range(full + 1)]
+    is_book: List[bool] = [True] * (full + 1)
+
+    for i, item in enumerate(items):
+        bit = 1 << i
+        slot = bit * width + item.anvil_uses
+        state = encode_item(item)
+        front[slot] = [(0, 0, (state, None, None, 0))]
+        levels[slot], present[slot] = state[1], state[2]
+        penalty[slot] = item.prior_penalty()
+        value[slot] = item.value
+        uses_of[bit].append(item.anvil_uses)
+        if item.item_type != "book":
+            for mask in range(bit, full + 1):
+                if mask & bit:
+                    is_book[mask] = False
+
+    tried = over_cap = 0
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        if mask == low:
+            continue
+        if stop is not None and stop():
+            raise _Interrupted([])
+        mask_base = mask * width
+        # candidates hold (target node, sacrifice node, cost) until the mask is done
+        pending: Dict[int, list] = {}
+        origin: Dict[int, Tuple[int, int]] = {}
+
+        rest = mask ^ low
+        sub = rest
+        while True:
+            left = sub | low
+            right = mask ^ left
+            if right:
+                pairs = ((left, right), (right, left)) if is_book[left] == is_book[right] else (
+                    ((right, left),) if is_book[left] else ((left, right),))
+                for tgt, sac in pairs:
+                    for tw in uses_of[tgt]:
+                        tslot = tgt * width + tw
+                        for sw in uses_of[sac]:
+                            sslot = sac * width + sw
+                            cost_lv = penalty[tslot] + penalty[sslot] + value[sslot]
+                            if cost_lv > limit:
+                                tried += 1
+                                over_cap += 1
+                                continue
+                            cost_xp = xp_cost[cost_lv]
+                            w = (tw if tw > sw else sw) + 1
+                            frontier = pending.setdefault(w, [])
+                            origin.setdefault(w, (tslot, sslot))
+                            tried += len(front[tslot]) * len(front[sslot])
+                            for tlv, txp, tnode in front[tslot]:
+                                for slv, sxp, snode in front[sslot]:
+                                    _pareto_insert(frontier, tlv + slv + cost_lv, txp + sxp + cost_xp,
+                                                   (tnode, snode, cost_lv))
+            if not sub:
+                break
+            sub = (sub - 1) & rest
+
+        for w, frontier in pending.items():
+            tslot, sslot = origin[w]
+            if not uses_of[mask]:
+                # the merged enchant set only depends on the mask
+                clash = packed.conflicts(present[tslot] | present[sslot])
+                if clash and not options.allow_incompatible:
+                    raise IncompatibleSelected(clash)
+            # books from missing_books never share an enchant, so every
+            # candidate for this slot merges to the same enchant set
+            state = (
+                front[tslot][0][2][0][0],
+                packed.merge(levels[tslot], levels[sslot], present[sslot]),
+                present[tslot] | present[sslot],
+                w,
+            )
+            slot = mask_base + w
+            front[slot] = [(lv, xp, (state,) + entry) for lv, xp, entry in frontier]
+            levels[slot], present[slot] = state[1], state[2]
+            penalty[slot] = (1 << w) - 1
+            value[slot] = packed.value(state[1])
+            uses_of[mask].append(w)
+
+    st = stats.current()
+    if st is not None:
+        st.count("merges_tried", tried)
+        st.count("merges_over_cap", over_cap)
+
+    final = []
+    for w in sorted(uses_of[full]):
+        for lv, xp, node in front[full * width + w]:
+            if not any(flv <= lv and fxp <= xp for flv, fxp, _ in final):
+                final.append((lv, xp, node))
+    final.sort(key=lambda e: (e[0], e[1]))
+    return final
@@ -0,0 +1,91 @@
+"""
+Compiled enchantment catalog, built once at import from ``data.ENCHANTMENTS``.
+
+Enchants get dense integer ids (in ``ENCHANTMENTS`` order) and every
+per-enchant fact becomes a tuple indexed by id: weight, max level and an
+incompatibility row holding bit ``j`` for each enchant ``j`` it clashes with.
+Each item type maps to the bitset of enchant ids it can take, so "can this
+item have it" and "do these clash" are bit operations instead of string-keyed
+lookups and list scans.  ``packed`` uses the same ids for its level fields.
+"""
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from .data import ENCHANTMENTS
+
+
+@dataclass(frozen=True)
+class Catalog:
+    names: Tuple[str, ...]
+    ids: Mapping[str, int]
+    # every item type an enchant applies to, sorted; books are not listed
+    item_types: Tuple[str, ...]
+    weight: Tuple[int, ...]
+    level_max: Tuple[int, ...]
+    incompat: Tuple[int, ...]
+    # item type -> bitset of the enchant ids it can take ("book" takes all)
+    applicable: Mapping[str, int]
+
+    @staticmethod
+    def build(enchantments: Dict[str, dict]) -> "Catalog":
+        names = tuple(enchantments)
+        ids = {ns: i for i, ns in enumerate(names)}
+        incompat = [0] * len(names)
+        applicable: Dict[str, int] = {}
+        for ns, meta in enchantments.items():
+            eid = ids[ns]
+            for other in meta["incompatible"]:
+                # a clash counts both ways even if only one side lists it
+                incompat[eid] |= 1 << ids[other]
+                incompat[ids[other]] |= 1 << eid
+            for item_type in meta["items"]:
+                applicable[item_type] = applicable.get(item_type, 0) | 1 << eid
+        item_types = tuple(sorted(it for it in applicable if it != "book"))
+        applicable["book"] = (1 << len(names)) - 1
+        return Catalog(
+            names=names,
+            ids=MappingProxyType(ids),
+            item_types=item_types,
+            weight=tuple(int(enchantments[ns]["weight"]) for ns in names),
+            level_max=tuple(int(enchantments[ns]["levelMax"]) for ns in names),
+            incompat=tuple(incompat),
+            applicable=MappingProxyType(applicable),
+        )
+
+    def present(self, enchants: Iterable[str]) -> int:
+        """Bitset of ``enchants``; ``KeyError`` for an unknown name."""
+        bits = 0
+        for ns in enchants:
+            bits |= 1 << self.ids[ns]
+        return bits
+
+    def can_have(self, ns: str, item_type: str) -> bool:
+        return bool(self.applicable.get(item_type, 0) >> self.ids[ns] & 1)
+
+    def clashes(self, present: int) -> bool:
+        bits = present
+        while bits:
+            low = bits & -bits
+            if self.incompat[low.bit_length() - 1] & present:
+                return True
+            bits ^= low
+        return False
+
+    def conflicts(self, present: int) -> List[Tuple[str, str]]:
+        """Incompatible pairs in an enchant bitset, in id order; empty when compatible."""
+        out: List[Tuple[str, str]] = []
+        bits = present
+        while bits:
+            low = bits & -bits
+            eid = low.bit_length() - 1
+            bits ^= low
+            clash = self.incompat[eid] & bits
+            while clash:
+                other = clash & -clash
+                out.append((self.names[eid], self.names[other.bit_length() - 1]))
+                clash ^= other
+        return out
+
+
+CATALOG = Catalog.build(ENCHANTMENTS)
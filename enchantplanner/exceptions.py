@@ -8,3 +8,7 @@ class MergeTooExpensive(Exception):
 
 class IncompatibleSelected(Exception):
     """Raised when two incompatible enchants end up together."""
+
+
+class PlanCancelled(Exception):
+    """Raised when a plan's cancel event is set before the search finishes."""
@@ -0,0 +1,529 @@
+"""
+Heuristic planner, ``plan_enchants(..., engine="heuristic")``.
+
+For enchant sets too large for an exact search.  Plans are costed the way
+``shapes`` sees them: a merge pays both prior-work penalties and the
+sacrifice's value, and a merged item is worth the sum of what went into it.
+Four searches feed each other:
+
+* greedy balanced pairing: merge in rounds, each pairing the most valuable
+  item left with the least valuable one, so merged items stay even;
+* a beam search over merge forests, keeping the ``width`` partial plans with
+  the best levels so far plus a lower bound on the rest (or, when the merge
+  cost limit leaves none of them a way to finish, a bounded backtracking
+  search);
+* repair of the beam search's best plan ignoring the limit: local search
+  on how far its merges go over the limit, which may also move part of an
+  over-limit merge's sacrifice elsewhere, until none does;
+* local search on the best of those trees: swapping leaves, swapping a
+  merge's target and sacrifice, and rotating merges, while that helps.
+
+The winner is replayed through ``EnchantedItem.merge``, so the plan's costs
+are the real ones.  ``lower_bound`` bounds the levels of any plan, which
+``plan_enchants`` reports as the plan's gap.
+"""
+import heapq
+import itertools
+import math
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+from .catalog import CATALOG
+from .exceptions import IncompatibleSelected, InvalidTarget, MergeTooExpensive
+from .models import EnchantedItem, Step, MergePlan, PlannerOptions
+from .shapes import min_tree_penalty
+from .utils import weight, xp_from_levels
+
+# partial plans the beam search keeps per merge
+BEAM_WIDTH = 8
+# local search stops after this many improving moves
+MAX_MOVES = 200
+# partial plans the backtracking search may visit
+BACKTRACK_STATES = 2000
+# a merge cost limit nothing reaches, for searching as if there were none
+_NO_LIMIT = 1 << 30
+
+# leaves are indices into the item list (the base is 0); merges are (target, sacrifice)
+_Tree = int | tuple
+# a tree still to be merged: (tree, anvil uses, value, holds the base item)
+_Part = Tuple[_Tree, int, int, bool]
+
+
+def lower_bound(base: EnchantedItem, books: List[EnchantedItem], limit: int = 1000) -> int:
+    """
+    Least levels any plan merging ``books`` onto ``base`` under the merge
+    cost limit can cost (see ``_rest_bound``).  An enchant several of them
+    hold is only counted on the one with the highest level of it: whatever
+    it is merged into has it at least that high.
+    """
+    items = [base] + books
+    owner: Dict[str, int] = {}
+    for i, item in enumerate(items):
+        for ns, lv in item.enchants.items():
+            if ns not in owner or lv > items[owner[ns]].enchants[ns]:
+                owner[ns] = i
+    worth = [sum(lv * weight(ns) for ns, lv in item.enchants.items() if owner[ns] == i)
+             for i, item in enumerate(items)]
+    leaves = [(i, uses, value, False) for i, (uses, value) in enumerate(zip((b.anvil_uses for b in items), worth))]
+    if base.item_type != "book":
+        leaves[0] = (0, base.anvil_uses, 0, True)
+    return _rest_bound(leaves, limit)
+
+
+def plan(base: EnchantedItem, books: List[EnchantedItem], mode: str, options: PlannerOptions,
+         width: int = BEAM_WIDTH, stop: Callable[[], bool] | None = None) -> MergePlan | None:
+    """
+    The best plan the heuristics find for merging ``books`` onto ``base``, or
+    None if none stays under the merge cost limit.  ``stop`` cuts the beam
+    search and local search short.
+    """
+    if not options.allow_incompatible:
+        present = CATALOG.present(base.enchants) | CATALOG.present(ns for b in books for ns in b.enchants)
+        clash = CATALOG.conflicts(present)
+        if clash:
+            raise IncompatibleSelected(clash)
+    items = [base] + books
+    leaves = _leaves(base, books)
+    limit = options.max_merge_levels
+
+    def rank(cost: Tuple[int, int, int]) -> tuple:
+        levels, uses, xp = cost
+        return (uses, levels, xp) if mode == "prior_work" else (levels, uses, xp)
+
+    found: Dict[_Tree, tuple] = {}
+    # the best plan ignoring the limit, pulled back under it if it has to be
+    loose = _beam(leaves, _NO_LIMIT, width, rank, stop)
+    repaired = None if loose is None else _repair(loose, leaves, limit, rank, stop)
+    beam = None
+    if repaired is not loose:
+        # when the merge cost limit kills the whole beam, backtracking may still get through
+        beam = _beam(leaves, limit, width, rank, stop) or _backtrack(leaves, limit, stop)
+    for tree in (_balanced(leaves, limit), beam, repaired):
+        if tree is None:
+            continue
+        tree = _improve(tree, leaves, limit, rank, stop)
+        found[tree] = rank(_evaluate(tree, leaves, limit))
+    # the cost model is exact for the usual inputs; a plan it got wrong is skipped
+    for tree in sorted(found, key=found.get):
+        try:
+            return _build(tree, items, options)
+        except (IncompatibleSelected, MergeTooExpensive, InvalidTarget):
+            continue
+    return None
+
+
+def _leaves(base: EnchantedItem, books: List[EnchantedItem]) -> List[_Part]:
+    # an item is never a sacrifice, so only a base book is worth anything
+    pinned = base.item_type != "book"
+    out = [(0, base.anvil_uses, 0 if pinned else base.value, pinned)]
+    return out + [(i + 1, book.anvil_uses, book.value, False) for i, book in enumerate(books)]
+
+
+def _rest_bound(forest: List[_Part], limit: int) -> int:
+    """
+    Lower bound on the levels of merging ``forest`` into one item.  Each part
+    pays its own prior-work penalty once, and the merges in between at least
+    ``shapes.min_tree_penalty``.  In a tree ``height`` merges high at most
+    ``comb(height, j)`` parts are sacrificed ``j`` times, so the parts pay at
+    least their values sorted against those counts; the base item is the one
+    part never sacrificed if it is here.  The tree's height is not known, so
+    this is the least over every height the limit allows.
+    """
+    parts = len(forest)
+    if parts < 2:
+        return 0
+    pinned = any(part[3] for part in forest)
+    paid = [0]
+    for value in sorted((value for _, _, value, pin in forest if not pin), reverse=True):
+        paid.append(paid[-1] + value)
+    low = (parts - 1).bit_length()
+    # both sides of the last merge pay their penalty, so neither was used more than this
+    high = max(low, min(parts - 1, (limit + 1).bit_length()))
+    best = None
+    for height in range(low, high + 1):
+        penalty = min_tree_penalty(parts, height)
+        if best is not None and penalty >= best:
+            break  # higher trees pay at least this much in penalties alone
+        # the most valuable part is never sacrificed, unless the base item is the one that is not
+        total, start = penalty, 0 if pinned else 1
+        for j in range(1, height + 1):
+            if start >= len(paid) - 1:
+                break
+            end = min(start + math.comb(height, j), len(paid) - 1)
+            total += j * (paid[end] - paid[start])
+            start = end
+        best = total if best is None else min(best, total)
+    return best + sum((1 << uses) - 1 for _, uses, _, _ in forest)
+
+
+def _uses_bound(forest: List[_Part]) -> int:
+    """Least anvil uses the item merged from ``forest`` can have."""
+    if len(forest) < 2:
+        return forest[0][1]
+    return (sum(1 << uses for _, uses, _, _ in forest) - 1).bit_length()
+
+
+def _merge(target: _Part, sacrifice: _Part) -> Tuple[_Part, int]:
+    cost = (1 << target[1]) - 1 + (1 << sacrifice[1]) - 1 + sacrifice[2]
+    return ((target[0], sacrifice[0]), max(target[1], sacrifice[1]) + 1, target[2] + sacrifice[2], target[3]), cost
+
+
+def _balanced(leaves: List[_Part], limit: int) -> _Tree | None:
+    """Greedy balanced pairing, or None if a merge breaks the limit."""
+    pool = list(leaves)
+    while len(pool) > 1:
+        # the base item first: it has to stay a target
+        pool.sort(key=lambda part: (not part[3], -part[2]))
+        half = len(pool) // 2
+        nxt = pool[half:len(pool) - half]
+        for i in range(half):
+            merged, cost = _merge(pool[i], pool[-1 - i])
+            if cost > limit:
+                return None
+            nxt.append(merged)
+        pool = nxt
+    return pool[0][0]
+
+
+def _beam(leaves: List[_Part], limit: int, width: int, rank: Callable[[tuple], tuple],
+          stop: Callable[[], bool] | None) -> _Tree | None:
+    """Beam search over merge forests, or None if every partial plan got stuck."""
+    # (rank, levels, xp, forest); forests are kept sorted so equal ones meet
+    beam = [(None, 0, 0, tuple(sorted(leaves, key=_part_key)))]
+    for _ in range(len(leaves) - 1):
+        if stop is not None and stop():
+            return None
+        children: Dict[tuple, tuple] = {}
+        for _, levels, xp, forest in beam:
+            taken = 0
+            for _, i, j in _moves(forest, limit):
+                if taken == width:
+                    break
+                merged, cost = _merge(forest[i], forest[j])
+                rest = sorted([p for k, p in enumerate(forest) if k not in (i, j)] + [merged], key=_part_key)
+                if not _viable(rest, limit):
+                    continue
+                taken += 1
+                # the rest of the plan only depends on what the items are worth, not which books they hold
+                key = tuple(_part_key(p) for p in rest)
+                child_levels, child_xp = levels + cost, xp + xp_from_levels(cost)
+                score = rank((child_levels + _rest_bound(rest, limit), _uses_bound(rest), child_xp))
+                if key not in children or score < children[key][0]:
+                    children[key] = (score, child_levels, child_xp, tuple(rest))
+        if not children:
+            return None
+        beam = heapq.nsmallest(width, children.values(), key=lambda c: c[0])
+    return beam[0][3][0][0]
+
+
+def _backtrack(leaves: List[_Part], limit: int, stop: Callable[[], bool] | None) -> _Tree | None:
+    """
+    First plan a depth-first search finds, taking the cheapest merges first
+    and backing out of dead ends, within ``BACKTRACK_STATES``; None if none.
+    """
+    budget = BACKTRACK_STATES
+    seen = set()
+
+    def walk(forest: Tuple[_Part, ...]) -> _Tree | None:
+        nonlocal budget
+        if len(forest) == 1:
+            return forest[0][0]
+        for _, i, j in _moves(forest, limit):
+            if budget <= 0 or (stop is not None and stop()):
+                return None
+            merged, _ = _merge(forest[i], forest[j])
+            rest = tuple(sorted([p for k, p in enumerate(forest) if k not in (i, j)] + [merged], key=_part_key))
+            key = tuple(_part_key(p) for p in rest)
+            if key in seen or not _viable(rest, limit):
+                continue
+            seen.add(key)
+            budget -= 1
+            tree = walk(rest)
+            if tree is not None:
+                return tree
+        return None
+
+    return walk(tuple(sorted(leaves, key=_part_key)))
+
+
+def _moves(forest: Tuple[_Part, ...], limit: int) -> List[Tuple[int, int, int]]:
+    """``(cost, target, sacrifice)`` of every merge in ``forest`` under the limit, cheapest first."""
+    moves = []
+    for i, target in enumerate(forest):
+        for j, sacrifice in enumerate(forest):
+            if i == j or sacrifice[3]:
+                continue
+            uses = max(target[1], sacrifice[1]) + 1
+            cost = (1 << target[1]) - 1 + (1 << sacrifice[1]) - 1 + sacrifice[2]
+            if cost <= limit:
+                # the merged item pays its own penalty at least once more
+                moves.append((cost + (1 << uses) - 1, i, j))
+    moves.sort()
+    return moves
+
+
+def _viable(forest: List[_Part], limit: int) -> bool:
+    """
+    Whether ``forest`` might still be merged into one item under the limit.
+    Some part is the final target; every other part has to be sacrificed
+    somewhere, and all of them go into the final target by merges that each
+    carry at most the limit less the target's penalty, which grows with
+    every merge.
+    """
+    total = sum(part[2] for part in forest)
+    pinned = [part for part in forest if part[3]]
+    # too heavy to be sacrificed at all, so it has to be the final target
+    heavy = [part for part in forest if not part[3] and (1 << part[1]) - 1 + part[2] > limit]
+    if len(heavy) > (0 if pinned else 1):
+        return False
+    return any(total - spine[2] <= _capacity(spine[1], limit) for spine in pinned or heavy or forest)
+
+
+@lru_cache(maxsize=None)
+def _capacity(uses: int, limit: int) -> int:
+    """Most value an item with ``uses`` anvil uses can still take in under the limit."""
+    out = 0
+    while (1 << uses) - 1 < limit:
+        out += limit - ((1 << uses) - 1)
+        uses += 1
+    return out
+
+
+def _part_key(part: _Part) -> Tuple[int, int, bool]:
+    return part[1], part[2], part[3]
+
+
+def _evaluate(tree: _Tree, leaves: List[_Part], limit: int) -> Tuple[int, int, int] | None:
+    """``(levels, final uses, xp)`` of ``tree``, None if it breaks the limit or sacrifices the base item."""
+    cost = _overrun(tree, leaves, limit)
+    if cost is None or cost[0]:
+        return None
+    return cost[1:]
+
+
+def _overrun(tree: _Tree, leaves: List[_Part], limit: int) -> Tuple[int, int, int, int] | None:
+    """
+    ``(levels over the limit, levels, final uses, xp)`` of ``tree``, adding
+    up what each merge costs beyond the limit; None if it sacrifices the
+    base item.
+    """
+    over = levels = xp = 0
+
+    def walk(node: _Tree) -> _Part | None:
+        nonlocal over, levels, xp
+        if isinstance(node, int):
+            return leaves[node]
+        target = walk(node[0])
+        sacrifice = walk(node[1])
+        if target is None or sacrifice is None or sacrifice[3]:
+            return None
+        merged, cost = _merge(target, sacrifice)
+        over += max(cost - limit, 0)
+        levels += cost
+        xp += xp_from_levels(cost)
+        return merged
+
+    root = walk(tree)
+    if root is None:
+        return None
+    return over, levels, root[1], xp
+
+
+def _improve(tree: _Tree, leaves: List[_Part], limit: int, rank: Callable[[tuple], tuple],
+             stop: Callable[[], bool] | None) -> _Tree:
+    """Local search from ``tree``, taking the best move while one helps."""
+    best = rank(_evaluate(tree, leaves, limit))
+    for _ in range(MAX_MOVES):
+        if stop is not None and stop():
+            break
+        pick = None
+        for cand in _neighbours(tree, leaves):
+            cost = _evaluate(cand, leaves, limit)
+            if cost is not None and rank(cost) < best:
+                best, pick = rank(cost), cand
+        if pick is None:
+            break
+        tree = pick
+    return tree
+
+
+def _repair(tree: _Tree, leaves: List[_Part], limit: int, rank: Callable[[tuple], tuple],
+            stop: Callable[[], bool] | None) -> _Tree | None:
+    """
+    Local search from ``tree``, which may break the merge cost limit, for
+    one that does not: the best move by how far its merges go over the
+    limit, then by cost, while one helps.  None if it gets stuck over.
+    """
+    def score(cost: Tuple[int, int, int, int]) -> tuple:
+        return (cost[0],) + rank(cost[1:])
+
+    best = score(_overrun(tree, leaves, limit))
+    for _ in range(MAX_MOVES):
+        if not best[0] or (stop is not None and stop()):
+            break
+        pick = None
+        for cand in itertools.chain(_neighbours(tree, leaves), _regrafts(tree, leaves, limit)):
+            cost = _overrun(cand, leaves, limit)
+            if cost is not None and score(cost) < best:
+                best, pick = score(cost), cand
+        if pick is None:
+            break
+        tree = pick
+    return None if best[0] else tree
+
+
+def _neighbours(tree: _Tree, leaves: List[_Part]):
+    """
+    Trees one move from ``tree``: each flip and rotation, as it is and with
+    its books re-sorted, and each swap of two books next to each other in
+    value.  Sorting is the best assignment to a shape unless the merge cost
+    limit binds, which is what the plain moves and swaps are for.
+    """
+    for cand in itertools.chain(_flips(tree), _rotations(tree)):
+        yield cand
+        yield _sort_books(cand, leaves)
+    order = _leaf_order(tree)
+    at = {leaf: pos for pos, leaf in enumerate(order)}
+    books = sorted((leaf for leaf in order if not leaves[leaf][3]), key=lambda leaf: leaves[leaf][2])
+    for a, b in zip(books, books[1:]):
+        if leaves[a][2] != leaves[b][2]:
+            swapped = list(order)
+            swapped[at[a]], swapped[at[b]] = b, a
+            yield _relabel(tree, iter(swapped))
+
+
+def _regrafts(tree: _Tree, leaves: List[_Part], limit: int):
+    """
+    Trees with part of the sacrifice of a merge over the limit moved: cut
+    out and merged onto any other node, as its sacrifice.
+    """
+    for path in _over(tree, leaves, limit):
+        sacrifice = _at(tree, path + (1,))
+        for sub, cut in _subtrees(sacrifice, path + (1,)):
+            rest = _cut(tree, cut)
+            for _, at in _subtrees(rest, ()):
+                yield _put(rest, at, sub)
+
+
+def _over(tree: _Tree, leaves: List[_Part], limit: int) -> List[tuple]:
+    """Paths (0 for target, 1 for sacrifice) to the merges of ``tree`` over the limit."""
+    out = []
+
+    def walk(node: _Tree, path: tuple) -> _Part:
+        if isinstance(node, int):
+            return leaves[node]
+        merged, cost = _merge(walk(node[0], path + (0,)), walk(node[1], path + (1,)))
+        if cost > limit:
+            out.append(path)
+        return merged
+
+    walk(tree, ())
+    return out
+
+
+def _subtrees(tree: _Tree, path: tuple):
+    """``(subtree, path)`` for ``tree`` and everything under it."""
+    yield tree, path
+    if not isinstance(tree, int):
+        yield from _subtrees(tree[0], path + (0,))
+        yield from _subtrees(tree[1], path + (1,))
+
+
+def _at(tree: _Tree, path: tuple) -> _Tree:
+    for side in path:
+        tree = tree[side]
+    return tree
+
+
+def _cut(tree: _Tree, path: tuple) -> _Tree:
+    """``tree`` without the subtree at ``path``, whose merge is replaced by the other side."""
+    if len(path) == 1:
+        return tree[1 - path[0]]
+    side = path[0]
+    inner = _cut(tree[side], path[1:])
+    return (inner, tree[1]) if side == 0 else (tree[0], inner)
+
+
+def _put(tree: _Tree, path: tuple, sub: _Tree) -> _Tree:
+    """``tree`` with ``sub`` merged onto the node at ``path``."""
+    if not path:
+        return tree, sub
+    if path[0] == 0:
+        return _put(tree[0], path[1:], sub), tree[1]
+    return tree[0], _put(tree[1], path[1:], sub)
+
+
+def _sort_books(tree: _Tree, leaves: List[_Part]) -> _Tree:
+    """``tree`` with its fresh books moved so the most valuable are sacrificed least often."""
+    order = _leaf_order(tree)
+    times = _sacrificed(tree)
+    slots = sorted((pos for pos, leaf in enumerate(order) if not leaves[leaf][3] and not leaves[leaf][1]),
+                   key=lambda pos: times[pos])
+    books = sorted((order[pos] for pos in slots), key=lambda leaf: -leaves[leaf][2])
+    for pos, leaf in zip(slots, books):
+        order[pos] = leaf
+    return _relabel(tree, iter(order))
+
+
+def _sacrificed(tree: _Tree, depth: int = 0) -> List[int]:
+    """How many merges each leaf (left to right) is on the sacrifice side of."""
+    if isinstance(tree, int):
+        return [depth]
+    return _sacrificed(tree[0], depth) + _sacrificed(tree[1], depth + 1)
+
+
+def _leaf_order(tree: _Tree) -> List[int]:
+    if isinstance(tree, int):
+        return [tree]
+    return _leaf_order(tree[0]) + _leaf_order(tree[1])
+
+
+def _relabel(tree: _Tree, order) -> _Tree:
+    if isinstance(tree, int):
+        return next(order)
+    target = _relabel(tree[0], order)
+    return target, _relabel(tree[1], order)
+
+
+def _flips(tree: _Tree):
+    """``tree`` with one merge's target and sacrifice swapped."""
+    if isinstance(tree, int):
+        return
+    target, sacrifice = tree
+    yield sacrifice, target
+    for t in _flips(target):
+        yield t, sacrifice
+    for s in _flips(sacrifice):
+        yield target, s
+
+
+def _rotations(tree: _Tree):
+    """``tree`` with one pair of nested merges regrouped, ((a, b), c) <-> (a, (b, c))."""
+    if isinstance(tree, int):
+        return
+    target, sacrifice = tree
+    if not isinstance(target, int):
+        yield target[0], (target[1], sacrifice)
+    if not isinstance(sacrifice, int):
+        yield (target, sacrifice[0]), sacrifice[1]
+    for t in _rotations(target):
+        yield t, sacrifice
+    for s in _rotations(sacrifice):
+        yield target, s
+
+
+def _build(tree: _Tree, items: List[EnchantedItem], options: PlannerOptions) -> MergePlan:
+    steps: List[Step] = []
+
+    def make(node: _Tree) -> EnchantedItem:
+        if isinstance(node, int):
+            return items[node]
+        left = make(node[0])
+        right = make(node[1])
+        merged, cost_lv, cost_xp = left.merge(right, options=options)
+        steps.append(Step(left, right, cost_lv, cost_xp, merged.prior_penalty()))
+        return merged
+
+    final = make(tree)
+    return MergePlan(steps, sum(s.cost_levels for s in steps), sum(s.cost_xp for s in steps),
+                     final.prior_penalty())
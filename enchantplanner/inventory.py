@@ -0,0 +1,556 @@
+"""
+Planning from the books and items a player already owns.
+"""
+import functools
+import operator
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+from . import packed, stats
+from .calculator import (NOT_PROVEN_OPTIMAL, OPTIMAL, Node, decode_steps, encode_item, missing_books, stopper,
+                         xp_costs)
+from .exceptions import MergeTooExpensive, PlanCancelled
+from .models import EnchantedItem, MergePlan, PlannerOptions, Step, DEFAULT_OPTIONS
+from .utils import check_item_can_have, pretty_name
+
+# sub-multisets one search may visit; a larger inventory is searched over the books
+# that bring the most, and its plan is not proven optimal
+MAX_SUBSETS = 1 << 14
+
+# pairs of subsets a search may weigh, once it has a plan to fall back on, before it
+# settles for that plan
+MAX_PAIRS = 2_000_000
+
+# bits per kind of item in a count vector; no kind keeps more than 16 copies
+_FIELD = 6
+
+# Added to plans from inventories with too many ways to combine them to search through.
+TOO_MANY_PLANS = ("Not proven optimal: the inventory can be combined in too many ways to check them all, "
+                  "so this is the best plan found.")
+
+
+class _Stopped(Exception):
+    """A search stopped by its ``stop`` check, with the best plan it had found."""
+
+    def __init__(self, best: Tuple[int, int, Node] | None):
+        super().__init__()
+        self.best = best
+
+
+class _Spent(_Stopped):
+    """A search that weighed ``MAX_PAIRS`` pairs, with the best plan it had found."""
+
+
+def plan_inventory(base: EnchantedItem, desired: Dict[str, int], inventory: List[EnchantedItem], *,
+                   mode: str = "levels", options: PlannerOptions = DEFAULT_OPTIONS,
+                   time_budget: float | None = None, deadline: float | None = None,
+                   cancel: threading.Event | None = None) -> Tuple[MergePlan, List[EnchantedItem]]:
+    """
+    Cheapest plan that gives ``base`` at least the ``desired`` levels using
+    only items from ``inventory`` (books, or items of the base's type).
+    Returns the plan and the inventory items it leaves out.
+
+    Owned books may be combined before they are applied (two Sharpness IV
+    books make a Sharpness V book) and may carry enchants beyond the target.
+    Items that bring none of the missing enchants, or that the base cannot
+    take, are left out up front, and so are copies beyond what any plan could
+    use; the search then works on counts of each kind of item, so many
+    copies of a few kinds of book stay cheap.
+
+    ``time_budget``, ``deadline`` and ``cancel`` work as in ``plan_enchants``;
+    out of time, the best plan found so far is returned.  Raises
+    ``ValueError`` when the inventory cannot reach the target.
+    """
+    need = {ns: lv for book in missing_books(base, desired) for ns, lv in book.enchants.items()}
+    if not need:
+        return MergePlan([], 0, 0, base.prior_penalty()), list(inventory)
+
+    stock: Counter = Counter()
+    for item, count in Counter(inventory).items():
+        copies = min(count, _useful_copies(base, item, need, options))
+        if copies:
+            stock[item] = copies
+    # two copies of a level make the next and nothing makes more, so counting a level-l
+    # copy as 2 ** l units, an enchant is out of reach with fewer than 2 ** goal
+    for ns, goal in need.items():
+        units = sum(count << min(item.enchants[ns], goal) for item, count in stock.items() if ns in item.enchants)
+        if ns in base.enchants:
+            units += 1 << base.enchants[ns]
+        if units < 1 << goal:
+            raise ValueError(f"The inventory cannot reach the desired enchantments: too little {pretty_name(ns)}.")
+    if time_budget is not None:
+        end = time.monotonic() + time_budget
+        deadline = end if deadline is None else min(deadline, end)
+    st = stats.current()
+    if st is not None:
+        st.count("searches")
+    # a quick plan over a few hand-picked books, the best plans over those and then over
+    # those and one of every other kind, bound the full search from the start
+    best = None
+    seed: Counter = Counter()
+    piles = _seed(stock, need)
+    if piles is not None:
+        best = _seed_plan(base, piles, need, mode, options)
+        seed = functools.reduce(operator.or_, piles.values())
+    trimmed = _subsets(stock) > MAX_SUBSETS
+    stages = [_trim(stock, seed, need) if trimmed else stock]
+    if piles is not None:
+        # a stage holding most of the stock costs about as much as the full search
+        stages = [part for part in (seed, seed | Counter(dict.fromkeys(stock, 1)))
+                  if 4 * sum(part.values()) <= 3 * sum(stages[-1].values())
+                  and _subsets(part) <= MAX_SUBSETS] + stages
+    stop = stopper(deadline, cancel)
+    warnings = [TOO_MANY_PLANS] if trimmed else [] if deadline is None else [OPTIMAL]
+    try:
+        for stage in stages:
+            bound = None if best is None else _rank(mode, best[2][0][3], best[0], best[1])
+            best = _search_inventory(base, stage, need, mode, options, bound, stop,
+                                     None if best is None else MAX_PAIRS) or best
+    except _Spent as e:
+        if st is not None:
+            st.count("inventory_spent")
+        best = e.best or best
+        warnings = [TOO_MANY_PLANS]
+    except _Stopped as e:
+        if cancel is not None and cancel.is_set():
+            if st is not None:
+                st.count("cancelled")
+            raise PlanCancelled("Planning was cancelled.") from None
+        if st is not None:
+            st.count("deadline_expired")
+        best = e.best or best
+        if best is None:
+            raise RuntimeError("No plan from the inventory found within the time budget.") from None
+        warnings = [NOT_PROVEN_OPTIMAL]
+    if best is None:
+        raise ValueError("The inventory cannot reach the desired enchantments.")
+
+    lv, xp, node = best
+    steps: List[Step] = []
+    final = decode_steps(node, steps)
+    used = Counter(_leaves(node))
+    used[encode_item(base)] -= 1
+    unused = []
+    for item in inventory:
+        state = encode_item(item)
+        if used[state] > 0:
+            used[state] -= 1
+        else:
+            unused.append(item)
+    return MergePlan(steps, lv, xp, final.prior_penalty(), warnings), unused
+
+
+def _useful_copies(base: EnchantedItem, item: EnchantedItem, need: Dict[str, int],
+                   options: PlannerOptions) -> int:
+    """How many copies of ``item`` a plan could use: none unless it brings a missing enchant."""
+    if item.item_type not in ("book", base.item_type):
+        return 0
+    if any(not check_item_can_have(ns, base.item_type) for ns in item.enchants):
+        return 0
+    if not options.allow_incompatible:
+        present = packed.encode(base.enchants)[1] | packed.encode(need)[1] | packed.encode(item.enchants)[1]
+        if packed.conflicts(present):
+            return 0
+    copies = 0
+    for ns, lv in item.enchants.items():
+        goal = need.get(ns)
+        if goal is not None:
+            # two books of one level make the next, so 2 ** (goal - lv) copies are plenty
+            copies = max(copies, 1 if lv >= goal else 1 << (goal - lv))
+    return copies
+
+
+def _subsets(stock: Counter) -> int:
+    """How many sub-multisets ``stock`` has."""
+    return functools.reduce(operator.mul, (count + 1 for count in stock.values()), 1)
+
+
+def _trim(stock: Counter, seed: Counter, need: Dict[str, int]) -> Counter:
+    """
+    ``seed`` and as many more copies from ``stock`` as keep the search within
+    ``MAX_SUBSETS``, the items bringing the most missing levels first.
+    """
+    part = Counter(seed)
+    for item in sorted(stock, key=lambda it: (-sum(min(it.enchants.get(ns, 0), goal) for ns, goal in need.items()),
+                                              it.anvil_uses, it.value)):
+        rest = _subsets(part) // (part[item] + 1)
+        part[item] = max(part[item], min(stock[item], MAX_SUBSETS // rest - 1))
+    return +part
+
+
+def _seed(stock: Counter, need: Dict[str, int]) -> Dict[str, Counter] | None:
+    """
+    Books that make each missing enchant: the lowest book at or above the
+    goal, else the highest books below it that add up to it, from the
+    single-enchant books if they can and from every book holding it if not.
+    None if some enchant cannot be made from books at all.
+    """
+    piles = {}
+    for ns, goal in need.items():
+        holders = [it for it in stock if it.item_type == "book" and ns in it.enchants]
+        piles[ns] = (_pile(stock, [it for it in holders if len(it.enchants) == 1], ns, goal)
+                     or _pile(stock, holders, ns, goal))
+        if piles[ns] is None:
+            return None
+    return piles
+
+
+def _pile(stock: Counter, books: List[EnchantedItem], ns: str, goal: int) -> Counter | None:
+    """Copies of ``books`` that make ``ns`` at ``goal``, as ``_seed`` picks them; None if they cannot."""
+    whole = [it for it in books if it.enchants[ns] >= goal]
+    if whole:
+        return Counter([min(whole, key=lambda it: (it.enchants[ns], it.value, it.anvil_uses))])
+    # a level-l book is worth 2 ** l level-0 books; taking the highest first hits 2 ** goal exactly
+    pile: Counter = Counter()
+    units = 0
+    for it in sorted(books, key=lambda it: (-it.enchants[ns], it.value, it.anvil_uses)):
+        for _ in range(stock[it]):
+            if units == 1 << goal:
+                return pile
+            units += 1 << it.enchants[ns]
+            pile[it] += 1
+    return pile if units == 1 << goal else None
+
+
+def _seed_plan(base: EnchantedItem, piles: Dict[str, Counter], need: Dict[str, int], mode: str,
+               options: PlannerOptions) -> Tuple[int, int, Node] | None:
+    """
+    A quick plan over the books of ``piles``: the single-enchant books of
+    each enchant merged into one, two of a level at a time, then the best
+    plan over those and the books of several enchants.
+    """
+    books: Counter = Counter()
+    subtrees: Dict[tuple, Node] = {}
+    for ns, pile in piles.items():
+        if any(len(it.enchants) > 1 for it in pile):
+            # a book picked for two enchants serves both
+            books |= pile
+            continue
+        # the pile's books add up to a power of two, so the two lowest are always equal
+        pile = [(it, (encode_item(it), None, None, 0)) for it in pile.elements()]
+        while len(pile) > 1:
+            pile.sort(key=lambda entry: (entry[0].enchants[ns], entry[0].anvil_uses))
+            (tgt, tnode), (sac, snode) = pile[:2]
+            try:
+                book, cost_lv, _ = tgt.merge(sac, options=options)
+            except MergeTooExpensive:
+                return None
+            pile[:2] = [(book, (encode_item(book), tnode, snode, cost_lv))]
+        books[pile[0][0]] += 1
+        subtrees[pile[0][1][0]] = pile[0][1]
+    plan = _search_inventory(base, books, need, mode, options)
+    if plan is None:
+        return None
+    # the plan may leave out a merged pile, so the totals come from the grafted tree
+    node = _graft(plan[2], subtrees)
+    xp_cost = xp_costs(options.max_merge_levels)
+    costs = _costs(node)
+    return sum(costs), sum(xp_cost[c] for c in costs), node
+
+
+def _graft(node: Node, subtrees: Dict[tuple, Node]) -> Node:
+    """
+    ``node`` with the leaves that have a subtree in ``subtrees`` replaced by
+    it, each subtree once (another leaf of its state is an owned item).
+    """
+    state, tnode, snode, cost_lv = node
+    if tnode is None:
+        return subtrees.pop(state, node)
+    return state, _graft(tnode, subtrees), _graft(snode, subtrees), cost_lv
+
+
+def _costs(node: Node) -> List[int]:
+    """Levels of every merge in ``node``."""
+    state, tnode, snode, cost_lv = node
+    if tnode is None:
+        return []
+    return _costs(tnode) + _costs(snode) + [cost_lv]
+
+
+def _rank(mode: str, uses: int, lv: int, xp: int) -> Tuple[int, int, int]:
+    """Sort key of a plan under ``mode``, best first (as ``calculator._plan_rank``)."""
+    if mode == "prior_work":
+        return uses, lv, xp
+    return lv, uses, xp
+
+
+def _search_inventory(base: EnchantedItem, stock: Counter, need: Dict[str, int], mode: str,
+                      options: PlannerOptions,
+                      bound: Tuple[int, int, int] | None = None,
+                      stop: Callable[[], bool] | None = None,
+                      max_pairs: int | None = None) -> Tuple[int, int, Node] | None:
+    """
+    Best ``(levels, xp, node)`` of a plan over ``base`` and items from
+    ``stock`` that reaches ``need``, or None if none ranks as well as
+    ``bound`` under ``mode``.  ``stop`` is checked as the search goes; once
+    it returns True the search raises ``_Stopped`` with its best plan, and
+    past ``max_pairs`` pairs of subsets it raises ``_Spent``.
+
+    A subset DP like ``_cheapest_single``, with two differences.  Copies of
+    an item are interchangeable, so subsets are count vectors over the kinds
+    of item, one ``_FIELD``-bit field per kind.  Owned books may share
+    enchants, so the merged levels of a subset depend on the merge order: each
+    subset keeps its best plan per (anvil uses, merged levels).  Subsets are
+    built by size, each from every pair of finished smaller subsets that
+    add up to it, so only subsets that still hold a state are ever paired.
+
+    States whose cost plus a lower bound on the rest cannot beat the best
+    plan known are dropped, and so are whole pairs whose cheapest states
+    cannot.  A state that is not done yet pays its prior-work penalty when
+    merged again.  Every enchant still short of its goal arrives on a
+    sacrifice holding it at least one level below the goal (at the goal if
+    the target lacks it), and sacrifice values add up over enchants; a state
+    without the base also pays its own value as part of some sacrifice, or
+    the base's penalty if it can take the base in instead.
+
+    Optimal plans need every item they use: dropping one saves its merge and
+    lowers no later cost, so a merge whose sacrifice (or book target) adds
+    nothing towards the goals is skipped.  Likewise books of an enchant that
+    only single-enchant books carry combine without waste: counting a
+    level-``l`` book as ``2 ** l`` units (a book at or past the goal as
+    ``2 ** goal``), no subset holds more than ``2 ** goal`` units of it, and
+    larger ones are skipped.
+    """
+    limit = options.max_merge_levels
+    xp_cost = xp_costs(limit)
+    goals = [(packed.IDS[ns] * packed.LEVEL_BITS, lv, packed.WEIGHT[packed.IDS[ns]]) for ns, lv in need.items()]
+    base_levels = packed.encode(base.enchants)[0]
+    base_cost = base.prior_penalty()
+    goal_mask = sum(packed.LEVEL_MASK << shift for shift, _, _ in goals)
+
+    def short(levels: int, book: int = 0) -> int:
+        # least value still to be sacrificed for the goals ``levels`` misses;
+        # with ``book``, beyond that book's own, for the goals the two miss together
+        total = 0
+        for shift, goal, weight in goals:
+            lv = (levels >> shift) & packed.LEVEL_MASK
+            if lv >= goal:
+                continue
+            held = (book >> shift) & packed.LEVEL_MASK
+            if not held:
+                total += weight * (goal - 1 if lv else goal)
+            elif (lv + 1 if lv == held else max(lv, held)) < goal:
+                # some other sacrifice carries it too, into the book or into what takes the book
+                total += weight
+        return total
+
+    # kind 0 is the base; a count vector over kinds is the subset's key
+    kinds = [base] + sorted(stock, key=lambda it: it.signature)
+    copies = [1] + [stock[it] for it in kinds[1:]]
+    total = sum(copies)
+    half = 1 << (_FIELD - 1)
+    # adding ``spare`` carries into ``overflow`` once a kind is used more often than owned
+    spare = sum((half - 1 - n) << (_FIELD * k) for k, n in enumerate(copies))
+    overflow = sum(half << (_FIELD * k) for k in range(len(kinds)))
+
+    # units of each goal in an 8-bit field, with the same carry test
+    item_units = [0] * len(kinds)
+    unit_spare = unit_overflow = 0
+    for j, (ns, goal) in enumerate(need.items()):
+        holders = [k for k in range(1, len(kinds)) if ns in kinds[k].enchants]
+        if any(len(kinds[k].enchants) > 1 or kinds[k].item_type != "book" for k in holders):
+            continue
+        for k in holders:
+            item_units[k] += 1 << (min(kinds[k].enchants[ns], goal) + 8 * j)
+        unit_spare += (127 - (1 << goal)) << (8 * j)
+        unit_overflow += 128 << (8 * j)
+
+    # per kind, a bit for each goal it holds and for each it holds at the goal; per count
+    # vector, how many of its items hold each goal at the goal, in an 8-bit field
+    holds = [0] * len(kinds)
+    tops = [0] * len(kinds)
+    item_tops = [0] * len(kinds)
+    for j, (ns, goal) in enumerate(need.items()):
+        for k in range(1, len(kinds)):
+            lv = kinds[k].enchants.get(ns, 0)
+            if lv:
+                holds[k] |= 1 << j
+            if lv >= goal:
+                tops[k] |= 1 << j
+                item_tops[k] += 1 << (8 * j)
+    books = [k for k in range(1, len(kinds)) if kinds[k].item_type == "book"]
+    field = (1 << _FIELD) - 1
+
+    def spare_book(vec: int, at_goal: int) -> bool:
+        # whether some book's goals are all held at the goal by other items
+        once = twice = 0
+        for j in range(len(goals)):
+            n = (at_goal >> (8 * j)) & 0xFF
+            if n == 1:
+                once |= 1 << j
+            elif n:
+                twice |= 1 << j
+        if not once | twice:
+            return False
+        return any((vec >> (_FIELD * k)) & field and not holds[k] & ~(once | twice) and not holds[k] & tops[k] & once
+                   for k in books)
+
+    # per count vector: (anvil uses, packed levels) -> (levels, xp, node, value)
+    table: Dict[int, Dict[Tuple[int, int], tuple]] = {}
+    present: Dict[int, int] = {}
+    units: Dict[int, int] = {}
+    at_goal: Dict[int, int] = {}
+    # per table: fewest levels spent once merged into something, once something is merged
+    # into it, and fewest anvil uses, to skip pairs that cannot beat the bound
+    floor: Dict[int, Tuple[int, int, int]] = {}
+    cheapest: Dict[int, int] = {}
+    # per count vector, least value still to be sacrificed for the goals none of its items
+    # hold (as ``short``), or -1 when they hold conflicting enchants
+    gap: Dict[int, int] = {}
+    absent = [(1 << (shift // packed.LEVEL_BITS), goal, weight, (base_levels >> shift) & packed.LEVEL_MASK)
+              for shift, goal, weight in goals]
+    # packed levels of (target, sacrifice) merges, which repeat across pairs
+    merged: Dict[Tuple[int, int], int] = {}
+    # count vectors with a table, by size
+    done: List[List[int]] = [[] for _ in range(total + 1)]
+    for k, item in enumerate(kinds):
+        vec = 1 << (_FIELD * k)
+        state = encode_item(item)
+        table[vec] = {(item.anvil_uses, state[1]): (0, 0, (state, None, None, 0), item.value)}
+        present[vec] = state[2]
+        units[vec] = item_units[k]
+        at_goal[vec] = item_tops[k]
+        floor[vec] = _floor(table[vec])
+        cheapest[vec] = min(floor[vec][:2])
+        done[1].append(vec)
+    done[1].sort(key=cheapest.get)
+
+    best = None
+    best_rank = bound
+    tried = over_cap = pairs = 0
+    for size in range(2, total + 1):
+        # every split of a subset of this size is a pair of smaller tables
+        layer: Dict[int, Dict[Tuple[int, int], tuple]] = {}
+        for small in range(1, size // 2 + 1):
+            large = size - small
+            for i, a in enumerate(done[large]):
+                if stop is not None and stop():
+                    raise _Stopped(best)
+                pairs += len(done[small]) if small != large else i + 1
+                if max_pairs is not None and pairs > max_pairs:
+                    raise _Spent(best)
+                a_sac, a_tgt, aw = floor[a]
+                # partners come cheapest first, so under ``levels`` the first too dear ends the run
+                dear = None if best_rank is None or mode == "prior_work" else best_rank[0] - min(a_sac, a_tgt)
+                for b in done[small] if small != large else done[small][:i + 1]:
+                    if dear is not None and cheapest[b] > dear:
+                        break
+                    if (a + b + spare) & overflow:
+                        continue
+                    if (units[a] + units[b] + unit_spare) & unit_overflow:
+                        continue
+                    vec = a + b
+                    rest = gap.get(vec)
+                    if rest is None:
+                        present[vec] = present[a] | present[b]
+                        units[vec] = units[a] + units[b]
+                        at_goal[vec] = at_goal[a] + at_goal[b]
+                        if not options.allow_incompatible and packed.conflicts(present[vec]):
+                            rest = -1
+                        elif spare_book(vec, at_goal[vec]):
+                            rest = -1
+                        else:
+                            rest = sum(weight * (goal - 1 if held else goal)
+                                       for bit, goal, weight, held in absent if not present[vec] & bit)
+                        gap[vec] = rest
+                    if rest < 0:
+                        continue
+                    b_sac, b_tgt, bw = floor[b]
+                    w = (aw if aw > bw else bw) + 1
+                    # another merge follows unless this takes in the base and misses nothing
+                    if not vec & 1:
+                        rest = (1 << w) - 1 + min(max(rest, 1), base_cost + max(rest, base.value))
+                    elif rest:
+                        rest += (1 << w) - 1
+                    uses = w + 1 if rest else w
+                    slots = None
+                    for x, y, tgt_floor, sac_floor in ((a, b, a_tgt, b_sac), (b, a, b_tgt, a_sac)):
+                        if best_rank is not None and _rank(mode, uses, tgt_floor + sac_floor + rest, 0) > best_rank:
+                            continue
+                        if slots is None:
+                            slots = layer.setdefault(vec, {})
+                        tbase, sbase = x & 1, y & 1
+                        sac = table[y]
+                        for (tw, tlevels), (tlv, txp, tnode, _) in table[x].items():
+                            tstate = tnode[0]
+                            tpen = (1 << tw) - 1
+                            for (sw, slevels), (slv, sxp, snode, svalue) in sac.items():
+                                sstate = snode[0]
+                                if tstate[0] == "book" and sstate[0] != "book":
+                                    continue
+                                tried += 1
+                                cost_lv = tpen + (1 << sw) - 1 + svalue
+                                if cost_lv > limit:
+                                    over_cap += 1
+                                    continue
+                                lv = tlv + slv + cost_lv
+                                xp = txp + sxp + xp_cost[cost_lv]
+                                w = (tw if tw > sw else sw) + 1
+                                if best_rank is not None and _rank(mode, w, lv, xp) > best_rank:
+                                    continue
+                                levels = merged.get((tlevels, slevels))
+                                if levels is None:
+                                    levels = merged[tlevels, slevels] = packed.merge(tlevels, slevels, sstate[2])
+                                # an item that adds nothing towards the goals is better left out
+                                if not sbase and (levels ^ tlevels) & goal_mask == 0:
+                                    continue
+                                if not tbase and tstate[0] == "book" and (levels ^ slevels) & goal_mask == 0:
+                                    continue
+                                cur = slots.get((w, levels))
+                                if cur is not None and (cur[0], cur[1]) <= (lv, xp):
+                                    continue
+                                state = (tstate[0], levels, tstate[2] | sstate[2], w)
+                                slots[w, levels] = (lv, xp, (state, tnode, snode, cost_lv))
+
+        for vec, slots in layer.items():
+            has_base = vec & 1
+            kept = {}
+            for (w, levels), (lv, xp, node) in slots.items():
+                value = packed.value(levels)
+                if has_base and all((levels >> shift) & packed.LEVEL_MASK >= goal for shift, goal, _ in goals):
+                    # a finished plan only gets dearer if merged again; one matching the bound is
+                    # kept until a better one turns up
+                    rank = _rank(mode, w, lv, xp)
+                    if best_rank is None or rank < best_rank or best is None and rank == best_rank:
+                        best_rank = rank
+                        best = (lv, xp, node)
+                    continue
+                if has_base:
+                    rest = max(short(levels), 1)
+                else:
+                    # goals this state cannot finish on the base still need other sacrifices
+                    rest = value + short(base_levels, levels)
+                    if node[0][0] == base.item_type:
+                        # it may end up the target instead, with the base merged into it
+                        rest = min(rest, base_cost + max(short(levels), base.value))
+                rest += (1 << w) - 1
+                if best_rank is None or _rank(mode, w + 1, lv + rest, xp) <= best_rank:
+                    kept[w, levels] = (lv, xp, node, value)
+            if kept:
+                table[vec] = kept
+                floor[vec] = _floor(kept)
+                cheapest[vec] = min(floor[vec][:2])
+                done[size].append(vec)
+        done[size].sort(key=cheapest.get)
+
+    st = stats.current()
+    if st is not None:
+        st.count("merges_tried", tried)
+        st.count("merges_over_cap", over_cap)
+    return best
+
+
+def _floor(slots: Dict[Tuple[int, int], tuple]) -> Tuple[int, int, int]:
+    """Least levels a table's states cost as a sacrifice and as a target, and their fewest anvil uses."""
+    return (min(lv + (1 << w) - 1 + value for (w, _), (lv, _, _, value) in slots.items()),
+            min(lv + (1 << w) - 1 for (w, _), (lv, _, _, _) in slots.items()),
+            min(w for w, _ in slots))
+
+
+def _leaves(node: Node) -> List[tuple]:
+    state, tnode, snode, _ = node
+    if tnode is None:
+        return [state]
+    return _leaves(tnode) + _leaves(snode)
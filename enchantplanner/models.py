@@ -4,17 +4,41 @@ from dataclasses import dataclass, field
 from typing import Dict, List
 from .utils import pretty_name, xp_from_levels, check_item_can_have, is_compatible, MAX_MERGE_LEVELS, weight
 from .exceptions import InvalidTarget, MergeTooExpensive, IncompatibleSelected
-from .data import ENCHANTMENTS
+from . import stats as _stats
+from .catalog import CATALOG
 
-ALLOW_INCOMPAT = False
+# rule sets the enchant data and merge rules describe
+EDITIONS = ("java",)
 
 
+@dataclass(frozen=True)
+class PlannerOptions:
+    """
+    Rules one plan is made under.  Options are passed explicitly down to every
+    merge and are part of every planner cache key, so concurrent requests with
+    different options neither race nor share results.
+    """
+    allow_incompatible: bool = False
+    max_merge_levels: int = MAX_MERGE_LEVELS
+    edition: str = "java"
+
+    def __post_init__(self):
+        if self.edition not in EDITIONS:
+            raise ValueError(f"Unsupported edition '{self.edition}'")
+        if not 1 <= self.max_merge_levels <= 1000:
+            raise ValueError(f"Merge cost limit {self.max_merge_levels} out of range (1-1000)")
+
+
+DEFAULT_OPTIONS = PlannerOptions()
+
 @dataclass(frozen=True, slots=True)
 class EnchantedItem:
     item_type: str
     enchants: Dict[str, int]
     anvil_uses: int = 0
     value: int = field(init=False)
+    signature: tuple = field(init=False, repr=False, compare=False)
+    _hash: int = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
         object.__setattr__(
@@ -22,19 +46,27 @@ class EnchantedItem:
             "value",
             sum(l * weight(e) for e, l in self.enchants.items())
         )
+        sig = (self.item_type, self.anvil_uses, tuple(sorted(self.enchants.items())))
+        object.__setattr__(self, "signature", sig)
+        object.__setattr__(self, "_hash", hash(sig))
 
     def __hash__(self) -> int:
-        return hash((
-            self.item_type,
-            self.anvil_uses,
-            tuple(sorted(self.enchants.items()))
-        ))
+        return self._hash
+
+    def __reduce__(self):
+        # rebuild through __init__ so an unpickled item gets this process's string hashes
+        return EnchantedItem, (self.item_type, self.enchants, self.anvil_uses)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, EnchantedItem):
+            return NotImplemented
+        # the cached hashes rule out most unequal items before the signatures are compared
+        return self is other or (self._hash == other._hash and self.signature == other.signature)
 
     def pretty(self) -> str:
         if self.enchants:
             ench_txt = ", ".join(
-                # use single quotes around 'levelMax' and avoid nested f–string
-                f"{pretty_name(ns)}{' ' + str(lv) if ENCHANTMENTS[ns]['levelMax'] > 1 else ''}"
+                f"{pretty_name(ns)}{' ' + str(lv) if CATALOG.level_max[CATALOG.ids[ns]] > 1 else ''}"
                 for ns, lv in sorted(self.enchants.items())
             )
             core = f"{self.item_type.capitalize()} ({ench_txt})"
@@ -47,18 +79,32 @@ class EnchantedItem:
         return f"{core} (Prior-work penalty = {self.anvil_uses})"
 
     @staticmethod
-    def from_state(item_type: str, enchants: Dict[str, int] | None = None, *, anvil_uses: int = 0):
+    def from_state(item_type: str, enchants: Dict[str, int] | None = None, *, anvil_uses: int = 0,
+                   options: PlannerOptions = DEFAULT_OPTIONS):
         enchants = enchants or {}
         ok, conflicts = is_compatible(enchants)
-        if not ok and not ALLOW_INCOMPAT:
+        if not ok and not options.allow_incompatible:
             raise ValueError(f"Incompatible enchantments: {conflicts}")
         for ns, lv in enchants.items():
             if not check_item_can_have(ns, item_type):
                 raise ValueError(f"{item_type} cannot receive enchantment '{ns}'")
-            if lv < 1 or lv > ENCHANTMENTS[ns]["levelMax"]:
+            if lv < 1 or lv > CATALOG.level_max[CATALOG.ids[ns]]:
                 raise ValueError(f"Level {lv} out of range for '{ns}'")
+        if not isinstance(anvil_uses, int) or isinstance(anvil_uses, bool) or anvil_uses < 0:
+            raise ValueError(f"Prior work {anvil_uses!r} must be a whole number of anvil uses, at least 0")
+        # an item whose prior-work penalty alone exceeds the limit can never be merged
+        if anvil_uses >= (options.max_merge_levels + 1).bit_length():
+            raise MergeTooExpensive(f"An item with {anvil_uses} prior anvil uses costs more than "
+                                    f"{options.max_merge_levels} levels to merge")
         return EnchantedItem(item_type, dict(enchants), anvil_uses=anvil_uses)
 
+    def to_dict(self) -> dict:
+        return {"type": self.item_type, "enchants": dict(self.enchants), "uses": self.anvil_uses}
+
+    @staticmethod
+    def from_dict(data: dict) -> "EnchantedItem":
+        return EnchantedItem(data["type"], dict(data["enchants"]), anvil_uses=data["uses"])
+
     @staticmethod
     def book(ns: str, level: int) -> "EnchantedItem":
         return EnchantedItem("book", {ns: level})
@@ -75,12 +121,17 @@ class EnchantedItem:
         cost += other.value
         return cost
 
-    def merge(self, other: "EnchantedItem", *, rename=False, repair=False):
+    def merge(self, other: "EnchantedItem", *, rename=False, repair=False, options: PlannerOptions = DEFAULT_OPTIONS):
+        st = _stats.current()
+        if st is not None:
+            st.count("item_merges")
         if self.item_type == "book" and other.item_type != "book":
             raise InvalidTarget()
         cost_lv = self.merge_cost_levels(other, rename, repair)
-        if cost_lv > MAX_MERGE_LEVELS:
-            raise MergeTooExpensive(f"Merge would cost {cost_lv} levels (limit {MAX_MERGE_LEVELS})")
+        if cost_lv > options.max_merge_levels:
+            if st is not None:
+                st.count("item_merges_too_expensive")
+            raise MergeTooExpensive(f"Merge would cost {cost_lv} levels (limit {options.max_merge_levels})")
         cost_xp = xp_from_levels(cost_lv)
 
         new_uses = max(self.anvil_uses, other.anvil_uses) + 1
@@ -90,10 +141,12 @@ class EnchantedItem:
             if current != lv:
                 new_enchants[ns] = max(current, lv)
             else:
-                new_enchants[ns] = min(current + 1, ENCHANTMENTS[ns]["levelMax"])
+                new_enchants[ns] = min(current + 1, CATALOG.level_max[CATALOG.ids[ns]])
 
         ok, conflicts = is_compatible(new_enchants)
-        if not ok and not ALLOW_INCOMPAT:
+        if not ok and not options.allow_incompatible:
+            if st is not None:
+                st.count("item_merges_incompatible")
             raise IncompatibleSelected(conflicts)
 
         result_type = self.item_type if self.item_type != "book" else other.item_type
@@ -108,6 +161,25 @@ class Step:
     cost_xp: int
     result_prior: int
 
+    def to_dict(self) -> dict:
+        return {
+            "left": self.left.to_dict(),
+            "right": self.right.to_dict(),
+            "levels": self.cost_levels,
+            "xp": self.cost_xp,
+            "prior": self.result_prior,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "Step":
+        return Step(
+            EnchantedItem.from_dict(data["left"]),
+            EnchantedItem.from_dict(data["right"]),
+            data["levels"],
+            data["xp"],
+            data["prior"],
+        )
+
     def __str__(self):
         l, r = self.left, self.right
         if l.item_type == "book" and r.item_type != "book":
@@ -125,6 +197,43 @@ class MergePlan:
     total_xp: int
     final_prior_work: int
     warnings: List[str] = field(default_factory=list)
+    # least levels any plan for the same target can cost, for plans not proven optimal
+    lower_bound: int | None = None
+    # stats of the collection this plan was returned in, when collection is on
+    stats: _stats.SearchStats | None = field(default=None, compare=False, repr=False)
+
+    def to_dict(self) -> dict:
+        out = {
+            "steps": [s.to_dict() for s in self.steps],
+            "total_levels": self.total_levels,
+            "total_xp": self.total_xp,
+            "final_prior_work": self.final_prior_work,
+            "warnings": list(self.warnings),
+        }
+        if self.lower_bound is not None:
+            out["lower_bound"] = self.lower_bound
+            out["gap"] = self.gap
+        if self.stats is not None:
+            out["stats"] = self.stats.to_dict()
+        return out
+
+    @staticmethod
+    def from_dict(data: dict) -> "MergePlan":
+        return MergePlan(
+            [Step.from_dict(s) for s in data["steps"]],
+            data["total_levels"],
+            data["total_xp"],
+            data["final_prior_work"],
+            list(data.get("warnings", [])),
+            data.get("lower_bound"),
+        )
+
+    @property
+    def gap(self) -> float | None:
+        """How far the levels may be above optimal, as a fraction of ``lower_bound``."""
+        if not self.lower_bound:
+            return None
+        return (self.total_levels - self.lower_bound) / self.lower_bound
 
     def summary(self) -> str:
         lines = [f"Step {i + 1}) {s}" for i, s in enumerate(self.steps)]
@@ -133,6 +242,8 @@ class MergePlan:
             f"Total: {self.total_levels} levels ({self.total_xp}xp), "
             f"prior-work = {self.final_prior_work}"
         )
+        if self.gap is not None:
+            lines.append(f"Within {self.gap:.1%} of optimal (lower bound {self.lower_bound} levels)")
         if self.warnings:
             lines.append("Warnings: " + "; ".join(self.warnings))
         return "\n".join(lines)
@@ -0,0 +1,80 @@
+"""
+Integer-encoded enchant sets for the search hot path.
+
+An enchant set is a pair of ints: ``packed`` holds each level in a
+``LEVEL_BITS``-wide field at ``id * LEVEL_BITS`` and ``present`` has bit
+``id`` set for every enchant on the item.  ``EnchantedItem`` stays the public
+type; convert with ``encode``/``decode`` at the search boundary only.
+"""
+from typing import Dict, List, Tuple
+
+from .catalog import CATALOG
+from .models import EnchantedItem
+
+LEVEL_BITS = 3
+LEVEL_MASK = (1 << LEVEL_BITS) - 1
+
+# the catalog's tables, as module globals for the hot loops below
+NAMES = CATALOG.names
+IDS = CATALOG.ids
+WEIGHT = CATALOG.weight
+LEVEL_MAX = CATALOG.level_max
+INCOMPAT = CATALOG.incompat
+
+assert max(LEVEL_MAX) <= LEVEL_MASK
+
+
+def encode(enchants: Dict[str, int]) -> Tuple[int, int]:
+    """``enchants`` as ``(packed, present)``."""
+    packed = present = 0
+    for ns, lv in enchants.items():
+        eid = IDS[ns]
+        packed |= lv << (eid * LEVEL_BITS)
+        present |= 1 << eid
+    return packed, present
+
+
+def decode(item_type: str, packed: int, uses: int) -> EnchantedItem:
+    enchants: Dict[str, int] = {}
+    eid = 0
+    while packed:
+        lv = packed & LEVEL_MASK
+        if lv:
+            enchants[NAMES[eid]] = lv
+        packed >>= LEVEL_BITS
+        eid += 1
+    return EnchantedItem(item_type, enchants, anvil_uses=uses)
+
+
+def value(packed: int) -> int:
+    total = 0
+    eid = 0
+    while packed:
+        total += (packed & LEVEL_MASK) * WEIGHT[eid]
+        packed >>= LEVEL_BITS
+        eid += 1
+    return total
+
+
+def merge(target: int, sacrifice: int, sacrifice_present: int) -> int:
+    """Anvil level rules of ``EnchantedItem.merge`` on packed levels."""
+    out = target
+    bits = sacrifice_present
+    while bits:
+        low = bits & -bits
+        eid = low.bit_length() - 1
+        shift = eid * LEVEL_BITS
+        cur = (target >> shift) & LEVEL_MASK
+        lv = (sacrifice >> shift) & LEVEL_MASK
+        if cur != lv:
+            new = cur if cur > lv else lv
+        else:
+            new = cur + 1 if cur < LEVEL_MAX[eid] else cur
+        out += (new - cur) << shift
+        bits ^= low
+    return out
+
+
+def conflicts(present: int) -> List[Tuple[str, str]]:
+    """Incompatible pairs in an enchant set, empty when compatible."""
+    return CATALOG.conflicts(present)
@@ -0,0 +1,76 @@
+"""
+Offline builder for the precomputed plan table.
+
+For every item type and every maximal compatible set of (non-curse)
+enchantments at max level, plans the bare item in both modes and writes the
+result for ``calculator.load_plan_table``::
+
+    python -m enchantplanner.precompute [output.json]
+"""
+import json
+import sys
+from typing import Dict, Iterator, List
+
+from .calculator import PLAN_TABLE_FORMAT, DEFAULT_PLAN_TABLE, plan_enchants
+from .catalog import CATALOG
+from .models import EnchantedItem
+from .utils import data_version
+
+MODES = ("levels", "prior_work")
+
+
+def item_types() -> List[str]:
+    return list(CATALOG.item_types)
+
+
+def _conflict(a: str, b: str) -> bool:
+    return bool(CATALOG.incompat[CATALOG.ids[a]] >> CATALOG.ids[b] & 1)
+
+
+def maximal_sets(item_type: str) -> Iterator[Dict[str, int]]:
+    """Every maximal compatible enchant set for ``item_type``, each at max level."""
+    pool = sorted(
+        ns for ns in CATALOG.names
+        if CATALOG.can_have(ns, item_type) and not ns.startswith("curse_")
+    )
+
+    # Bron–Kerbosch over the compatibility graph
+    def extend(chosen: List[str], candidates: List[str], excluded: List[str]):
+        if not candidates and not excluded:
+            yield {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in chosen}
+            return
+        for ns in list(candidates):
+            yield from extend(
+                chosen + [ns],
+                [c for c in candidates if c != ns and not _conflict(c, ns)],
+                [x for x in excluded if not _conflict(x, ns)],
+            )
+            candidates.remove(ns)
+            excluded.append(ns)
+
+    yield from extend([], pool, [])
+
+
+def build_plan_table() -> dict:
+    plans = []
+    for item_type in item_types():
+        base = EnchantedItem(item_type, {})
+        for desired in maximal_sets(item_type):
+            for mode in MODES:
+                plan = plan_enchants(base, desired, mode=mode)
+                plans.append([item_type, sorted(desired.items()), mode, plan.to_dict()])
+    return {"format": PLAN_TABLE_FORMAT, "data_version": data_version(), "plans": plans}
+
+
+def main(argv: List[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else DEFAULT_PLAN_TABLE
+    table = build_plan_table()
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(table, fh, separators=(",", ":"))
+    print(f"wrote {len(table['plans'])} plans to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+Exact planner over merge-tree shapes, ``plan_enchants(..., engine="shapes")``.
+
+The books ``plan_enchants`` merges are fresh and carry one enchant each, no
+two the same.  A merge then costs the prior-work penalties of its two inputs,
+which only depend on the shape of the tree below each, plus the sacrifice's
+value, which is the sum of its books' values.  So a plan is a tree shape and
+an assignment of books to its leaves: each book pays its value once per
+merge it is on the sacrifice side of (its multiplier), and by the
+rearrangement inequality the cheapest assignment gives the most valuable
+books the smallest multipliers.
+
+A shape is summed up by its signature: anvil uses at the root, the penalties
+its merges pay, and its leaves' multipliers in ascending order.  Signatures
+are built bottom up by leaf count; one that is no better than another on
+every count never gives a cheaper plan and is dropped, which leaves a few
+dozen per leaf count, so the work grows polynomially with the books.  Each
+complete signature's sorted assignment is a lower bound on its plans; the
+best are checked against the merge cost limit with their real costs, trying
+the assignments that keep the levels (books swapped between leaves of equal
+multiplier) so the xp tie-break is met too.
+
+The answer is proven optimal when a plan reaches the best lower bound.  When
+the merge cost limit rules that out (it binds in a few cases, and more often
+the more books there are) the cheapest feasible plan may need an unsorted
+assignment or a dropped shape, so ``plan_enchants`` runs the subset DP
+instead, as it does for items outside the model above (a base book with
+enchants or prior work).
+"""
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from .catalog import CATALOG
+from .exceptions import IncompatibleSelected
+from .models import EnchantedItem, Step, MergePlan, PlannerOptions
+from .utils import xp_from_levels
+
+# leaves of a shape; inner nodes are (target, sacrifice) pairs
+_BOOK = "book"
+_BASE = "base"
+
+# shapes kept per signature; they spread the same cost differently over the
+# merges, which matters for the merge cost limit and for xp
+WITNESSES = 32
+# assignments tried per shape (books swapped between equal multipliers)
+ASSIGNMENTS = 2000
+
+# (uses, penalties paid, sorted multipliers)
+_Signature = Tuple[int, int, Tuple[int, ...]]
+
+
+def supported(base: EnchantedItem, books: List[EnchantedItem]) -> bool:
+    """Whether ``plan`` models these items: fresh one-enchant books with distinct enchants."""
+    if base.item_type == "book" and (base.enchants or base.anvil_uses):
+        return False
+    seen = set()
+    for book in books:
+        if book.item_type != "book" or book.anvil_uses or len(book.enchants) != 1:
+            return False
+        seen.update(book.enchants)
+    return len(seen) == len(books)
+
+
+def plan(base: EnchantedItem, books: List[EnchantedItem], mode: str, options: PlannerOptions,
+         stop: Callable[[], bool] | None = None) -> Tuple[MergePlan | None, bool] | None:
+    """
+    ``(plan, proven)`` for merging ``books`` onto ``base``: the best plan
+    found (None if none was) and whether it is optimal.  None for items
+    outside the model or when ``stop`` fired.
+    """
+    if not supported(base, books):
+        return None
+    if not options.allow_incompatible:
+        present = CATALOG.present(base.enchants) | CATALOG.present(ns for b in books for ns in b.enchants)
+        clash = CATALOG.conflicts(present)
+        if clash:
+            raise IncompatibleSelected(clash)
+
+    leaves = sorted(books, key=lambda b: -b.value)
+    values = [b.value for b in leaves]
+    roots = _signatures(values, base.anvil_uses, base.item_type == "book", options.max_merge_levels)
+    if not roots:
+        return None, False
+
+    def bound(sig: _Signature) -> int:
+        return sig[1] + sum(v * r for v, r in zip(values, sig[2]))
+
+    def rank(levels: int, uses: int, xp: int) -> tuple:
+        return (uses, levels, xp) if mode == "prior_work" else (levels, uses, xp)
+
+    def floor(sig: _Signature) -> tuple:
+        # the best (levels, uses) rank any plan of this shape can reach
+        return rank(bound(sig), sig[0], 0)[:2]
+
+    order = sorted(roots, key=floor)
+    best = None
+    for sig in order:
+        if best is not None and floor(sig) > best[0][:2]:
+            break
+        for tree in roots[sig]:
+            if stop is not None and stop():
+                return None
+            for assigned in _assignments(tree, values):
+                cost = _evaluate(tree, assigned, base.anvil_uses, options.max_merge_levels)
+                if cost is not None and (best is None or rank(*cost) < best[0]):
+                    best = (rank(*cost), tree, assigned)
+    if best is None:
+        return None, False
+    return _build(best[1], best[2], leaves, base, options), best[0][:2] == floor(order[0])
+
+
+@lru_cache(maxsize=None)
+def min_tree_penalty(leaves: int, height: int = 0) -> int:
+    """
+    Least total prior-work penalty the internal nodes of any merge tree over
+    ``leaves`` fresh items, at least ``height`` merges high, pay when they
+    are merged again (the root is not).  A node is used at least as often as
+    its height, so heights bound it.
+    """
+    if leaves < 2:
+        return 0
+    return min(c - ((1 << h) - 1) for h, c in _subtree_penalties(leaves).items() if h >= min(height, leaves - 1))
+
+
+@lru_cache(maxsize=None)
+def _subtree_penalties(leaves: int) -> Dict[int, int]:
+    """Least penalty of a subtree of ``leaves`` leaves, root included, by its height."""
+    if leaves == 1:
+        return {0: 0}
+    row: Dict[int, int] = {}
+    for a in range(1, leaves // 2 + 1):
+        for ha, ca in _subtree_penalties(a).items():
+            for hb, cb in _subtree_penalties(leaves - a).items():
+                h = max(ha, hb) + 1
+                c = ca + cb + (1 << h) - 1
+                if c < row.get(h, c + 1):
+                    row[h] = c
+    return row
+
+
+def _signatures(values: List[int], base_uses: int, base_book: bool, limit: int) -> Dict[_Signature, List[tuple]]:
+    """
+    Complete signatures (with up to ``WITNESSES`` shapes each) over the base
+    and ``len(values)`` books.  The base adds nothing to the multipliers: an
+    item is never a sacrifice and an empty book is worth nothing.  Only an
+    empty book can be one.
+    """
+    k = len(values)
+    smallest = [0] * (k + 1)
+    for m, v in enumerate(sorted(values)):
+        smallest[m + 1] = smallest[m] + v
+    books: List[Dict[_Signature, List[tuple]]] = [{} for _ in range(k + 1)]
+    based: List[Dict[_Signature, List[tuple]]] = [{} for _ in range(k + 1)]
+    if k:
+        books[1][0, 0, (0,)] = [_BOOK]
+    based[0][base_uses, 0, ()] = [_BASE]
+
+    def join(out: Dict[_Signature, List[tuple]], targets: Dict[_Signature, List[tuple]],
+             sacrifices: Dict[_Signature, List[tuple]]):
+        for (tuses, tpen, tmult), ttrees in list(targets.items()):
+            for (suses, spen, smult), strees in sacrifices.items():
+                pen = (1 << tuses) - 1 + (1 << suses) - 1
+                # even the cheapest books on the sacrifice side would break the limit
+                if pen + smallest[len(smult)] > limit:
+                    continue
+                sig = (max(tuses, suses) + 1, tpen + spen + pen, tuple(sorted(tmult + tuple(r + 1 for r in smult))))
+                if _keep(out, sig):
+                    trees = out[sig]
+                    for t in ttrees:
+                        for s in strees:
+                            if len(trees) >= WITNESSES:
+                                break
+                            trees.append((t, s))
+
+    for m in range(2, k + 1):
+        for a in range(1, m):
+            join(books[m], books[a], books[m - a])
+    for m in range(1, k + 1):
+        for a in range(m):
+            join(based[m], based[a], books[m - a])
+            if base_book:
+                join(based[m], books[m - a], based[a])
+    return based[k]
+
+
+def _keep(out: Dict[_Signature, List[tuple]], sig: _Signature) -> bool:
+    """Add ``sig`` to ``out`` unless another is at least as good everywhere; drops those it beats."""
+    if sig in out:
+        return True
+    uses, pen, mult = sig
+    beaten = []
+    for other in out:
+        ouses, open_, omult = other
+        if ouses <= uses and open_ <= pen and all(a <= b for a, b in zip(omult, mult)):
+            return False
+        if uses <= ouses and pen <= open_ and all(a <= b for a, b in zip(mult, omult)):
+            beaten.append(other)
+    for other in beaten:
+        del out[other]
+    out[sig] = []
+    return True
+
+
+def _multipliers(tree) -> List[int]:
+    """Multiplier of every book leaf, left to right."""
+    out: List[int] = []
+    stack = [(tree, 0)]
+    while stack:
+        node, r = stack.pop()
+        if node == _BOOK:
+            out.append(r)
+        elif node != _BASE:
+            stack.append((node[1], r + 1))
+            stack.append((node[0], r))
+    return out
+
+
+def _assignments(tree, values: List[int]) -> Iterator[Tuple[int, ...]]:
+    """
+    Leaf values (left to right) of every cheapest assignment to ``tree``, the
+    sorted one first: values in descending order go to multipliers in
+    ascending order, and only leaves of the same multiplier trade values.
+    """
+    mults = _multipliers(tree)
+    leaves = sorted(range(len(mults)), key=lambda i: mults[i])
+    groups: List[Tuple[List[int], List[int]]] = []
+    for pos, leaf in enumerate(leaves):
+        if pos and mults[leaf] == mults[leaves[pos - 1]]:
+            groups[-1][0].append(leaf)
+            groups[-1][1].append(values[pos])
+        else:
+            groups.append(([leaf], [values[pos]]))
+
+    assigned = [0] * len(mults)
+
+    def fill(g: int) -> Iterator[Tuple[int, ...]]:
+        if g == len(groups):
+            yield tuple(assigned)
+            return
+        slots, vals = groups[g]
+        for perm in _permutations(vals):
+            for slot, v in zip(slots, perm):
+                assigned[slot] = v
+            yield from fill(g + 1)
+
+    tried = 0
+    for out in fill(0):
+        yield out
+        tried += 1
+        if tried >= ASSIGNMENTS:
+            return
+
+
+def _permutations(values: List[int]) -> Iterator[List[int]]:
+    """Distinct orderings of ``values`` (descending), the given order first."""
+    counts: Dict[int, int] = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    keys = sorted(counts, reverse=True)
+    out: List[int] = []
+
+    def step() -> Iterator[List[int]]:
+        if len(out) == len(values):
+            yield list(out)
+            return
+        for v in keys:
+            if counts[v]:
+                counts[v] -= 1
+                out.append(v)
+                yield from step()
+                out.pop()
+                counts[v] += 1
+
+    return step()
+
+
+def _evaluate(tree, assigned: Tuple[int, ...], base_uses: int, limit: int) -> Tuple[int, int, int] | None:
+    """``(levels, final uses, xp)`` of ``tree`` with leaf values ``assigned``, None over the limit."""
+    levels = xp = 0
+    leaf = 0
+
+    def walk(node) -> Tuple[int, int]:
+        # (anvil uses, value) of the item the subtree makes
+        nonlocal levels, xp, leaf
+        if node == _BOOK:
+            leaf += 1
+            return 0, assigned[leaf - 1]
+        if node == _BASE:
+            return base_uses, 0
+        tuses, tvalue = walk(node[0])
+        suses, svalue = walk(node[1])
+        cost = (1 << tuses) - 1 + (1 << suses) - 1 + svalue
+        if cost > limit:
+            raise _OverLimit
+        levels += cost
+        xp += xp_from_levels(cost)
+        return max(tuses, suses) + 1, tvalue + svalue
+
+    try:
+        uses = walk(tree)[0]
+    except _OverLimit:
+        return None
+    return levels, uses, xp
+
+
+class _OverLimit(Exception):
+    pass
+
+
+def _build(tree, assigned: Tuple[int, ...], leaves: List[EnchantedItem], base: EnchantedItem,
+           options: PlannerOptions) -> MergePlan:
+    """The plan for ``tree`` with books placed by value, its steps sub-plans first."""
+    pool: Dict[int, List[EnchantedItem]] = {}
+    for item in reversed(leaves):
+        pool.setdefault(item.value, []).append(item)
+    placed = iter(pool[v].pop() for v in assigned)
+    steps: List[Step] = []
+
+    def make(node) -> EnchantedItem:
+        if node == _BOOK:
+            return next(placed)
+        if node == _BASE:
+            return base
+        left = make(node[0])
+        right = make(node[1])
+        merged, cost_lv, cost_xp = left.merge(right, options=options)
+        steps.append(Step(left, right, cost_lv, cost_xp, merged.prior_penalty()))
+        return merged
+
+    final = make(tree)
+    return MergePlan(steps, sum(s.cost_levels for s in steps), sum(s.cost_xp for s in steps),
+                     final.prior_penalty())
@@ -0,0 +1,144 @@
+"""
+Coalescing of identical work that is asked for at the same time.
+
+``SingleFlight`` runs a function once per key among the threads of a
+process: a call for a key that is already being computed waits for that
+computation and gets its result (or its exception).  ``HostLock`` does the
+waiting part across the processes of one host, with ``flock`` on lock files
+in a directory; what the waiting process then reads is up to the caller
+(the planner reads its plan store).  It needs ``fcntl``, so on platforms
+without it (Windows) ``available()`` is False and each process computes for
+itself.
+"""
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Tuple, Type
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX; each process then plans for itself
+    fcntl = None
+
+# how often a waiting call checks ``stop``, in seconds
+POLL_INTERVAL = 0.02
+# lock files per directory; keys share them by hash, so unrelated keys rarely wait on each other
+LOCK_STRIPES = 1024
+
+
+class Abandoned(Exception):
+    """``stop`` fired while waiting for another call's result."""
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], stop: Callable[[], bool] | None = None,
+           retry: Tuple[Type[BaseException], ...] = ()) -> Tuple[Any, bool]:
+        """
+        ``(fn(), False)`` if no call for ``key`` is in flight, else ``(its
+        result, True)`` once it finishes; its exception is raised in every
+        waiting call too, except those in ``retry``, after which the waiting
+        calls try again (one of them running ``fn``).  Raises ``Abandoned``
+        if ``stop`` fires while waiting.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.calls += 1
+            if leader:
+                try:
+                    flight.value = fn()
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+                return flight.value, False
+
+            _wait(flight.done, stop)
+            if flight.error is None:
+                with self._lock:
+                    self.shared += 1
+                return flight.value, True
+            if not isinstance(flight.error, retry):
+                raise flight.error
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+def _wait(done: threading.Event, stop: Callable[[], bool] | None) -> None:
+    if stop is None:
+        done.wait()
+        return
+    while not done.wait(POLL_INTERVAL):
+        if stop():
+            raise Abandoned()
+
+
+def available() -> bool:
+    """Whether ``HostLock`` can lock across processes here."""
+    return fcntl is not None
+
+
+class HostLock:
+    """Exclusive locks on string keys shared by every process using ``directory``."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        stripe = int.from_bytes(hashlib.sha256(key.encode()).digest()[:4], "big") % LOCK_STRIPES
+        return os.path.join(self.directory, f"{stripe:04d}.lock")
+
+    @contextmanager
+    def hold(self, key: str, stop: Callable[[], bool] | None = None) -> Iterator[bool]:
+        """
+        Hold the lock for ``key``; yields whether another process held it
+        first (so whatever it was computing may now be ready).  Raises
+        ``Abandoned`` if ``stop`` fires while waiting.
+        """
+        fd = os.open(self.path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if stop is None:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                        break
+                    if stop():
+                        raise Abandoned() from None
+                    time.sleep(POLL_INTERVAL)
+            try:
+                yield waited
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
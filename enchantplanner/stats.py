@@ -0,0 +1,167 @@
+"""
+Planner instrumentation.
+
+Counters and timers go into a ``SearchStats`` while collection is on, either
+for the whole process (``enable``) or around one block (``collect``).  With
+collection off the planner does no extra bookkeeping.  Every finished
+collection is added to the process totals that ``render_prometheus`` exports.
+
+Counters:
+
+* ``plans`` / ``fronts``: ``plan_enchants`` / ``plan_front`` calls
+* ``plan_table_hits``, ``plan_cache_hits``, ``plan_store_hits``, ``front_cache_hits``:
+  answered without a search
+* ``searches``: searches run
+* ``coalesced``: plans taken from an identical request's search (in another
+  thread, or another worker through the plan store) instead of searching
+* ``shape_searches``: ``engine="shapes"`` searches; ``shape_fallbacks`` for
+  those that could not prove their plan and ran the DP, ``shape_unproven``
+  for those returned unproven
+* ``heuristic_searches``: ``engine="heuristic"`` searches
+* ``merges_tried``: candidate merges the search tried
+* ``merges_over_cap``: candidates dropped for costing more than 39 levels
+* ``subproblem_hits`` / ``subproblem_misses``: sub-problem cache lookups
+* ``incompatible_selected``: plans refused for incompatible enchants
+* ``item_merges``: ``EnchantedItem.merge`` calls, and ``item_merges_too_expensive``
+  / ``item_merges_incompatible`` for those that raised
+
+Timers (seconds): ``plan`` (whole call), ``search``, and whatever callers
+add, such as ``render`` in the app.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterator, Mapping
+
+PREFIX = "enchantplanner"
+
+
+@dataclass
+class SearchStats:
+    counters: Dict[str, int] = field(default_factory=dict)
+    timers: Dict[str, float] = field(default_factory=dict)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add(self, other: "SearchStats") -> None:
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {name: round(s, 6) for name, s in sorted(self.timers.items())},
+        }
+
+
+_CURRENT: ContextVar["SearchStats | None"] = ContextVar("enchantplanner_stats", default=None)
+_ENABLED = False
+
+_TOTALS = SearchStats()
+_TOTALS_LOCK = Lock()
+_COLLECTIONS = 0
+
+
+def enable(on: bool = True) -> None:
+    """Collect stats for every ``plan_enchants``/``plan_front`` call in this process."""
+    global _ENABLED
+    _ENABLED = on
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+def current() -> SearchStats | None:
+    """The stats being collected in this context, or None when collection is off."""
+    return _CURRENT.get()
+
+
+@contextmanager
+def collect() -> Iterator[SearchStats]:
+    """
+    Collect stats for the enclosed block, then add them to the process
+    totals.  Nested blocks share the outermost collection.
+    """
+    outer = _CURRENT.get()
+    if outer is not None:
+        yield outer
+        return
+    stats = SearchStats()
+    token = _CURRENT.set(stats)
+    try:
+        yield stats
+    finally:
+        _CURRENT.reset(token)
+        record(stats)
+
+
+def record(stats: SearchStats) -> None:
+    global _COLLECTIONS
+    with _TOTALS_LOCK:
+        _TOTALS.add(stats)
+        _COLLECTIONS += 1
+
+
+def totals() -> SearchStats:
+    """A copy of the process totals."""
+    with _TOTALS_LOCK:
+        out = SearchStats()
+        out.add(_TOTALS)
+        return out
+
+
+def reset() -> None:
+    global _COLLECTIONS
+    with _TOTALS_LOCK:
+        _TOTALS.counters.clear()
+        _TOTALS.timers.clear()
+        _COLLECTIONS = 0
+
+
+def render_prometheus(caches: Mapping[str, object] | None = None) -> str:
+    """
+    Process totals in the Prometheus text format.  ``caches`` maps a cache
+    name to its ``CacheStats`` (see ``calculator.cache_stats``).
+    """
+    with _TOTALS_LOCK:
+        counters = dict(_TOTALS.counters)
+        timers = dict(_TOTALS.timers)
+        collections = _COLLECTIONS
+
+    lines = [
+        f"# HELP {PREFIX}_collections_total Finished stats collections (one per request or plan).",
+        f"# TYPE {PREFIX}_collections_total counter",
+        f"{PREFIX}_collections_total {collections}",
+    ]
+    for name, n in sorted(counters.items()):
+        metric = f"{PREFIX}_{name}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {n}"]
+    for name, seconds in sorted(timers.items()):
+        metric = f"{PREFIX}_{name}_seconds_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {seconds:.6f}"]
+
+    if caches:
+        for field_name, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                                 ("entries", "gauge"), ("weight", "gauge")):
+            metric = f"{PREFIX}_cache_{field_name}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, cache in sorted(caches.items()):
+                lines.append(f'{metric}{{cache="{name}"}} {getattr(cache, field_name)}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,140 @@
+"""
+Persistent plan store shared by every worker on a host.
+
+Each worker process keeps its own ``PlanCache`` of finished plans, which
+starts empty on every boot and is never shared, so with N workers a popular
+plan is searched N times.  A ``PlanStore`` is an SQLite file on local disk
+that all of them read and write: a plan searched once is served to every
+worker, and survives restarts.
+
+Plans are stored under a canonical request string (see
+``calculator.store_key``) and the ``ENCHANTMENTS`` data version, as
+zlib-compressed compact JSON.  Rows from other data versions are dropped
+when a store is opened.  The file is in WAL mode, so readers never wait for
+a writer; writers queue on SQLite's lock for up to ``timeout`` seconds, and
+since every plan for one key is the same the first write wins.  The store is
+a cache: a locked, corrupt or unwritable file makes lookups miss and writes
+do nothing, and planning goes on without it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from threading import Lock
+
+from .cache import CacheStats
+from .models import MergePlan
+from .utils import data_version
+
+# bump when the table or the serialized plan changes shape
+STORE_FORMAT = 1
+# writes between trimming the oldest rows back to ``max_entries``
+_TRIM_EVERY = 256
+
+
+class PlanStore:
+    def __init__(self, path: str, *, max_entries: int | None = 100_000, timeout: float = 5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.version = data_version()
+        self._local = threading.local()
+        self._lock = Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        try:
+            self._setup()
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread, and a new one after a fork: a connection
+        # must not cross either
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _setup(self) -> None:
+        conn = self._connect()
+        if conn.execute("PRAGMA user_version").fetchone()[0] != STORE_FORMAT:
+            conn.execute("DROP TABLE IF EXISTS plans")
+            conn.execute(f"PRAGMA user_version={STORE_FORMAT}")
+        conn.execute("CREATE TABLE IF NOT EXISTS plans "
+                     "(version TEXT NOT NULL, key TEXT NOT NULL, plan BLOB NOT NULL, PRIMARY KEY (version, key))")
+        conn.execute("DELETE FROM plans WHERE version != ?", (self.version,))
+
+    def get(self, key: str) -> MergePlan | None:
+        try:
+            row = self._connect().execute("SELECT plan FROM plans WHERE version = ? AND key = ?",
+                                          (self.version, key)).fetchone()
+            plan = None if row is None else _decode(row[0])
+        except (sqlite3.Error, ValueError, KeyError, TypeError, AttributeError, zlib.error):
+            with self._lock:
+                self.errors += 1
+            return None
+        with self._lock:
+            if plan is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return plan
+
+    def put(self, key: str, plan: MergePlan) -> None:
+        try:
+            conn = self._connect()
+            conn.execute("INSERT OR IGNORE INTO plans (version, key, plan) VALUES (?, ?, ?)",
+                         (self.version, key, _encode(plan)))
+            with self._lock:
+                self._writes += 1
+                trim = self.max_entries is not None and self._writes % _TRIM_EVERY == 0
+            if trim:
+                # oldest first; rowids only grow, so this needs no bookkeeping on reads
+                dropped = conn.execute("DELETE FROM plans WHERE rowid <= (SELECT max(rowid) FROM plans) - ?",
+                                       (self.max_entries,)).rowcount
+                with self._lock:
+                    self.evictions += max(dropped, 0)
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM plans")
+        except sqlite3.Error:
+            self.errors += 1
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def close(self) -> None:
+        """Close this thread's connection; the store reconnects if used again."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def stats(self) -> CacheStats:
+        try:
+            entries, weight = self._connect().execute(
+                "SELECT count(*), coalesce(sum(length(plan)), 0) FROM plans").fetchone()
+        except sqlite3.Error:
+            entries = weight = 0
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, entries, weight, self.max_entries, None)
+
+
+def _encode(plan: MergePlan) -> bytes:
+    body = {k: v for k, v in plan.to_dict().items() if k != "stats"}
+    return zlib.compress(json.dumps(body, separators=(",", ":")).encode())
+
+
+def _decode(blob: bytes) -> MergePlan:
+    return MergePlan.from_dict(json.loads(zlib.decompress(blob)))
@@ -1,5 +1,9 @@
+import hashlib
+import json
+from functools import lru_cache
 from typing import Dict, List, Tuple
 from .data import ENCHANTMENTS
+from .catalog import CATALOG
 
 MAX_MERGE_LEVELS = 39  # for reference in merge routines
 _IGNORE_LOWER = {"of"}
@@ -28,19 +32,28 @@ def xp_from_levels(levels: int) -> int:
 
 
 def weight(ns: str) -> int:
-    return int(ENCHANTMENTS[ns]["weight"])
+    return CATALOG.weight[CATALOG.ids[ns]]
 
 
 def check_item_can_have(enchant_ns: str, item_type: str) -> bool:
-    return item_type == "book" or item_type in ENCHANTMENTS[enchant_ns]["items"]
+    return CATALOG.can_have(enchant_ns, item_type)
 
 
 def is_compatible(chosen: Dict[str, int]) -> Tuple[bool, List[Tuple[str, str]]]:
+    if not CATALOG.clashes(CATALOG.present(chosen)):
+        return True, []
     conflicts: List[Tuple[str, str]] = []
     items = list(chosen.keys())
     for i in range(len(items)):
         for j in range(i + 1, len(items)):
             a, b = items[i], items[j]
-            if a in ENCHANTMENTS[b]["incompatible"] or b in ENCHANTMENTS[a]["incompatible"]:
+            if CATALOG.incompat[CATALOG.ids[a]] >> CATALOG.ids[b] & 1:
                 conflicts.append((a, b))
     return (not conflicts, conflicts)
+
+
+@lru_cache(maxsize=None)
+def data_version() -> str:
+    """Short hash of ``ENCHANTMENTS``; anything persisted from it is stale once this changes."""
+    blob = json.dumps(ENCHANTMENTS, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
@@ -0,0 +1,207 @@
+"""
+NumPy kernel for the subset DP of ``calculator._cheapest_single``.
+
+``_solve_mask`` walks one mask's splits at a time in Python.  ``LayerKernel``
+instead lays out every split of a whole layer as arrays and scores all of
+their candidate merges at once: merge costs from per-slot penalty and value
+arrays, xp from a lookup array, then one sort picks every slot's winner.
+Only the winners go back to Python for the back-pointer bookkeeping.
+
+Candidates are ordered the way ``_solve_mask`` visits them and ties keep the
+first, so winners, back-pointers and the order each mask's anvil-use slots
+are filled in are the same as the Python loop's, and so are the plans.
+
+NumPy is optional; ``available()`` says whether it is installed.
+"""
+from typing import Callable, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # the planner runs without it
+    np = None
+
+# candidate merges scored per batch; bounds the kernel's scratch memory
+BATCH_CANDIDATES = 1 << 22
+
+# larger than any level, xp or visit order
+_NONE = np.iinfo(np.int64).max if np is not None else None
+
+_Found = List[Tuple[int, int, int, int, int, int]]
+
+
+def available() -> bool:
+    return np is not None
+
+
+class LayerKernel:
+    """
+    NumPy mirror of one search's slot arrays (``mask * width + uses``) that
+    solves whole layers.
+
+    The search reports every slot it fills through ``put``, in the order it
+    appends the slot's anvil uses to ``uses_of``; ``solve`` then returns what
+    ``_solve_chunk`` would for the same masks.
+    """
+
+    def __init__(self, full: int, width: int, limit: int, xp_cost: List[int], cut: List[int],
+                 is_book: List[bool], splits: Callable[[int], Iterable[Tuple[int, int, int]]] | None = None):
+        size = (full + 1) * width
+        self.width = width
+        self.limit = limit
+        self.lv = np.full(size, -1, dtype=np.int64)
+        self.xp = np.zeros(size, dtype=np.int64)
+        self.penalty = np.zeros(size, dtype=np.int64)
+        self.value = np.zeros(size, dtype=np.int64)
+        self.xp_cost = np.asarray(xp_cost, dtype=np.int64)
+        self.cut = np.asarray(cut, dtype=np.int64)
+        # filled in by the search as its leaves go in; read once the first layer is solved
+        self._is_book_list = is_book
+        self.is_book = None
+        # per mask, its anvil-use counts in fill order (-1 past the last)
+        self.uses = np.full((full + 1, width), -1, dtype=np.int64)
+        self.filled = np.zeros(full + 1, dtype=np.int64)
+        # (left, right, concrete right) of a mask, for symmetry-class searches
+        self.splits = splits
+
+    def put(self, slot: int, lv: int, xp: int, penalty: int, value: int) -> None:
+        mask, w = divmod(slot, self.width)
+        self.uses[mask, self.filled[mask]] = w
+        self.filled[mask] += 1
+        self.lv[slot] = lv
+        self.xp[slot] = xp
+        self.penalty[slot] = penalty
+        self.value[slot] = value
+
+    def solve(self, masks: List[int]) -> List[Tuple[int, bool, int, int, _Found]]:
+        """
+        Solve ``masks`` (one layer) from their solved submasks.  Per mask:
+        ``(mask, lost, tried, over_cap, found)`` with ``found`` holding
+        ``(uses, levels, xp, target slot, sacrifice slot, merge levels)`` in
+        fill order, as ``_solve_chunk`` returns.
+        """
+        if self.is_book is None:
+            self.is_book = np.asarray(self._is_book_list, dtype=bool)
+        held = int(self.filled.max())
+        out = []
+        batch: List[int] = []
+        queued = 0
+        for mask in masks:
+            batch.append(mask)
+            # an upper bound with symmetry classes, which visit fewer splits
+            queued += 2 * held * held * _split_count(mask)
+            if queued >= BATCH_CANDIDATES:
+                out += self._solve_batch(np.asarray(batch, dtype=np.int64))
+                batch = []
+                queued = 0
+        if batch:
+            out += self._solve_batch(np.asarray(batch, dtype=np.int64))
+        return out
+
+    def _layout(self, masks) -> Tuple["np.ndarray", ...]:
+        """Every split of ``masks`` as flat arrays: mask row, visit order, left, right, concrete right."""
+        if self.splits is not None:
+            rows, order, lefts, rights, ats = [], [], [], [], []
+            for row, mask in enumerate(masks.tolist()):
+                for j, (left, right, right_at) in enumerate(self.splits(mask)):
+                    rows.append(row)
+                    order.append(j)
+                    lefts.append(left)
+                    rights.append(right)
+                    ats.append(right_at)
+            return tuple(np.asarray(a, dtype=np.int64) for a in (rows, order, lefts, rights, ats))
+
+        # as ``_solve_mask``: ``left`` is the lowest bit plus every proper submask
+        # of the rest, the larger submasks first
+        low = masks & -masks
+        rest = masks ^ low
+        k = _popcount(int(masks[0])) - 1
+        nbits = int(masks.max()).bit_length()
+        bits = (rest[:, None] >> np.arange(nbits, dtype=np.int64)) & 1
+        positions = np.nonzero(bits)[1].reshape(len(masks), k)
+        count = (1 << k) - 1
+        picks = np.arange(count - 1, -1, -1, dtype=np.int64)
+        chosen = (picks[None, :, None] >> np.arange(k, dtype=np.int64)) & 1
+        sub = (chosen << positions[:, None, :]).sum(axis=2)
+        left = sub | low[:, None]
+        right = masks[:, None] ^ left
+        rows = np.repeat(np.arange(len(masks), dtype=np.int64), count)
+        order = np.tile(np.arange(count, dtype=np.int64), len(masks))
+        left = left.ravel()
+        right = right.ravel()
+        return rows, order, left, right, right
+
+    def _solve_batch(self, masks) -> List[Tuple[int, bool, int, int, _Found]]:
+        width = self.width
+        rows, order, left, right, right_at = self._layout(masks)
+        n_rows = len(masks)
+        moved = (right_at - right) * width
+        zero = np.zeros_like(moved)
+
+        # per split, direction 0 merges the right half into the left one and
+        # direction 1 the other way; a book only takes other books
+        tgt = np.stack((left, right), axis=1).ravel()
+        sac = np.stack((right, left), axis=1).ravel()
+        tmoved = np.stack((zero, moved), axis=1).ravel()
+        smoved = np.stack((moved, zero), axis=1).ravel()
+        per_tgt = self.filled[sac]
+        pairs = self.filled[tgt] * per_tgt
+        pairs[self.is_book[tgt] & ~self.is_book[sac]] = 0
+        # one candidate per filled target slot and filled sacrifice slot of each pair
+        pair = np.repeat(np.arange(len(tgt), dtype=np.int64), pairs)
+        offset = np.arange(len(pair), dtype=np.int64) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+        tpos, spos = np.divmod(offset, per_tgt[pair])
+        row = rows[pair >> 1]
+        tried = np.bincount(row, minlength=n_rows)
+
+        tw = self.uses[tgt[pair], tpos]
+        sw = self.uses[sac[pair], spos]
+        tslot = tgt[pair] * width + tw
+        sslot = sac[pair] * width + sw
+        cost = self.penalty[tslot] + self.penalty[sslot] + self.value[sslot]
+        cheap = cost <= self.limit
+        over_cap = np.bincount(row, weights=~cheap, minlength=n_rows)
+        total = self.lv[tslot] + self.lv[sslot] + cost
+        local = row * width + np.maximum(tw, sw) + 1
+        kept = total <= self.cut[masks[row] * width + local % width]
+        lost = np.bincount(row, weights=cheap & ~kept, minlength=n_rows) > 0
+        kept &= cheap
+
+        keep = np.flatnonzero(kept)
+        pair, row, local, tslot, sslot, cost, total = (
+            a[keep] for a in (pair, row, local, tslot, sslot, cost, total))
+        xp = self.xp[tslot] + self.xp[sslot] + self.xp_cost[cost]
+        # the order ``_solve_mask`` visits candidates in: split, direction, then fill order of each half
+        visit = ((order[pair >> 1] * 2 + (pair & 1)) * width + tpos[keep]) * width + spos[keep]
+
+        # a slot's uses are appended when it first gets a candidate; the winner is the
+        # cheapest (levels, xp), the first visited among equals
+        size = n_rows * width
+        first = np.full(size, _NONE, dtype=np.int64)
+        np.minimum.at(first, local, visit)
+        winner = np.arange(len(local))
+        for key in (total, xp, visit):
+            best = np.full(size, _NONE, dtype=np.int64)
+            np.minimum.at(best, local[winner], key[winner])
+            winner = winner[key[winner] == best[local[winner]]]
+
+        slots = local[winner]
+        ranked = np.lexsort((first[slots], slots // width))
+        winner = winner[ranked]
+        slots = slots[ranked].tolist()
+        tfinal = (tslot + tmoved[pair])[winner].tolist()
+        sfinal = (sslot + smoved[pair])[winner].tolist()
+        totals, xps, costs = total[winner].tolist(), xp[winner].tolist(), cost[winner].tolist()
+        found: List[_Found] = [[] for _ in range(n_rows)]
+        for i, slot in enumerate(slots):
+            found[slot // width].append((slot % width, totals[i], xps[i], tfinal[i], sfinal[i], costs[i]))
+        return [(mask, bool(lost[r]), int(tried[r]), int(over_cap[r]), found[r])
+                for r, mask in enumerate(masks.tolist())]
+
+
+def _popcount(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+def _split_count(mask: int) -> int:
+    """Unordered splits of a mask without symmetry classes."""
+    return (1 << (_popcount(mask) - 1)) - 1
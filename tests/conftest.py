@@ -0,0 +1,24 @@
+import pytest
+
+from enchantplanner import calculator
+from enchantplanner.models import DEFAULT_OPTIONS
+
+
+@pytest.fixture(autouse=True)
+def fresh_planner():
+    """Every test searches from cold caches, without the precomputed plan table."""
+    table = dict(calculator._TABLE)
+    calculator._TABLE.clear()
+    calculator.clear_caches()
+    yield
+    calculator._TABLE.update(table)
+    calculator.clear_caches()
+
+
+def replay(plan, options=DEFAULT_OPTIONS):
+    """Check every step of ``plan`` against ``EnchantedItem.merge`` and the totals against the steps."""
+    for step in plan.steps:
+        merged, cost_lv, cost_xp = step.left.merge(step.right, options=options)
+        assert (cost_lv, cost_xp, merged.prior_penalty()) == (step.cost_levels, step.cost_xp, step.result_prior)
+    assert plan.total_levels == sum(s.cost_levels for s in plan.steps)
+    assert plan.total_xp == sum(s.cost_xp for s in plan.steps)
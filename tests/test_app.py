@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+
+from app import create_app
+from enchantplanner import calculator, stats
+from enchantplanner.benchmark import enchant_pool
+
+BUDGET = 0.5
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config.update(TESTING=True, PLAN_TIME_BUDGET=BUDGET)
+    yield app.test_client()
+    stats.enable(False)
+    calculator.configure_heuristic()
+
+
+def _books(count):
+    """The first ``count`` book enchants; a Pareto front over 13 of them takes far longer than ``BUDGET``."""
+    return enchant_pool("book")[:count]
+
+
+@pytest.mark.parametrize("mode", ["pareto", "levels"])
+def test_calculate_returns_within_the_budget(client, mode):
+    form = {"item_type": "book", "mode": mode, "time_budget": "0.3", **{f"des-{ns}": "1" for ns in _books(13)}}
+    start = time.monotonic()
+    r = client.post("/calculate", data=form)
+    assert r.status_code == 200
+    assert time.monotonic() - start < 0.3 + 1.0
+
+
+def test_pareto_api_returns_within_the_budget_and_is_not_cached(client):
+    desired = ",".join(f"{ns}:1" for ns in sorted(_books(13)))
+    start = time.monotonic()
+    r = client.get(f"/api/plan?item_type=book&desired={desired}&mode=pareto", follow_redirects=True)
+    assert r.status_code == 200
+    assert time.monotonic() - start < BUDGET + 1.0
+    assert r.cache_control.no_store
+    assert all(calculator.NOT_PROVEN_OPTIMAL in plan["warnings"] for plan in r.get_json()["plans"])
+
+
+def test_plan_api_keeps_a_session_for_clients_that_ask(client):
+    url = "/api/plan?item_type=sword&desired=sharpness:5,unbreaking:3"
+    plain = client.get(url, follow_redirects=True)
+    assert "X-Plan-Token" not in plain.headers and plain.cache_control.public
+    first = client.get(url, headers={"X-Plan-Token": ""}, follow_redirects=True)
+    token = first.headers["X-Plan-Token"]
+    assert first.cache_control.private and "X-Plan-Token" in first.vary
+    edited = client.get(url.replace("unbreaking:3", "unbreaking:3,looting:3"), headers={"X-Plan-Token": token},
+                        follow_redirects=True)
+    assert edited.headers["X-Plan-Token"] == token
+
+
+@pytest.mark.parametrize("body", [[{"item_type": "sword"}], "requests", 3])
+def test_batch_refuses_a_body_that_is_not_an_object(client, body):
+    r = client.post("/api/plan/batch", json=body)
+    assert r.status_code == 400
+    assert r.get_json()["error"].startswith("Malformed request")
+
+
+def test_batch_streams_one_line_per_job(client):
+    jobs = [
+        {"item_type": "sword", "desired": {"sharpness": 5, "unbreaking": 3}},
+        {"item_type": "sword", "desired": {"sharpness": 5, "smite": 5}, "allow_incompat": "false"},
+        {"item_type": "boots", "desired": {"feather_falling": 4}, "allow_incompat": "no"},
+        {"desired": {"mending": 1}},
+        {"item_type": "pickaxe", "desired": {"efficiency": 5}, "allow_incompat": True},
+    ]
+    r = client.post("/api/plan/batch", json={"requests": jobs})
+    assert r.status_code == 200 and r.mimetype == "application/x-ndjson"
+    lines = {line["index"]: line for line in map(json.loads, r.get_data(as_text=True).splitlines())}
+    assert sorted(lines) == list(range(len(jobs)))
+    assert {i for i, line in lines.items() if "plan" in line} == {0, 4}
+    # "false" is false: the clash is refused, not allowed
+    assert "error" in lines[1] and "true or false" not in lines[1]["error"]
+    assert "true or false" in lines[2]["error"]
+    assert lines[3]["error"].startswith("Malformed request")
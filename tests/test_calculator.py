@@ -0,0 +1,173 @@
+import itertools
+import random
+from functools import lru_cache
+
+import pytest
+
+from enchantplanner import calculator
+from enchantplanner.benchmark import enchant_pool
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.catalog import CATALOG
+from enchantplanner.exceptions import InvalidTarget, MergeTooExpensive
+from enchantplanner.models import EnchantedItem, PlannerOptions
+from enchantplanner.precompute import item_types
+
+from conftest import replay
+
+
+def _maxed(item_type, count):
+    return {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in enchant_pool(item_type)[:count]}
+
+
+@lru_cache(maxsize=None)
+def _combinations_search(items):
+    """The planner's original search: every split of every tuple, best (levels, xp) per anvil uses."""
+    if len(items) == 1:
+        return {items[0].anvil_uses: (0, 0, items[0])}
+    best = {}
+    n = len(items)
+    for i in range(1, n):
+        for left_idx in itertools.combinations(range(n), i):
+            lefts = tuple(items[j] for j in left_idx)
+            rights = tuple(items[j] for j in range(n) if j not in left_idx)
+            for llv, lxp, litem in _combinations_search(lefts).values():
+                for rlv, rxp, ritem in _combinations_search(rights).values():
+                    try:
+                        merged, cost_lv, cost_xp = litem.merge(ritem)
+                    except (InvalidTarget, MergeTooExpensive):
+                        continue
+                    cand = (llv + rlv + cost_lv, lxp + rxp + cost_xp, merged)
+                    cur = best.get(merged.anvil_uses)
+                    if cur is None or cand[:2] < cur[:2]:
+                        best[merged.anvil_uses] = cand
+    return best
+
+
+def _reference(base, desired, mode):
+    books = tuple(EnchantedItem.book(ns, lv) for ns, lv in desired.items() if base.enchants.get(ns, 0) < lv)
+    solutions = _combinations_search((base,) + books)
+    if mode == "prior_work":
+        uses, (lv, xp, _) = min(solutions.items(), key=lambda s: (s[0], s[1][0], s[1][1]))
+    else:
+        uses, (lv, xp, _) = min(solutions.items(), key=lambda s: (s[1][0], s[0], s[1][1]))
+    return lv, xp, (1 << uses) - 1
+
+
+CASES = [
+    (EnchantedItem(item_type, {}, anvil_uses=uses), _maxed(item_type, count))
+    for item_type in ("sword", "boots", "bow", "book")
+    for count in range(1, 6)
+    for uses in (0, 3)
+] + [
+    # upgrades of enchants the base already has
+    (EnchantedItem("sword", {"sharpness": 3, "unbreaking": 3}, anvil_uses=1),
+     {"sharpness": 5, "unbreaking": 3, "looting": 3, "mending": 1}),
+    (EnchantedItem("book", {"protection": 2}), {"protection": 4, "unbreaking": 3, "mending": 1}),
+]
+
+
+@pytest.mark.parametrize("mode", ["levels", "prior_work"])
+@pytest.mark.parametrize("base,desired", CASES)
+def test_subset_dp_matches_combinations_search(base, desired, mode):
+    plan = plan_enchants(base, desired, mode=mode)
+    replay(plan)
+    assert (plan.total_levels, plan.total_xp, plan.final_prior_work) == _reference(base, desired, mode)
+
+
+@pytest.mark.parametrize("mode", ["levels", "prior_work"])
+@pytest.mark.parametrize("item_type,count,uses", [
+    ("boots", 7, 0), ("boots", 7, 2), ("sword", 7, 0), ("axe", 5, 3), ("helmet", 6, 0), ("book", 9, 0),
+])
+def test_symmetry_classes_give_the_same_plans(monkeypatch, item_type, count, uses, mode):
+    base = EnchantedItem(item_type, {}, anvil_uses=uses)
+    desired = _maxed(item_type, count)
+    books = tuple(EnchantedItem.book(ns, lv) for ns, lv in desired.items())
+    assert calculator._symmetry_classes((base,) + books, calculator.DEFAULT_OPTIONS) is not None
+
+    by_count = plan_enchants(base, desired, mode=mode)
+    calculator.clear_caches()
+    monkeypatch.setattr(calculator, "_symmetry_classes", lambda items, options: None)
+    by_identity = plan_enchants(base, desired, mode=mode)
+
+    replay(by_count)
+    assert (by_count.total_levels, by_count.total_xp, by_count.final_prior_work) == \
+           (by_identity.total_levels, by_identity.total_xp, by_identity.final_prior_work)
+
+
+def _random_request(rng):
+    item_type = rng.choice([t for t in item_types() + ["book"] if enchant_pool(t)])
+    pool = enchant_pool(item_type)
+    desired = {ns: rng.randint(1, CATALOG.level_max[CATALOG.ids[ns]])
+               for ns in rng.sample(pool, rng.randint(1, min(7, len(pool))))}
+    current = {ns: rng.randint(1, lv - 1) for ns, lv in desired.items() if lv > 1 and rng.random() < 0.3}
+    base = EnchantedItem(item_type, current, anvil_uses=rng.randint(0, 3))
+    return base, desired, rng.choice(["levels", "prior_work"]), PlannerOptions(max_merge_levels=rng.choice([25, 39, 60]))
+
+
+def _outcome(base, desired, mode, options, bounded):
+    calculator.clear_caches()
+    try:
+        plan = plan_enchants(base, desired, mode=mode, options=options, bounded=bounded)
+    except RuntimeError as e:
+        return str(e)
+    replay(plan, options)
+    return plan.total_levels, plan.total_xp, plan.final_prior_work
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_bounded_search_gives_the_same_plans(seed):
+    base, desired, mode, options = _random_request(random.Random(seed))
+    assert _outcome(base, desired, mode, options, True) == _outcome(base, desired, mode, options, False)
+
+
+@pytest.mark.parametrize("engine", ["dp", "shapes", "heuristic"])
+def test_too_worked_base_is_refused_before_searching(engine):
+    # 2**6 - 1 = 63 levels of penalty alone is past the default limit of 39
+    base = EnchantedItem("sword", {}, anvil_uses=12000)
+    with pytest.raises(MergeTooExpensive):
+        plan_enchants(base, _maxed("sword", 7), engine=engine)
+
+
+@pytest.mark.parametrize("uses,error", [(-1, ValueError), (6, MergeTooExpensive), (True, ValueError)])
+def test_prior_work_is_validated(uses, error):
+    with pytest.raises(error):
+        EnchantedItem.from_state("sword", {}, anvil_uses=uses)
+
+
+def test_front_out_of_time_is_warned_and_not_cached():
+    base, desired = EnchantedItem("book", {}), _maxed("book", 13)
+    front = calculator.plan_front(base, desired, time_budget=0.2)
+    assert front and all(calculator.NOT_PROVEN_OPTIMAL in plan.warnings for plan in front)
+    for plan in front:
+        replay(plan)
+    assert calculator.cache_stats()["fronts"].entries == 0
+
+
+def test_incremental_replan_matches_a_cold_plan():
+    base = EnchantedItem("sword", {})
+    desired = _maxed("sword", 7)
+    _, token = calculator.plan_incremental(base, desired)
+    # edit one book: one level lower
+    ns = max(desired, key=desired.get)
+    edited = dict(desired, **{ns: desired[ns] - 1})
+    plan, again = calculator.plan_incremental(base, edited, token)
+    assert again == token
+    calculator.clear_caches()
+    cold = plan_enchants(base, edited)
+    assert (plan.total_levels, plan.total_xp, plan.final_prior_work) == \
+        (cold.total_levels, cold.total_xp, cold.final_prior_work)
+
+
+def test_unknown_session_token_starts_a_new_session():
+    base, desired = EnchantedItem("sword", {}), _maxed("sword", 5)
+    plan, token = calculator.plan_incremental(base, desired, "no-such-session")
+    assert token != "no-such-session"
+    assert plan.total_levels == plan_enchants(base, desired).total_levels
+    # a session evicted from the table is unknown too
+    calculator.configure_caches(session_entries=0)
+    try:
+        plan, fresh = calculator.plan_incremental(base, desired, token)
+    finally:
+        calculator.configure_caches()
+    assert fresh != token
+    assert plan.total_levels == plan_enchants(base, desired).total_levels
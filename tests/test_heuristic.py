@@ -0,0 +1,47 @@
+import pytest
+
+from enchantplanner import calculator, heuristic
+from enchantplanner.benchmark import enchant_pool
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.catalog import CATALOG
+from enchantplanner.models import EnchantedItem, PlannerOptions
+
+from conftest import replay
+
+
+def _maxed(item_type, count):
+    return {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in enchant_pool(item_type)[:count]}
+
+
+@pytest.mark.parametrize("limit", [25, 39, 1000])
+@pytest.mark.parametrize("base", [
+    EnchantedItem("book", {}),
+    # already holds lower levels of two of the enchants it is given
+    EnchantedItem("book", {"blast_protection": 2, "efficiency": 3}, 1),
+    EnchantedItem("sword", {"smite": 3, "looting": 1}, 2),
+])
+def test_lower_bound_is_below_the_optimum(base, limit):
+    desired = _maxed(base.item_type, 7)
+    options = PlannerOptions(max_merge_levels=limit)
+    try:
+        exact = plan_enchants(base, desired, options=options)
+    except RuntimeError:
+        pytest.skip("nothing fits the limit")
+    books = calculator.missing_books(base, desired)
+    assert heuristic.lower_bound(base, books, limit) <= exact.total_levels
+    calculator.clear_caches()
+    plan = plan_enchants(base, desired, options=options, engine="heuristic")
+    replay(plan, options)
+    assert plan.lower_bound <= exact.total_levels <= plan.total_levels
+
+
+def test_heuristic_gets_many_books_under_a_tight_limit():
+    options = PlannerOptions(max_merge_levels=39)
+    base = EnchantedItem("book", {})
+    exact = plan_enchants(base, _maxed("book", 18), options=options, engine="shapes")
+    calculator.clear_caches()
+    plan = plan_enchants(base, _maxed("book", 18), options=options, engine="heuristic")
+    replay(plan, options)
+    assert (plan.total_levels, plan.final_prior_work) == (exact.total_levels, exact.final_prior_work)
+    # past what the beam search alone gets under the limit
+    replay(plan_enchants(base, _maxed("book", 20), options=options, engine="heuristic"), options)
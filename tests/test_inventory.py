@@ -0,0 +1,124 @@
+from functools import lru_cache
+import random
+
+import pytest
+
+from enchantplanner.exceptions import IncompatibleSelected, InvalidTarget, MergeTooExpensive
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.inventory import TOO_MANY_PLANS, plan_inventory
+from enchantplanner.models import EnchantedItem
+
+from conftest import replay
+
+
+def book(uses=0, **enchants):
+    return EnchantedItem("book", enchants, anvil_uses=uses)
+
+
+def _brute_force(base, desired, inventory, mode):
+    """Best (levels, prior work, xp) over every subset of ``inventory`` and every merge tree over it."""
+    items = (base,) + tuple(inventory)
+
+    @lru_cache(maxsize=None)
+    def results(mask):
+        # every item a merge tree over ``mask`` can make, at its cheapest (levels, xp)
+        members = [i for i in range(len(items)) if mask >> i & 1]
+        if len(members) == 1:
+            return {items[members[0]]: (0, 0)}
+        out = {}
+        sub = (mask - 1) & mask
+        while sub:
+            for left, right in ((sub, mask ^ sub), (mask ^ sub, sub)):
+                for litem, (llv, lxp) in results(left).items():
+                    for ritem, (rlv, rxp) in results(right).items():
+                        try:
+                            merged, cost_lv, cost_xp = litem.merge(ritem)
+                        except (InvalidTarget, MergeTooExpensive, IncompatibleSelected):
+                            continue
+                        cand = (llv + rlv + cost_lv, lxp + rxp + cost_xp)
+                        if merged not in out or cand < out[merged]:
+                            out[merged] = cand
+            sub = (sub - 1) & mask
+        return out
+
+    best = None
+    for mask in range(1, 1 << len(items), 2):
+        for item, (lv, xp) in results(mask).items():
+            if item.item_type != base.item_type or any(item.enchants.get(ns, 0) < lv_ for ns, lv_ in desired.items()):
+                continue
+            rank = (item.anvil_uses, lv, xp) if mode == "prior_work" else (lv, item.anvil_uses, xp)
+            if best is None or rank < best[0]:
+                best = (rank, (lv, item.prior_penalty(), xp))
+    return None if best is None else best[1]
+
+
+CASES = [
+    (EnchantedItem("sword", {}), {"sharpness": 5, "unbreaking": 3},
+     [book(sharpness=4), book(sharpness=4), book(unbreaking=3), book(unbreaking=2), book(mending=1)]),
+    (EnchantedItem("pickaxe", {"efficiency": 3}, anvil_uses=1), {"efficiency": 5, "fortune": 3},
+     [book(efficiency=4, unbreaking=3), book(efficiency=4), book(fortune=3), book(fortune=2), book(fortune=2)]),
+    (EnchantedItem("boots", {}), {"protection": 4, "feather_falling": 4, "mending": 1},
+     [book(protection=3), book(protection=3), book(uses=1, feather_falling=4), book(mending=1),
+      EnchantedItem("boots", {"protection": 4}, anvil_uses=2)]),
+]
+
+
+@pytest.mark.parametrize("mode", ["levels", "prior_work"])
+@pytest.mark.parametrize("base,desired,inventory", CASES)
+def test_inventory_plans_match_brute_force(base, desired, inventory, mode):
+    plan, unused = plan_inventory(base, desired, inventory, mode=mode)
+    replay(plan)
+    assert (plan.total_levels, plan.final_prior_work, plan.total_xp) == _brute_force(base, desired, inventory, mode)
+    # the plan merges in exactly the owned items it does not leave out
+    assert len(plan.steps) == len(inventory) - len(unused)
+    assert all(it in inventory for it in unused)
+
+
+def test_unreachable_target_is_refused():
+    with pytest.raises(ValueError):
+        plan_inventory(EnchantedItem("sword", {}), {"looting": 3}, [book(looting=1), book(looting=1)])
+
+
+SWORD = {"sharpness": 5, "unbreaking": 3, "mending": 1, "looting": 3, "fire_aspect": 2, "sweeping": 3,
+         "knockback": 2}
+
+
+def _sword_books(seed, count):
+    rng = random.Random(seed)
+    books = []
+    while len(books) < count:
+        if rng.random() < 0.2:
+            books.append(book(**{ns: rng.randint(1, SWORD[ns]) for ns in rng.sample(list(SWORD), 2)}))
+        else:
+            ns = rng.choice(list(SWORD))
+            books.append(book(**{ns: rng.randint(max(1, SWORD[ns] - 2), SWORD[ns])}))
+    return books
+
+
+def test_large_inventory_gets_a_plan_without_a_time_budget():
+    inventory = _sword_books(5, 23)
+    plan, unused = plan_inventory(EnchantedItem("sword", {}), SWORD, inventory, time_budget=None)
+    replay(plan)
+    assert len(plan.steps) == len(inventory) - len(unused)
+
+
+def test_uncovered_enchant_is_refused_before_searching():
+    inventory = [it for it in _sword_books(2, 40) if "sharpness" not in it.enchants][:23]
+    with pytest.raises(ValueError, match="Sharpness"):
+        plan_inventory(EnchantedItem("sword", {}), SWORD, inventory, time_budget=None)
+
+
+def test_varied_inventory_gets_a_plan():
+    # 24 distinct books, too many sub-multisets to search them all
+    inventory = [book(**{ns: lv}) for ns, lv in SWORD.items()]
+    inventory += [book(sharpness=lv) for lv in range(1, 5)] + [book(unbreaking=lv) for lv in (1, 2)]
+    inventory += [book(looting=lv) for lv in (1, 2)] + [book(sweeping=lv) for lv in (1, 2)]
+    inventory += [book(fire_aspect=1), book(knockback=1), book(sharpness=1, looting=1),
+                  book(sharpness=2, unbreaking=1), book(looting=1, knockback=1), book(fire_aspect=1, sweeping=1),
+                  book(unbreaking=1, mending=1)]
+    assert len(set(inventory)) == 24
+    plan, unused = plan_inventory(EnchantedItem("sword", {}), SWORD, inventory, time_budget=None)
+    replay(plan)
+    assert plan.warnings == [TOO_MANY_PLANS]
+    # no worse than buying the seven maxed books
+    assert plan.total_levels <= plan_enchants(EnchantedItem("sword", {}), SWORD).total_levels
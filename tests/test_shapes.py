@@ -0,0 +1,36 @@
+import pytest
+
+from enchantplanner import benchmark, calculator, shapes
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.models import EnchantedItem, PlannerOptions
+
+from conftest import replay
+
+
+def test_shapes_agree_with_dp_on_benchmark_corpus():
+    problems = benchmark.differential(["sword", "boots", "helmet", "bow", "trident", "book"], 10, [0, 3], "shapes")
+    assert problems == []
+
+
+@pytest.mark.parametrize("limit", [20, 25, 1000])
+@pytest.mark.parametrize("count", [6, 9])
+def test_shapes_agree_with_dp_at_other_limits(limit, count):
+    desired = {ns: 3 if ns == "unbreaking" else 1 for ns in benchmark.enchant_pool("book")[:count]}
+    options = PlannerOptions(max_merge_levels=limit)
+    base = EnchantedItem("book", {})
+    found = []
+    for engine in ("dp", "shapes"):
+        calculator.clear_caches()
+        try:
+            plan = plan_enchants(base, desired, options=options, engine=engine)
+        except RuntimeError as e:
+            found.append(str(e))
+            continue
+        replay(plan, options)
+        found.append((plan.total_levels, plan.final_prior_work))
+    assert found[0] == found[1]
+
+
+def test_min_tree_penalty_of_balanced_trees():
+    # the root is never merged again: three leaves pay for one inner merge, four for two
+    assert [shapes.min_tree_penalty(k) for k in (1, 2, 3, 4)] == [0, 0, 1, 2]
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from enchantplanner import calculator
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.models import EnchantedItem
+from enchantplanner.singleflight import SingleFlight
+
+CALLERS = 8
+
+
+def _run_together(target):
+    """Results (or exceptions) of ``target()`` called from ``CALLERS`` threads at once."""
+    results = [None] * CALLERS
+
+    def call(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(CALLERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def _slow(release, runs, outcome):
+    """A computation that counts its runs and holds on until ``release`` is set."""
+    def fn():
+        runs.append(1)
+        release.wait()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return fn
+
+
+def _released_later(release):
+    # long enough for every caller to join the flight
+    threading.Timer(0.2, release.set).start()
+
+
+def test_callers_of_one_key_share_one_computation():
+    flight, release, runs = SingleFlight(), threading.Event(), []
+    fn = _slow(release, runs, object())
+    _released_later(release)
+    results = _run_together(lambda: flight.do("k", fn))
+    assert len(runs) == 1
+    assert len({id(value) for value, _ in results}) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * (CALLERS - 1)
+    assert flight.in_flight() == 0
+
+
+def test_leader_error_reaches_every_caller_and_frees_the_key():
+    flight, release, runs = SingleFlight(), threading.Event(), []
+    error = RuntimeError("search failed")
+    _released_later(release)
+    results = _run_together(lambda: flight.do("k", _slow(release, runs, error)))
+    assert len(runs) == 1
+    assert all(r is error for r in results)
+    assert flight.in_flight() == 0
+    # the next call for the key computes again
+    assert flight.do("k", lambda: 42) == (42, False)
+
+
+def test_identical_plan_requests_search_once(monkeypatch):
+    searches = []
+    search = calculator._plan_uncached
+
+    def counted(*args, **kwargs):
+        searches.append(1)
+        time.sleep(0.2)
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(calculator, "_plan_uncached", counted)
+    base, desired = EnchantedItem("sword", {}), {"sharpness": 5, "unbreaking": 3, "looting": 3}
+    plans = _run_together(lambda: plan_enchants(base, desired))
+    assert len(searches) == 1
+    assert all(plan is plans[0] for plan in plans)
+
+
+def test_identical_plan_requests_share_an_error(monkeypatch):
+    def failing(*args, **kwargs):
+        time.sleep(0.2)
+        raise RuntimeError("No valid anvil order found—cost too high.")
+
+    monkeypatch.setattr(calculator, "_plan_uncached", failing)
+    results = _run_together(lambda: plan_enchants(EnchantedItem("sword", {}), {"sharpness": 5}))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert calculator._FLIGHTS.in_flight() == 0
+    monkeypatch.undo()
+    assert plan_enchants(EnchantedItem("sword", {}), {"sharpness": 5}).total_levels > 0
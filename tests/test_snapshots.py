@@ -0,0 +1,99 @@
+"""
+Reference plans for a fixed corpus, recorded in ``snapshots/plans.json``.
+
+Every search change (symmetry classes, bounding, the NumPy layer kernel)
+must keep these plans step for step.  After a deliberate change of plans or
+of the enchant data, rewrite the file with
+``PYTHONPATH=. python tests/test_snapshots.py``.
+"""
+import hashlib
+import json
+import os
+
+import pytest
+
+from enchantplanner import calculator
+from enchantplanner.benchmark import enchant_pool
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.catalog import CATALOG
+from enchantplanner.models import EnchantedItem
+from enchantplanner.precompute import MODES, item_types
+from enchantplanner.utils import data_version
+
+SNAPSHOTS = os.path.join(os.path.dirname(__file__), "snapshots", "plans.json")
+MAX_BOOKS = 5
+
+
+def _cases():
+    """(name, base, desired, mode): up to ``MAX_BOOKS`` maxed books per item type, fresh, worked and upgraded."""
+    for item_type in item_types() + ["book"]:
+        pool = enchant_pool(item_type)
+        top = {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in pool}
+        for count in range(1, min(MAX_BOOKS, len(pool)) + 1):
+            desired = {ns: top[ns] for ns in pool[:count]}
+            bases = [EnchantedItem(item_type, {}, anvil_uses=uses) for uses in (0, 2)]
+            if count > 1 and top[pool[0]] > 1:
+                bases.append(EnchantedItem(item_type, {pool[0]: top[pool[0]] - 1}, anvil_uses=1))
+            for base in bases:
+                for mode in MODES:
+                    current = ",".join(f"{ns}:{lv}" for ns, lv in sorted(base.enchants.items()))
+                    yield f"{item_type} books={count} uses={base.anvil_uses} current={current} {mode}", \
+                        base, desired, mode
+
+
+def _outcome(base, desired, mode):
+    """Totals and a digest of the steps, or the error's type."""
+    try:
+        plan = plan_enchants(base, desired, mode=mode)
+    except (RuntimeError, ValueError) as e:
+        return type(e).__name__
+    steps = "\n".join(str(s) for s in plan.steps)
+    return [plan.total_levels, plan.total_xp, plan.final_prior_work, hashlib.sha256(steps.encode()).hexdigest()[:16]]
+
+
+def _snapshot():
+    with open(SNAPSHOTS, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    recorded = _snapshot()
+    assert recorded["data_version"] == data_version(), "enchant data changed; rewrite the snapshots"
+    return recorded["plans"]
+
+
+def _check(snapshot):
+    seen = []
+    for name, base, desired, mode in _cases():
+        calculator.clear_caches()
+        assert _outcome(base, desired, mode) == snapshot[name], name
+        seen.append(name)
+    assert sorted(seen) == sorted(snapshot)
+
+
+def test_plans_match_the_snapshots(snapshot):
+    _check(snapshot)
+
+
+def test_layer_kernel_plans_match_the_snapshots(snapshot):
+    pytest.importorskip("numpy")
+    calculator.configure_vectorized(True, min_items=2)
+    try:
+        _check(snapshot)
+    finally:
+        calculator.configure_vectorized(False)
+
+
+if __name__ == "__main__":
+    calculator._TABLE.clear()
+    plans = {}
+    for name, base, desired, mode in _cases():
+        calculator.clear_caches()
+        plans[name] = _outcome(base, desired, mode)
+    os.makedirs(os.path.dirname(SNAPSHOTS), exist_ok=True)
+    with open(SNAPSHOTS, "w", encoding="utf-8") as fh:
+        # one plan per line, so a change shows up as a readable diff
+        lines = [f"  {json.dumps(name)}: {json.dumps(plans[name])}" for name in sorted(plans)]
+        fh.write(f'{{"data_version": {json.dumps(data_version())}, "plans": {{\n' + ",\n".join(lines) + "\n}}\n")
+    print(f"wrote {len(plans)} plans to {SNAPSHOTS}")
@@ -0,0 +1,111 @@
+import multiprocessing
+import sqlite3
+import threading
+import zlib
+
+import pytest
+
+from enchantplanner import singleflight
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.models import EnchantedItem
+from enchantplanner.store import STORE_FORMAT, PlanStore
+
+
+def _plan(**desired):
+    return plan_enchants(EnchantedItem("sword", {}), desired or {"sharpness": 5, "unbreaking": 3, "mending": 1})
+
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT version, key FROM plans").fetchall()
+
+
+def test_round_trip(tmp_path):
+    store = PlanStore(str(tmp_path / "plans.db"))
+    plan = _plan()
+    assert store.get("k") is None
+    store.put("k", plan)
+    assert store.get("k") == plan
+    # the first write wins
+    store.put("k", _plan(looting=3))
+    assert store.get("k") == plan
+    stats = store.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (2, 1, 1)
+
+
+def test_reopened_store_keeps_its_plans_and_drops_other_versions(tmp_path):
+    path = str(tmp_path / "plans.db")
+    store = PlanStore(path)
+    plan = _plan()
+    store.put("k", plan)
+    store.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO plans VALUES ('old-data', 'k', ?)", (b"",))
+    reopened = PlanStore(path)
+    assert reopened.get("k") == plan
+    assert _rows(path) == [(reopened.version, "k")]
+
+
+def test_store_of_an_old_format_starts_empty(tmp_path):
+    path = str(tmp_path / "plans.db")
+    store = PlanStore(path)
+    store.put("k", _plan())
+    store.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"PRAGMA user_version={STORE_FORMAT - 1}")
+    reopened = PlanStore(path)
+    assert reopened.get("k") is None
+    assert reopened.errors == 0
+
+
+@pytest.mark.parametrize("blob", [b"not zlib", zlib.compress(b"not json"), zlib.compress(b'{"steps": 1}')])
+def test_corrupt_row_misses(tmp_path, blob):
+    path = str(tmp_path / "plans.db")
+    store = PlanStore(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO plans VALUES (?, 'k', ?)", (store.version, blob))
+    assert store.get("k") is None
+    assert store.errors == 1
+    # planning goes on: the next lookup of another key works
+    store.put("other", _plan())
+    assert store.get("other") is not None
+
+
+def test_threads_write_through_their_own_connections(tmp_path):
+    store = PlanStore(str(tmp_path / "plans.db"))
+    plan = _plan()
+    threads = [threading.Thread(target=store.put, args=(f"k{i}", plan)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(store.get(f"k{i}") == plan for i in range(8))
+    assert store.errors == 0
+
+
+def _worker(path, locks, log):
+    # what calculator._kept does: behind the key's lock, read the store or plan and write
+    store = PlanStore(path)
+    with singleflight.HostLock(locks).hold("k"):
+        plan = store.get("k")
+        if plan is None:
+            plan = _plan()
+            with open(log, "a") as f:
+                f.write("searched\n")
+            store.put("k", plan)
+    assert plan.total_levels == _plan().total_levels
+
+
+@pytest.mark.skipif(not singleflight.available(), reason="needs fcntl")
+def test_concurrent_workers_search_once_through_the_host_lock(tmp_path):
+    path, locks, log = str(tmp_path / "plans.db"), str(tmp_path / "locks"), str(tmp_path / "log")
+    PlanStore(path)
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_worker, args=(path, locks, log)) for _ in range(6)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert [w.exitcode for w in workers] == [0] * 6
+    with open(log) as f:
+        assert f.read().count("searched") == 1
@@ -0,0 +1,34 @@
+import pytest
+
+from enchantplanner import calculator
+from enchantplanner.benchmark import enchant_pool
+from enchantplanner.calculator import plan_enchants
+from enchantplanner.catalog import CATALOG
+from enchantplanner.models import EnchantedItem, PlannerOptions
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def vectorized():
+    yield lambda: calculator.configure_vectorized(True, min_items=2)
+    calculator.configure_vectorized(False)
+
+
+CASES = [
+    (EnchantedItem(item_type, {}, anvil_uses=uses), count, options)
+    for item_type, count in (("sword", 7), ("boots", 7), ("bow", 5), ("book", 10))
+    for uses in (0, 3)
+    for options in (PlannerOptions(), PlannerOptions(max_merge_levels=1000))
+] + [(EnchantedItem("sword", {"smite": 4, "unbreaking": 1}, anvil_uses=1), 7, PlannerOptions())]
+
+
+@pytest.mark.parametrize("mode", ["levels", "prior_work"])
+@pytest.mark.parametrize("base,count,options", CASES)
+def test_layer_kernel_gives_identical_plans(vectorized, base, count, options, mode):
+    desired = {ns: CATALOG.level_max[CATALOG.ids[ns]] for ns in enchant_pool(base.item_type)[:count]}
+    loop = plan_enchants(base, desired, mode=mode, options=options)
+    calculator.clear_caches()
+    vectorized()
+    kernel = plan_enchants(base, desired, mode=mode, options=options)
+    assert kernel == loop